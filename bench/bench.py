@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lexer
+import parser
+import semantic
+import optimizer
+import compiler
+import bytecode
+import vmio
+import mlvm
+import generate
+
+############################################
+#               Benchmarks
+############################################
+
+# run  - generates every workload, times each compiler stage and the VM
+#        engines on it (best of --repeat runs) and writes the metrics as JSON
+# compare - checks the metrics of a run against a stored baseline and fails
+#        when one regressed by more than the threshold
+#
+# Metrics are flat 'workload.name' keys. Stage times are seconds, lower is
+# better; 'workload.vm.<engine>' is executed VM instructions per second,
+# higher is better.
+
+# workload: size at --scale 1
+SIZES = {'expr': 200, 'stmts': 20000, 'loops': 2000, 'write': 100000}
+
+STAGES = ['lexer', 'parser', 'semantic', 'optimizer', 'compiler']
+
+def clock(timings, stage, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    timings[stage] = min(timings.get(stage, float('inf')), time.perf_counter() - start)
+    return result
+
+def compile_text(text, timings):
+    tokens = clock(timings, 'lexer', lambda: list(lexer.tokenize(text)))
+    if lexer.errors:
+        raise ValueError(lexer.errors.strip())
+    parser.init_tokens(lexer.numbers, lexer.ids, tokens)
+    program = clock(timings, 'parser', parser.run)
+    if not program:
+        raise ValueError('syntax error')
+    semantic.init_ast(parser.numbers, parser.ids, program)
+    clock(timings, 'semantic', semantic.semantic)
+    if semantic.errors:
+        raise ValueError(semantic.errors.strip())
+    semantic.init_values()
+    clock(timings, 'optimizer', optimizer.optimize, program.args[1], parser.numbers, semantic.decls)
+    compiler.init_ast(parser.numbers, parser.ids, semantic.decls, program.args[1])
+    clock(timings, 'compiler', compiler.compile_program)
+    compiler.optimize_program()
+    return bytecode.dumps(compiler.slot_types, compiler.slot_names, compiler.consts, compiler.program)
+
+# Returns the number of instructions executed and the best time per engine
+def run_vm(image, engines, repeat):
+    mlvm.types, mlvm.names, mlvm.consts, mlvm.program, mlvm.stack_size = bytecode.loads(image)
+    times = {}
+    with open(os.devnull, 'w') as sink:
+        mlvm.output = vmio.Output(sink)
+        mlvm.reader = vmio.Input.from_values([])
+        mlvm.init_values()
+        count = mlvm.run_counted()
+        mlvm.output.flush()
+        for engine in engines:
+            for i in range(repeat):
+                mlvm.init_values()
+                clock(times, engine, mlvm.engines[engine])
+                mlvm.output.flush()
+    return count, times
+
+def bench(scale, repeat, engines, selected):
+    metrics = {}
+    workloads = {}
+    for kind in selected:
+        size = max(int(SIZES[kind] * scale), 1)
+        text = generate.generate(kind, size)
+        timings = {}
+        try:
+            for i in range(repeat):
+                image = compile_text(text, timings)
+            count, times = run_vm(image, engines, repeat)
+        except (ValueError, RecursionError) as error:
+            print('FAIL  ' + kind + '  ' + (str(error) or type(error).__name__))
+            workloads[kind] = {'size': size, 'error': str(error) or type(error).__name__}
+            continue
+        workloads[kind] = {'size': size, 'lines': text.count('\n'), 'instructions': count}
+        line = 'ok    ' + kind.ljust(6) + ' size ' + str(size)
+        for stage in STAGES:
+            metrics[kind + '.' + stage] = timings[stage]
+            line += '  ' + stage + ' ' + format(timings[stage], '.3f') + 's'
+        for engine in engines:
+            metrics[kind + '.vm.' + engine] = count / max(times[engine], 1e-9)
+            line += '  ' + engine + ' ' + format(metrics[kind + '.vm.' + engine] / 1e6, '.2f') + 'M ips'
+        print(line)
+    return {'python': platform.python_version(),
+            'machine': platform.machine(),
+            'scale': scale,
+            'repeat': repeat,
+            'workloads': workloads,
+            'metrics': metrics}
+
+def higher_is_better(name):
+    return '.vm.' in name
+
+# Seconds the metric measured, for rates from the instruction count
+def seconds(results, name):
+    value = results['metrics'][name]
+    if not higher_is_better(name):
+        return value
+    count = results['workloads'].get(name.split('.')[0], {}).get('instructions', 0)
+    return count / value if value else 0.0
+
+# Prints every metric found in both runs, returns the regressed ones.
+# Measurements shorter than min_time are shown but too noisy to fail.
+def compare(baseline, current, threshold, min_time):
+    regressions = []
+    for name in sorted(baseline['metrics']):
+        if name not in current['metrics']:
+            print('      ' + name.ljust(24) + ' missing')
+            continue
+        old = baseline['metrics'][name]
+        new = current['metrics'][name]
+        if higher_is_better(name):
+            change = old / new - 1 if new else float('inf')
+        else:
+            change = new / old - 1 if old else 0.0
+        # change > 0 is a slowdown
+        regressed = change > threshold and max(seconds(baseline, name), seconds(current, name)) >= min_time
+        if regressed:
+            regressions.append(name)
+        print(('SLOW  ' if regressed else 'ok    ') + name.ljust(24) +
+              format(old, '14.6g') + format(new, '14.6g') + format(-change * 100, '+9.1f') + '%')
+    return regressions
+
+def load_results(filename):
+    try:
+        with open(filename, 'r') as handle:
+            results = json.load(handle)
+    except (OSError, ValueError) as error:
+        print('Error: cannot read results \'' + filename + '\': ' + str(error))
+        sys.exit(1)
+    if 'metrics' not in results:
+        print('Error: \'' + filename + '\' holds no benchmark results')
+        sys.exit(1)
+    return results
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description = 'Model language compiler and VM benchmarks')
+    commands = argparser.add_subparsers(dest = 'command', required = True)
+
+    run_command = commands.add_parser('run', help = 'run the benchmarks')
+    run_command.add_argument('-o', '--output', metavar = 'FILE', help = 'write the results to FILE')
+    run_command.add_argument('--scale', type = float, default = 1.0,
+                             help = 'multiply the workload sizes (default 1)')
+    run_command.add_argument('--repeat', type = int, default = 3, metavar = 'N',
+                             help = 'keep the best of N runs (default 3)')
+    run_command.add_argument('--engines', default = 'loop,table,jit', metavar = 'LIST',
+                             help = 'VM engines to time (default loop,table,jit)')
+    run_command.add_argument('--workloads', default = ','.join(SIZES), metavar = 'LIST',
+                             help = 'workloads to run (default ' + ','.join(SIZES) + ')')
+
+    compare_command = commands.add_parser('compare', help = 'compare results against a baseline')
+    compare_command.add_argument('baseline')
+    compare_command.add_argument('current')
+    compare_command.add_argument('--threshold', type = float, default = 10, metavar = 'PERCENT',
+                                 help = 'allowed slowdown per metric (default 10%%)')
+    compare_command.add_argument('--min-time', type = float, default = 0.005, metavar = 'SECONDS',
+                                 help = 'never fail on metrics measured in less time (default 0.005)')
+    args = argparser.parse_args()
+
+    if args.command == 'run':
+        engines = [name for name in args.engines.split(',') if name]
+        selected = [name for name in args.workloads.split(',') if name]
+        for name in engines:
+            if name not in mlvm.engines:
+                print('Error: unknown engine \'' + name + '\'')
+                sys.exit(1)
+        for name in selected:
+            if name not in SIZES:
+                print('Error: unknown workload \'' + name + '\'')
+                sys.exit(1)
+        results = bench(args.scale, max(args.repeat, 1), engines, selected)
+        if args.output:
+            with open(args.output, 'w') as handle:
+                json.dump(results, handle, indent = 2, sort_keys = True)
+                handle.write('\n')
+    else:
+        regressions = compare(load_results(args.baseline), load_results(args.current),
+                              args.threshold / 100, args.min_time)
+        if regressions:
+            print(str(len(regressions)) + ' regressed by more than ' + format(args.threshold, 'g') + '%: ' +
+                  ', '.join(regressions))
+            sys.exit(1)
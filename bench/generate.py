@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import sys
+import argparse
+
+############################################
+#          Synthetic Workloads
+############################################
+
+# Each generator returns the source of a model language program whose cost
+# grows with size:
+#   expr   - expressions nested size levels deep (front end, recursion)
+#   stmts  - size statements in a flat list (front end, code size)
+#   loops  - nested for/while loops running about 100 * size iterations (VM)
+#   write  - a loop writing 3 * size values (VM output)
+
+def deep_expr(size):
+    lines = ['program var int a, b float x bool c', 'begin', 'a ass 1; b ass 2; x ass 0.5; c ass true;']
+    ops = ['+', '-', '*']
+    operands = ['b', '1', '1']
+    e = 'a'
+    for i in range(size):
+        e = '(' + e + ' ' + ops[i % 3] + ' ' + operands[i % 3] + ')'
+    lines.append('a ass ' + e + ';')
+    e = 'x'
+    for i in range(size):
+        e = '(' + e + ' ' + ops[i % 3] + ' 0.5)'
+    lines.append('x ass ' + e + ';')
+    e = 'c'
+    for i in range(size):
+        e = '(' + e + (' and ' if i % 2 else ' or ') + '(a < ' + str(i) + '))'
+    lines.append('c ass ' + e + ';')
+    lines.append('write(a, x, c);')
+    lines.append('end.')
+    return '\n'.join(lines) + '\n'
+
+def long_stmts(size):
+    lines = ['program var int i, s, t float x bool b', 'begin', 's ass 0; t ass 1; x ass 1.5; b ass false;']
+    for i in range(size):
+        kind = i % 4
+        if kind == 0:
+            lines.append('s ass s + ' + str(i) + ' * 3 - t;')
+        elif kind == 1:
+            lines.append('x ass x * 1.0001 + s / 7;')
+        elif kind == 2:
+            lines.append('if s > ' + str(i) + ' then t ass t + 1 else b ass not b;')
+        else:
+            lines.append('t ass (t * 0 + ' + str(i) + ') * 5 - 2;')
+        if i % 64 == 63:
+            lines.append('write(s, t, x, b);')
+    lines.append('write(s, t, x, b);')
+    lines.append('end.')
+    return '\n'.join(lines) + '\n'
+
+def nested_loops(size):
+    return '\n'.join([
+        'program var int i, j, k, n, s float x',
+        'begin',
+        's ass 0; k ass 0; n ass ' + str(size) + '; x ass 0;',
+        'for i ass 0 to n do for j ass 0 to 100 do s ass s + i * j - k;',
+        'while k < n do k ass k + 1 : x ass x + k / 2;',
+        'i ass 0;',
+        'while (i < n) and (s > 0) do i ass i + 1 : s ass s - i;',
+        'write(s, k, x);',
+        'end.']) + '\n'
+
+def heavy_write(size):
+    return '\n'.join([
+        'program var int i, n',
+        'begin',
+        'n ass ' + str(size) + ';',
+        'for i ass 0 to n do write(i, i * 0.5, i < 7);',
+        'end.']) + '\n'
+
+workloads = {'expr':  deep_expr,
+             'stmts': long_stmts,
+             'loops': nested_loops,
+             'write': heavy_write}
+
+def generate(kind, size):
+    return workloads[kind](size)
+
+if __name__ == '__main__':
+    argparser = argparse.ArgumentParser(description = 'Generate a synthetic model language program')
+    argparser.add_argument('kind', choices = sorted(workloads))
+    argparser.add_argument('size', type = int)
+    argparser.add_argument('-o', '--output', metavar = 'FILE', help = 'write the program to FILE instead of stdout')
+    args = argparser.parse_args()
+
+    text = generate(args.kind, args.size)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            handle.write(text)
+    else:
+        sys.stdout.write(text)
@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import sys
+import io
+import mmap
+import struct
+import bisect
+from array import array
+
+from mlctypes import OPNAMES, OPERANDS, STORE_B, PUSH, TEE, READ_I, READ_B, FORPREP, FORLOOP,\
+                    JMP, HALT, STACK_EFFECT, JUMPS, KEEP_JUMPS
+
+############################################
+#            Program File Format
+############################################
+
+# header:    magic, version, flags, constants count, variables count, code size,
+#            stack size (the deepest the operand stack gets, see max_depth)
+# constants: tag byte + value (int64, double, bool or decimal text of a big int)
+# variables: one per slot, type (byte), name length (uint16), name (utf-8)
+# code:      4-byte aligned, code size little-endian int32 words
+# lines:     present if flags has FLAG_LINES, byte size (uint32) and the
+#            pc -> source line table (see pack_lines)
+
+MAGIC   = b'MLVM'
+VERSION = 6
+
+FLAG_LINES = 1
+
+HEADER   = struct.Struct('<4sHHIIII')
+VARIABLE = struct.Struct('<BH')
+
+CONST_INT, CONST_FLOAT, CONST_BOOL, CONST_BIGINT = range(4)
+
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+def pack_const(value):
+    if type(value) is bool:
+        return struct.pack('<BB', CONST_BOOL, value)
+    if type(value) is float:
+        return struct.pack('<Bd', CONST_FLOAT, value)
+    if INT_MIN <= value <= INT_MAX:
+        return struct.pack('<Bq', CONST_INT, value)
+    text = str(value).encode('ascii')
+    return struct.pack('<BI', CONST_BIGINT, len(text)) + text
+
+# types, names: per variable slot, consts: PUSH operands, code: list of ints,
+# lines: source line of every code word or None
+def dumps(types, names, consts, code, lines = None):
+    flags = FLAG_LINES if lines is not None else 0
+    chunks = [HEADER.pack(MAGIC, VERSION, flags, len(consts), len(types), len(code), max_depth(code))]
+    for value in consts:
+        chunks.append(pack_const(value))
+    for kind, name in zip(types, names):
+        name = name.encode('utf-8')
+        chunks.append(VARIABLE.pack(kind, len(name)) + name)
+
+    size = sum(len(chunk) for chunk in chunks)
+    chunks.append(b'\0' * (-size % 4))
+
+    code = array('i', code)
+    if sys.byteorder != 'little':
+        code.byteswap()
+    chunks.append(code.tobytes())
+    if lines is not None:
+        table = pack_lines(line_table(code, lines))
+        chunks.append(struct.pack('<I', len(table)) + table)
+    return b''.join(chunks)
+
+def dump(filename, types, names, consts, code, lines = None):
+    with open(filename, 'wb') as handle:
+        handle.write(dumps(types, names, consts, code, lines))
+
+# Parses a program image, the code section is returned as an int32 view
+# into buffer without copying it. The line table is left alone, see
+# loads_lines.
+# Returns (types, names, consts, code, stack size), types and names are per
+# slot.
+def loads(buffer):
+    return read_image(buffer)[:5]
+
+# Returns (types, names, consts, code, stack size, flags, offset after the
+# code)
+def read_image(buffer):
+    view = memoryview(buffer)
+    if len(view) < 6:
+        raise ValueError('not an mlvm program')
+    magic, version = struct.unpack_from('<4sH', view, 0)
+    if magic != MAGIC:
+        raise ValueError('not an mlvm program')
+    if version != VERSION:
+        raise ValueError('unsupported program version ' + str(version))
+    if len(view) < HEADER.size:
+        raise ValueError('truncated program')
+    magic, version, flags, nconsts, nvars, ncode, stack = HEADER.unpack_from(view, 0)
+    offset = HEADER.size
+
+    consts = []
+    for i in range(nconsts):
+        if len(view) < offset + 1:
+            raise ValueError('truncated program')
+        tag = view[offset]
+        offset += 1
+        # the value, or the text length of a big int
+        size = 1 if tag == CONST_BOOL else 4 if tag == CONST_BIGINT else 8
+        if len(view) < offset + size:
+            raise ValueError('truncated program')
+        if tag == CONST_INT:
+            consts.append(struct.unpack_from('<q', view, offset)[0])
+            offset += 8
+        elif tag == CONST_FLOAT:
+            consts.append(struct.unpack_from('<d', view, offset)[0])
+            offset += 8
+        elif tag == CONST_BOOL:
+            consts.append(bool(view[offset]))
+            offset += 1
+        else:
+            size = struct.unpack_from('<I', view, offset)[0]
+            offset += 4
+            if len(view) < offset + size:
+                raise ValueError('truncated program')
+            consts.append(int(bytes(view[offset:offset + size])))
+            offset += size
+
+    types = []
+    names = []
+    for i in range(nvars):
+        if len(view) < offset + VARIABLE.size:
+            raise ValueError('truncated program')
+        kind, size = VARIABLE.unpack_from(view, offset)
+        offset += VARIABLE.size
+        if len(view) < offset + size:
+            raise ValueError('truncated program')
+        types.append(kind)
+        names.append(bytes(view[offset:offset + size]).decode('utf-8'))
+        offset += size
+
+    offset += -offset % 4
+    if len(view) < offset + ncode * 4:
+        raise ValueError('truncated program')
+    code = view[offset:offset + ncode * 4]
+    if sys.byteorder != 'little':
+        code = array('i', code)
+        code.byteswap()
+        code = memoryview(code)
+    return types, names, consts, code.cast('i'), stack, flags, offset + ncode * 4
+
+# Maps the program file into memory, the code is executed straight from
+# the mapping.
+def load(filename):
+    with open(filename, 'rb') as handle:
+        try:
+            buffer = mmap.mmap(handle.fileno(), 0, access = mmap.ACCESS_READ)
+        except ValueError:
+            raise ValueError('not an mlvm program')
+    return loads(buffer)
+
+############################################
+#               Stack Depth
+############################################
+
+# Follows every path through the code from pc 0 with the depth of the
+# operand stack on entry to each instruction. The compiler keeps the depth
+# the same on all paths to an instruction. JFALSE_OR_POP and JTRUE_OR_POP
+# keep their value when they jump.
+def max_depth(code):
+    depth = {0: 0}
+    deepest = 0
+    work = [0]
+    while work:
+        pc = work.pop()
+        op = code[pc]
+        after = depth[pc] + STACK_EFFECT[op]
+        if after > deepest:
+            deepest = after
+        follow = pc + 1 + OPERANDS[op]
+        if op in JUMPS:
+            target = code[follow - 1]
+            if target not in depth:
+                depth[target] = after + 1 if op in KEEP_JUMPS else after
+                work.append(target)
+        if op != JMP and op != HALT and follow < len(code) and follow not in depth:
+            depth[follow] = after
+            work.append(follow)
+    return deepest
+
+############################################
+#               Line Table
+############################################
+
+# The table lists (pc, line) wherever the source line changes between
+# instructions, in pc order; an instruction has the line of the last entry
+# at or before it. In the file every entry is the pc delta and the zigzag
+# coded line delta to the previous one (starting from 0, 0) as unsigned
+# LEB128 varints, a couple of bytes per source line. It is only read when
+# a line is asked for, loading a program does not look at it.
+
+def line_table(code, lines):
+    table = []
+    last = None
+    pc = 0
+    while pc < len(code):
+        if lines[pc] != last:
+            last = lines[pc]
+            table.append((pc, last))
+        pc += 1 + OPERANDS[code[pc]]
+    return table
+
+def pack_varint(chunks, value):
+    while value > 0x7f:
+        chunks.append(0x80 | (value & 0x7f))
+        value >>= 7
+    chunks.append(value)
+
+def pack_lines(table):
+    data = bytearray()
+    last_pc = last_line = 0
+    for pc, line in table:
+        delta = line - last_line
+        pack_varint(data, pc - last_pc)
+        pack_varint(data, delta << 1 if delta >= 0 else (-delta << 1) - 1)
+        last_pc, last_line = pc, line
+    return bytes(data)
+
+def unpack_lines(data):
+    numbers = []
+    value = shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            numbers.append(value)
+            value = shift = 0
+    table = []
+    pc = line = 0
+    for i in range(0, len(numbers) - 1, 2):
+        delta = numbers[i + 1]
+        pc += numbers[i]
+        line += delta >> 1 if not delta & 1 else -((delta + 1) >> 1)
+        table.append((pc, line))
+    return table
+
+# Returns the line table of a program image, empty if it has none
+def loads_lines(buffer):
+    flags, offset = read_image(buffer)[5:]
+    if not flags & FLAG_LINES:
+        return []
+    view = memoryview(buffer)
+    if len(view) < offset + 4:
+        raise ValueError('truncated program')
+    size = struct.unpack_from('<I', view, offset)[0]
+    if len(view) < offset + 4 + size:
+        raise ValueError('truncated program')
+    return unpack_lines(view[offset + 4:offset + 4 + size])
+
+def load_lines(filename):
+    with open(filename, 'rb') as handle:
+        return loads_lines(handle.read())
+
+# Source line of the instruction at pc, None if the table does not cover it
+def line_at(table, pc):
+    if pc is None:
+        return None
+    i = bisect.bisect_right(table, (pc, float('inf')))
+    return table[i - 1][1] if i else None
+
+############################################
+#              Disassembler
+############################################
+
+# The .S listing format: 'pc<tab>OP' or 'pc:operand pc<tab>OP<tab>operand',
+# slot operands are shown by variable name, PUSH by constant value.
+# FORPREP/FORLOOP show their first slot and the jump target as two operands.
+
+def operand_to_string(op, operand, names, consts):
+    if op <= STORE_B or op == TEE or READ_I <= op <= READ_B or op == FORPREP or op == FORLOOP:
+        return names[operand]
+    if op == PUSH:
+        return str(consts[operand])
+    return str(operand)
+
+def instruction_to_string(code, pc, names, consts):
+    op = code[pc]
+    if OPERANDS[op] > 1:
+        return str(pc) + ':' + str(pc + 1) + '\t' + OPNAMES[op] + '\t' + \
+               operand_to_string(op, code[pc + 1], names, consts) + '\t' + str(code[pc + 2])
+    if OPERANDS[op]:
+        return str(pc) + ':' + str(pc + 1) + '\t' + OPNAMES[op] + '\t' + \
+               operand_to_string(op, code[pc + 1], names, consts)
+    return str(pc) + '\t' + OPNAMES[op]
+
+# Yields (pc, text) for every instruction of the program
+def disassemble(code, names, consts):
+    pc = 0
+    while pc < len(code):
+        yield pc, instruction_to_string(code, pc, names, consts)
+        pc += 1 + OPERANDS[code[pc]]
+
+# Writes the whole listing to handle, with a '; line N' row where the line
+# table starts a new source line
+def write_listing(handle, code, names, consts, table = ()):
+    starts = dict(table)
+    for pc, text in disassemble(code, names, consts):
+        if pc in starts:
+            handle.write('; line ' + str(starts[pc]) + '\n')
+        handle.write(text + '\n')
+
+def listing(code, names, consts, table = ()):
+    text = io.StringIO()
+    write_listing(text, code, names, consts, table)
+    return text.getvalue()
@@ -0,0 +1,120 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import gc
+import hashlib
+import pickle
+
+############################################
+#              Build Cache
+############################################
+
+# Stage results are pickled into directory/<key>.<stage>, the key is a
+# hash of everything the result depends on. A hit refreshes the file mtime,
+# evict() removes the least recently used files once the directory grows
+# past the size limit. Files are written to a temporary name and renamed,
+# so parallel compilers never see a partial entry. The garbage collector is
+# paused while pickling, an AST is many small objects and the collections
+# triggered by allocating them would dominate the time.
+
+LIMIT = 64 << 20
+
+# None disables the cache
+directory = None
+limit = LIMIT
+# {stage: [hits, misses]}
+counts = {}
+
+def init(cache_directory, size_limit = LIMIT):
+    global directory, limit, counts
+    directory = cache_directory
+    limit = size_limit
+    counts = {}
+    os.makedirs(directory, exist_ok = True)
+
+def key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+def path(entry, stage):
+    return os.path.join(directory, entry + '.' + stage)
+
+def count(stage, hit):
+    counts.setdefault(stage, [0, 0])[0 if hit else 1] += 1
+
+# Returns the stored value or None
+def load(entry, stage):
+    filename = path(entry, stage)
+    collect = gc.isenabled()
+    gc.disable()
+    try:
+        with open(filename, 'rb') as handle:
+            value = pickle.load(handle)
+    except FileNotFoundError:
+        count(stage, False)
+        return None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        # damaged or written by an incompatible version
+        remove(filename)
+        count(stage, False)
+        return None
+    finally:
+        if collect:
+            gc.enable()
+    try:
+        os.utime(filename)
+    except OSError:
+        pass
+    count(stage, True)
+    return value
+
+def store(entry, stage, value):
+    filename = path(entry, stage)
+    temporary = filename + '.' + str(os.getpid()) + '.tmp'
+    collect = gc.isenabled()
+    gc.disable()
+    try:
+        with open(temporary, 'wb') as handle:
+            pickle.dump(value, handle, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, filename)
+    except (OSError, pickle.PicklingError, RecursionError):
+        remove(temporary)
+    finally:
+        if collect:
+            gc.enable()
+
+def remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+def evict():
+    files = []
+    total = 0
+    with os.scandir(directory) as entries:
+        for item in entries:
+            if item.name.endswith('.tmp'):
+                continue
+            try:
+                info = item.stat()
+            except OSError:
+                # removed by another compiler meanwhile
+                continue
+            files.append((info.st_mtime, info.st_size, item.path))
+            total += info.st_size
+    if total <= limit:
+        return
+    files.sort()
+    for mtime, size, filename in files:
+        remove(filename)
+        total -= size
+        if total <= limit:
+            break
@@ -6,11 +6,15 @@ import sys
 import os
 import pickle
 
+import bytecode
+import peephole
+import mlctypes
 from mlctypes import NodeAST
 from mlctypes import Token
-
-FETCH, STORE, PUSH, POP, ADD, SUB, MUL, DIV, JL, JG, JLE, JGE, JE, JNE, JMP, CMP, HALT,\
-WRITE, READ, AND, OR, NOT = range(22)
+from mlctypes import FETCH_I, FETCH_F, FETCH_B, STORE_I, STORE_F, STORE_B, PUSH, POP, ADD, SUB, MUL, DIV,\
+                     JNE, JMP, CMP, HALT, WRITE, AND, OR, NOT, TOINT, TOFLOAT,\
+                     JLT_POP, JGT_POP, JLE_POP, JGE_POP, JEQ_POP, JNE_POP,\
+                     READ_I, READ_F, READ_B, JFALSE, JTRUE, JFALSE_OR_POP, JTRUE_OR_POP, FORPREP, FORLOOP
 
 ast = None
 decls = None
@@ -18,260 +22,444 @@ ids = None
 numbers = None
 pc = 0
 program = []
+# Source line of every program word, the line of the leaf node (id, number
+# or operator) compiled last; composite nodes carry the line the parser was
+# at when they were completed, which may already be a later statement
+line = 0
+lines = []
+# PUSH operands are indices in the constant pool
+consts = []
+consts_index = {}
+# Variables live in dense slots: {id index: slot}, slot types and names
+slots = {}
+slot_types = []
+slot_names = []
+# Hidden slots of the for loops (counter, limit, loop variable), shared by
+# the loops that cannot run at the same time:
+# {(nesting depth, id index, limit type): first slot}
+for_slots = {}
+for_depth = 0
 
 TABLE_KEYWORD   = 1
 TABLE_SEPARATOR = 2
 TABLE_NUMBER    = 3
 TABLE_ID        = 4
 
+# relational operator: (jump if true, jump if false)
+RELATIONS = {Token.LESS:       (JLT_POP, JGE_POP),
+             Token.GREAT:      (JGT_POP, JLE_POP),
+             Token.LESSEQUAL:  (JLE_POP, JGT_POP),
+             Token.GREATEQUAL: (JGE_POP, JLT_POP),
+             Token.EQUAL:      (JEQ_POP, JNE_POP),
+             Token.NOTEQUAL:   (JNE_POP, JEQ_POP)}
+
 def add_command(command):
     global progam, pc
     program.append(command)
+    lines.append(line)
     pc += 1
 
-def compile_ast(ast):
-    if ast.kind == NodeAST.NUMBER:
-        add_command(PUSH)
-        add_command(numbers[ast.args[0]])
+# Equal values of different types (1, 1.0, True) get separate entries, the
+# repr keeps 0.0 and -0.0 apart
+def add_const(value):
+    key = (type(value), repr(value))
+    index = consts_index.get(key)
+    if index is None:
+        index = len(consts)
+        consts_index[key] = index
+        consts.append(value)
+    return index
 
-    elif ast.kind == NodeAST.ID:
-        add_command(FETCH)
-        add_command(ast.args[0])
+def init_slots():
+    global slots, slot_types, slot_names, for_slots, for_depth
+    slots = {}
+    slot_types = []
+    slot_names = []
+    for_slots = {}
+    for_depth = 0
+    for index, values in decls.items():
+        slots[index] = len(slot_types)
+        slot_types.append(values[0])
+        slot_names.append(ids[index])
 
-    elif ast.kind == NodeAST.BOOL:
-        add_command(PUSH)
-        if ast.args[0] == Token.TRUE:
-            add_command(True)
-        else:
-            add_command(False)
-
-    elif ast.kind == NodeAST.OP:
-        if ast.args[0] == TABLE_SEPARATOR:
-            if ast.args[1] == Token.PLUS:
-                add_command(ADD)
-            elif ast.args[1] == Token.MINUS:
-                add_command(SUB)
-            elif ast.args[1] == Token.DIV:
-                add_command(DIV)
-            elif ast.args[1] == Token.MUL:
-                add_command(MUL)
-            else:
-                add_command(CMP)
-                if ast.args[1] == Token.LESS:
-                    add_command(JGE)
-                elif ast.args[1] == Token.GREAT:
-                    add_command(JLE)
-                elif ast.args[1] == Token.LESSEQUAL:
-                    add_command(JG)
-                elif ast.args[1] == Token.GREATEQUAL:
-                    add_command(JL)
-                elif ast.args[1] == Token.EQUAL:
-                    add_command(JNE)
-                elif ast.args[1] == Token.NOTEQUAL:
-                    add_command(JE)
-                add_command(pc + 7)
-                add_command(POP)
-                add_command(POP)
-                add_command(PUSH)
-                add_command(True)
-                add_command(JMP)
-                add_command(pc + 5)
-                add_command(POP)
-                add_command(POP)
-                add_command(PUSH)
-                add_command(False)
-        else:
-            if ast.args[1] == Token.AND:
-                add_command(AND)
-            elif ast.args[1] == Token.OR:
-                add_command(OR)
-            elif ast.args[1] == Token.NOT:
-                add_command(NOT)
-
-    elif ast.kind == NodeAST.EXPR:
-        compile_ast(ast.args[1])
-        if ast.args[2]:
-            compile_ast(ast.args[2])
-        compile_ast(ast.args[0])
-
-    elif ast.kind == NodeAST.ASS:
-        compile_ast(ast.args[1])
-        add_command(STORE)
-        add_command(ast.args[0].args[0])
-
-    elif ast.kind == NodeAST.WRITE:
-        for e in ast.args:
-            compile_ast(e)
-            add_command(WRITE)
-
-    elif ast.kind == NodeAST.READ:
-        for i in ast.args:
-            compile_ast(i)
-            add_command(READ)
-
-    elif ast.kind == NodeAST.IF:
-        compile_ast(ast.args[0])
+def add_for_slots(index, limit):
+    key = (for_depth, index, limit)
+    base = for_slots.get(key)
+    if base is None:
+        base = for_slots[key] = len(slot_types)
+        slot_types.extend([decls[index][0], limit, decls[index][0]])
+        slot_names.extend(['(for ' + ids[index] + ')', '(for limit)', ids[index]])
+    return base
+
+def add_fetch(index):
+    kind = decls[index][0]
+    if kind == Token.INT:
+        add_command(FETCH_I)
+    elif kind == Token.FLOAT:
+        add_command(FETCH_F)
+    else:
+        add_command(FETCH_B)
+    add_command(slots[index])
+
+def add_store(index):
+    kind = decls[index][0]
+    if kind == Token.INT:
+        add_command(STORE_I)
+    elif kind == Token.FLOAT:
+        add_command(STORE_F)
+    else:
+        add_command(STORE_B)
+    add_command(slots[index])
+
+def add_read(index):
+    kind = decls[index][0]
+    if kind == Token.INT:
+        add_command(READ_I)
+    elif kind == Token.FLOAT:
+        add_command(READ_F)
+    else:
+        add_command(READ_B)
+    add_command(slots[index])
+
+def is_relation(ast):
+    return ast.kind == NodeAST.EXPR and ast.args[0].args[0] == TABLE_SEPARATOR and \
+           ast.args[0].args[1] in RELATIONS
+
+def is_not(ast):
+    return ast.kind == NodeAST.EXPR and ast.args[0].args[0] == TABLE_KEYWORD and \
+           ast.args[0].args[1] == Token.NOT
+
+# 'and'/'or', possibly under 'not's: compiled with jumps that skip the right
+# operand once the left one decides the result
+def is_logical(ast):
+    while is_not(ast):
+        ast = ast.args[1]
+    return ast.kind == NodeAST.EXPR and ast.args[0].args[0] == TABLE_KEYWORD
+
+def patch(addrs, target):
+    for addr in addrs:
+        program[addr] = target
+
+# Compiles a condition followed by a jump taken when it is false, a relation
+# branches directly on its operands and 'and'/'or' branch on each operand.
+# Returns the addresses of the jump operands to patch with the target.
+def compile_condition(cond):
+    if is_logical(cond):
+        return compile_branch(cond, False)
+    if is_relation(cond):
+        compile_expr(cond.args[1])
+        compile_expr(cond.args[2])
+        add_command(RELATIONS[cond.args[0].args[1]][1])
+    else:
+        compile_expr(cond)
         add_command(PUSH)
-        add_command(True)
+        add_command(add_const(True))
         add_command(CMP)
         add_command(POP)
         add_command(POP)
         add_command(JNE)
+    addr = pc
+    add_command(0)
+    return [addr]
 
-        addr = pc
+# Compiles jumps taken when cond is sense (True/False), the code falls
+# through otherwise. 'a and b' jumps on false if either operand is false;
+# to jump on true the left operand jumps past the right one when it is
+# false. 'or' is the same with true and false swapped, 'not' swaps them.
+# The work list holds (operand, sense, list of its jump addresses) and the
+# lists of jumps to patch with the current address.
+# Returns the addresses of the jump operands to patch with the target.
+def compile_branch(cond, sense):
+    jumps = []
+    work = [(cond, sense, jumps)]
+    while work:
+        item = work.pop()
+        if type(item) is list:
+            patch(item, pc)
+            continue
+        node, sense, targets = item
+        while is_not(node):
+            node = node.args[1]
+            sense = not sense
+        if node.kind == NodeAST.EXPR and node.args[0].args[0] == TABLE_KEYWORD:
+            if (node.args[0].args[1] == Token.AND) != sense:
+                work.append((node.args[2], sense, targets))
+                work.append((node.args[1], sense, targets))
+            else:
+                skip = []
+                work.append(skip)
+                work.append((node.args[2], sense, targets))
+                work.append((node.args[1], not sense, skip))
+            continue
+        if is_relation(node):
+            compile_expr(node.args[1])
+            compile_expr(node.args[2])
+            add_command(RELATIONS[node.args[0].args[1]][0 if sense else 1])
+        else:
+            compile_expr(node)
+            add_command(JTRUE if sense else JFALSE)
+        targets.append(pc)
         add_command(0)
-        
-        compile_ast(ast.args[1])
-        program[addr] = pc
-        if ast.args[2]:
-            program[addr] += 2
-            add_command(JMP)
-            addr = pc
-            add_command(0)
-            compile_ast(ast.args[2])
-            program[addr] = pc
-
-    elif ast.kind == NodeAST.FOR:
-        compile_ast(ast.args[0])
-        compile_ast(ast.args[1])
-        compile_ast(ast.args[0].args[0])
-        add_command(CMP)
-        add_command(JLE)
-        addr = pc
+    return jumps
+
+# The value of an 'and'/'or' expression: the left operand stays on the stack
+# as the result if it decides it, otherwise it is popped and the right
+# operand is the result. Right operands are followed in a loop, the 'not's
+# and jumps along them are finished in reverse.
+def compile_logical(ast):
+    global line
+    pending = []
+    while is_logical(ast):
+        op = ast.args[0]
+        if op.args[1] == Token.NOT:
+            pending.append(op)
+            ast = ast.args[1]
+            continue
+        compile_expr(ast.args[1])
+        line = op.line
+        add_command(JFALSE_OR_POP if op.args[1] == Token.AND else JTRUE_OR_POP)
+        pending.append(pc)
         add_command(0)
-        compile_ast(ast.args[2])
-        add_command(PUSH)
-        add_command(1)
-        add_command(ADD)
-        add_command(STORE)
-        add_command(ast.args[0].args[0].args[0])
-        add_command(JMP)
-        add_command(addr - 4)
-        program[addr] = pc
-        add_command(POP)
-        add_command(POP)
+        ast = ast.args[2]
+    compile_expr(ast)
+    while pending:
+        item = pending.pop()
+        if type(item) is int:
+            program[item] = pc
+        else:
+            line = item.line
+            add_command(NOT)
+    return Token.BOOL
 
-    elif ast.kind == NodeAST.WHILE:
-        begin = pc
-        compile_ast(ast.args[0])
-        add_command(PUSH)
-        add_command(True)
-        add_command(CMP)
-        add_command(POP)
-        add_command(POP)
-        add_command(JNE)
+# Expression handlers return the type of the value the expression leaves on
+# the VM stack. Unlike ast.type it accounts for '/' always producing a float
+# and ignores the target type that semantic assigns to the right side of a
+# mixed assignment.
+def compile_number(ast):
+    global line
+    line = ast.line
+    add_command(PUSH)
+    add_command(add_const(numbers[ast.args[0]]))
+    if type(numbers[ast.args[0]]) is float:
+        return Token.FLOAT
+    return Token.INT
+
+def compile_id(ast):
+    global line
+    line = ast.line
+    add_fetch(ast.args[0])
+    return decls[ast.args[0]][0]
+
+def compile_bool(ast):
+    global line
+    line = ast.line
+    add_command(PUSH)
+    if ast.args[0] == Token.TRUE:
+        add_command(add_const(True))
+    else:
+        add_command(add_const(False))
+    return Token.BOOL
+
+def compile_op(ast):
+    global line
+    line = ast.line
+    if ast.args[0] == TABLE_SEPARATOR:
+        if ast.args[1] == Token.PLUS:
+            add_command(ADD)
+        elif ast.args[1] == Token.MINUS:
+            add_command(SUB)
+        elif ast.args[1] == Token.DIV:
+            add_command(DIV)
+        elif ast.args[1] == Token.MUL:
+            add_command(MUL)
+        else:
+            add_command(RELATIONS[ast.args[1]][0])
+            add_command(pc + 5)
+            add_command(PUSH)
+            add_command(add_const(False))
+            add_command(JMP)
+            add_command(pc + 3)
+            add_command(PUSH)
+            add_command(add_const(True))
+    else:
+        if ast.args[1] == Token.AND:
+            add_command(AND)
+        elif ast.args[1] == Token.OR:
+            add_command(OR)
+        elif ast.args[1] == Token.NOT:
+            add_command(NOT)
+
+def compile_operation(ast, ltype, rtype):
+    compile_op(ast.args[0])
+
+    op = ast.args[0]
+    if op.args[0] == TABLE_KEYWORD:
+        return Token.BOOL
+    if op.args[1] == Token.DIV:
+        return Token.FLOAT
+    if op.args[1] == Token.PLUS or op.args[1] == Token.MINUS or op.args[1] == Token.MUL:
+        if ltype == Token.FLOAT or rtype == Token.FLOAT:
+            return Token.FLOAT
+        return Token.INT
+    return Token.BOOL
+
+def compile_ass(ast):
+    global line
+    rtype = compile_expr(ast.args[1])
+    kind = decls[ast.args[0].args[0]][0]
+    if kind == Token.INT and rtype == Token.FLOAT:
+        add_command(TOINT)
+    elif kind == Token.FLOAT and rtype == Token.INT:
+        add_command(TOFLOAT)
+    line = ast.args[0].line
+    add_store(ast.args[0].args[0])
 
+def compile_write(ast):
+    for e in ast.args:
+        compile_expr(e)
+        add_command(WRITE)
+
+def compile_read(ast):
+    global line
+    for i in ast.args:
+        line = i.line
+        add_read(i.args[0])
+
+def compile_if(ast):
+    jumps = compile_condition(ast.args[0])
+    yield ast.args[1]
+    if ast.args[2]:
+        add_command(JMP)
         addr = pc
         add_command(0)
-        compile_ast(ast.args[1])
-        add_command(JMP)
-        add_command(begin)
+        patch(jumps, pc)
+        yield ast.args[2]
         program[addr] = pc
+    else:
+        patch(jumps, pc)
+
+# The body sees the loop variable in the last hidden slot, so assignments
+# to it do not change the counter; when the loop ends the counter is stored
+# to the variable.
+def compile_for(ast):
+    global line, for_depth
+    yield ast.args[0]
+    index = ast.args[0].args[0].args[0]
+    base = add_for_slots(index, compile_expr(ast.args[1]))
+    compile_expr(ast.args[0].args[0])
+    add_command(FORPREP)
+    add_command(base)
+    addr = pc
+    add_command(0)
+    outer = slots[index]
+    slots[index] = base + 2
+    for_depth += 1
+    yield ast.args[2]
+    for_depth -= 1
+    line = ast.args[0].args[0].line
+    add_command(FORLOOP)
+    add_command(base)
+    add_command(addr + 1)
+    program[addr] = pc
+    slots[index] = base
+    add_fetch(index)
+    slots[index] = outer
+    add_store(index)
+
+def compile_while(ast):
+    begin = pc
+    jumps = compile_condition(ast.args[0])
+    yield ast.args[1]
+    add_command(JMP)
+    add_command(begin)
+    patch(jumps, pc)
+
+def compile_stmt_seq(ast):
+    for stmt in ast.args:
+        yield stmt
+
+expr_compilers = {NodeAST.NUMBER: compile_number,
+                  NodeAST.ID:     compile_id,
+                  NodeAST.BOOL:   compile_bool,
+                  NodeAST.EXPR:   compile_operation}
+
+compilers = {NodeAST.ASS:      compile_ass,
+             NodeAST.WRITE:    compile_write,
+             NodeAST.READ:     compile_read,
+             NodeAST.IF:       compile_if,
+             NodeAST.FOR:      compile_for,
+             NodeAST.WHILE:    compile_while,
+             NodeAST.STMT_SEQ: compile_stmt_seq}
+
+# Returns the type of the value the expression leaves on the VM stack.
+# 'and'/'or' under other operators ('=' and '<>' of booleans) evaluate both
+# operands.
+def compile_expr(ast):
+    if is_logical(ast):
+        return compile_logical(ast)
+    return mlctypes.evaluate(ast, expr_compilers)
+
+def compile_ast(ast):
+    mlctypes.walk(ast, compilers)
 
-    elif ast.kind == NodeAST.STMT_SEQ:
-        for stmt in ast.args:
-            compile_ast(stmt)
+def init_ast(parser_numbers, lexer_ids, semantic_decls, stmts):
+    global ids, numbers, ast, decls, program, pc, consts, consts_index, line, lines
+    numbers = parser_numbers
+    ids = lexer_ids
+    decls = semantic_decls
+    ast = stmts
+    program = []
+    lines = []
+    line = 0
+    pc = 0
+    consts = []
+    consts_index = {}
+    init_slots()
 
 def init(lexer_filename, semantic_filename):
-    global ids, numbers, ast, decls
     with open(semantic_filename, 'rb') as handle:
-        numbers, decls, ast = pickle.load(handle)
+        parser_numbers, semantic_decls, stmts = pickle.load(handle)
     with open(lexer_filename, 'r') as handle:
         handle.readline()
-        ids = handle.readline().split()
+        lexer_ids = handle.readline().split()
+    init_ast(parser_numbers, lexer_ids, semantic_decls, stmts)
+
+def compile_program():
+    for item in ast:
+        compile_ast(item)
+    add_command(HALT)
+
+# Runs the peephole rules over the compiled program, returns their stats
+def optimize_program(disabled = ()):
+    global program, lines
+    program, lines, stats = peephole.optimize(program, lines, consts, disabled)
+    return stats
+
+def write_program(program_filename):
+    bytecode.dump(program_filename, slot_types, slot_names, consts, program, lines)
+
+# The listing has a '; line N' row wherever the source line changes
+def write_listing(listing_filename):
+    with open(listing_filename, 'w') as handle:
+        bytecode.write_listing(handle, program, slot_names, consts, bytecode.line_table(program, lines))
+
 
 if __name__ == '__main__':
     if len(sys.argv) != 4:
         print('compiler: Error: Required input files.')
         sys.exit(1)
-    else:
-        lexer_filename = sys.argv[1]
-        semantic_filename = sys.argv[2]
-        program_filename = sys.argv[3]
-        if not os.path.isfile(semantic_filename):
-            print('compiler: Error: File \'' + semantic_filename + '\' is not exist.')
-            sys.exit(1)
-        if not os.path.isfile(lexer_filename):
-            print('compiler: Error: File \'' + lexer_filename + '\' is not exist.')
-            sys.exit(1)
-
-        init(lexer_filename, semantic_filename)
-        for item in ast:
-            compile_ast(item)
-        program.append(HALT)
-
-    with open(program_filename, 'wb') as handle:
-        pickle.dump([decls, program], handle)
-
-    with open(program_filename + '.S', 'w') as handle:
-        i = 0
-        while i < len(program):
-            if program[i] == FETCH:
-                handle.write(str(i) + ':' + str(i + 1) + '\tFETCH\t' + ids[program[i + 1]] + '\n')
-                i += 2
-            elif program[i] == STORE:
-                handle.write(str(i) + ':' + str(i + 1) + '\tSTORE\t' + ids[program[i + 1]] + '\n')
-                i += 2
-            elif program[i] == PUSH:
-                handle.write(str(i) + ':' + str(i + 1) + '\tPUSH\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == POP:
-                handle.write(str(i) + '\tPOP' + '\n')
-                i += 1
-            elif program[i] == ADD:
-                handle.write(str(i) + '\tADD' + '\n')
-                i += 1
-            elif program[i] == SUB:
-                handle.write(str(i) + '\tSUB' + '\n')
-                i += 1
-            elif program[i] == MUL:
-                handle.write(str(i) + '\tMUL' + '\n')
-                i += 1
-            elif program[i] == DIV:
-                handle.write(str(i) + '\tDIV' + '\n')
-                i += 1
-            elif program[i] == NOT:
-                handle.write(str(i) + '\tNOT' + '\n')
-                i += 1
-            elif program[i] == AND:
-                handle.write(str(i) + '\tAND' + '\n')
-                i += 1
-            elif program[i] == OR:
-                handle.write(str(i) + '\tOR' + '\n')
-                i += 1
-            elif program[i] == JL:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJL\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JG:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJG\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JLE:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJLE\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JGE:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJGE\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JE:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJE\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JNE:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJNE\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == JMP:
-                handle.write(str(i) + ':' + str(i + 1) + '\tJMP\t' + str(program[i + 1]) + '\n')
-                i += 2
-            elif program[i] == CMP:
-                handle.write(str(i) + '\tCMP' + '\n')
-                i += 1
-            elif program[i] == WRITE:
-                handle.write(str(i) + '\tWRITE' + '\n')
-                i += 1
-            elif program[i] == READ:
-                handle.write(str(i) + '\tREAD' + '\n')
-                i += 1
-            elif program[i] == HALT:
-                handle.write(str(i) + '\tHALT' + '\n')
-                i += 1
-
-        sys.exit(0)
+    lexer_filename = sys.argv[1]
+    semantic_filename = sys.argv[2]
+    program_filename = sys.argv[3]
+    if not os.path.isfile(semantic_filename):
+        print('compiler: Error: File \'' + semantic_filename + '\' is not exist.')
+        sys.exit(1)
+    if not os.path.isfile(lexer_filename):
+        print('compiler: Error: File \'' + lexer_filename + '\' is not exist.')
+        sys.exit(1)
 
+    init(lexer_filename, semantic_filename)
+    compile_program()
+    write_program(program_filename)
+    write_listing(program_filename + '.S')
+    sys.exit(0)
@@ -0,0 +1,479 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import math
+
+import vmio
+
+from mlctypes import FETCH_I, FETCH_F, FETCH_B, STORE_I, STORE_F, STORE_B, PUSH, POP, ADD, SUB, MUL, DIV,\
+                     JL, JG, JLE, JGE, JE, JNE, JMP, CMP, HALT, WRITE, AND, OR, NOT, TOINT, TOFLOAT,\
+                     JLT_POP, JGT_POP, JLE_POP, JGE_POP, JEQ_POP, JNE_POP, JFALSE, TEE,\
+                     READ_I, READ_F, READ_B, JTRUE, JTRUE_OR_POP, FORPREP, FORLOOP,\
+                     OPNAMES, OPERANDS, STACK_EFFECT, JUMPS, KEEP_JUMPS
+
+############################################
+#          Python Translation Tier
+############################################
+
+# The program is split into basic blocks and translated into the source of
+# a single Python function. Variable slots become locals v0, v1, ...; inside
+# a block the stack is evaluated symbolically, so 'FETCH a; PUSH 1; ADD;
+# STORE a' turns into 'v0 = (v0 + 1)'. Values left on the stack at a block
+# boundary live in locals s0, s1, ... and the CMP flags in fl, fr (the
+# compared operands). Blocks reached from a single place are inlined into
+# their predecessor, the others are dispatched by a balanced if-tree over
+# the block address inside 'while True'.
+#
+# Expressions are materialized into temporaries t0, t1, ... whenever the
+# interpreter would have evaluated them earlier than their use: before a
+# store to a variable they read, before WRITE, before and/or, which
+# Python would short-circuit, and once they nest MAX_NESTING levels deep.
+# The operations that can fail, DIV, TOINT and TOFLOAT, always get a
+# temporary of their own, so an error is raised on a line tagged with the
+# pc of the failing instruction and in the order of the interpreter.
+# JFALSE_OR_POP/JTRUE_OR_POP branch on a temporary that the jumping path
+# keeps on its stack.
+#
+# Numbers are None until they are assigned. The first FETCH_I/FETCH_F of a
+# slot that is not assigned on every path to it checks for None, as the
+# interpreter does on every fetch.
+
+# Deepest indentation of inlined code, deeper blocks are dispatched
+MAX_INLINE = 40
+# Deepest parenthesis nesting of an expression, deeper operands are moved to
+# temporaries first (the Python parser gives up at 200 levels)
+MAX_NESTING = 100
+
+BINARY = {ADD: '+', SUB: '-', MUL: '*', DIV: '/', AND: 'and', OR: 'or'}
+RELATION = {JLT_POP: '<', JGT_POP: '>', JLE_POP: '<=', JGE_POP: '>=', JEQ_POP: '==', JNE_POP: '!=',
+            JL: '<', JG: '>', JLE: '<=', JGE: '>=', JE: '==', JNE: '!='}
+FLAG_JUMPS = (JL, JG, JLE, JGE, JE, JNE)
+READS = {READ_I: 'read_int()', READ_F: 'read_float()', READ_B: 'read_bool()'}
+
+NOTHING = frozenset()
+
+program = []
+consts = []
+nvars = 0
+# {block address: [(pc, op, operand)]}
+blocks = {}
+# {block address: [successor addresses]}
+successors = {}
+# {block address: number of incoming edges}
+preds = {}
+# {block address: stack depth on entry}
+depth = {}
+# {block address: True if the flags of a previous CMP may be read}
+flags_live = {}
+# {block address: [True if the flags may be read after the instruction]}
+flags_after = {}
+# {block address: variable slots assigned on every path to the block}
+defined = {}
+# blocks that need a dispatch entry, in the order they were found
+dispatched = []
+dispatched_set = set()
+temps = 0
+# pc of the instruction being translated
+origin = 0
+# pc per line of the generated source, None for the lines of no instruction
+origins = []
+
+# A stack entry is (expression, variable slots it reads, parenthesis
+# nesting), atoms (names and literals) have nesting 0 and can be used many
+# times without recomputing.
+def atom(expr, deps = NOTHING):
+    return (expr, deps, 0)
+
+def literal(index):
+    value = consts[index]
+    if type(value) is float and not math.isfinite(value):
+        return atom('c' + str(index))
+    return atom(repr(value))
+
+def split_blocks():
+    global blocks, successors
+    leaders = set([0])
+    pc = 0
+    while pc < len(program):
+        op = program[pc]
+        size = 1 + OPERANDS[op]
+        if op in JUMPS:
+            leaders.add(program[pc + size - 1])
+            leaders.add(pc + size)
+        elif op == HALT:
+            leaders.add(pc + size)
+        pc += size
+
+    blocks = {}
+    successors = {}
+    current = None
+    pc = 0
+    while pc < len(program):
+        op = program[pc]
+        if pc in leaders:
+            current = blocks[pc] = []
+        current.append((pc, op, program[pc + 1] if OPERANDS[op] else None))
+        pc += 1 + OPERANDS[op]
+
+    for start, code in blocks.items():
+        pc, op, operand = code[-1]
+        follow = pc + 1 + OPERANDS[op]
+        if op == JMP:
+            successors[start] = [operand]
+        elif op in JUMPS:
+            successors[start] = [program[follow - 1], follow]
+        elif op == HALT or follow >= len(program):
+            successors[start] = []
+        else:
+            successors[start] = [follow]
+
+# Stack depth at the start of every reachable block, JFALSE_OR_POP and
+# JTRUE_OR_POP keep their value on the stack when they jump
+def find_depths():
+    global depth, preds
+    depth = {0: 0}
+    preds = {0: 1}
+    work = [0]
+    while work:
+        start = work.pop()
+        size = depth[start] + sum(STACK_EFFECT[op] for pc, op, operand in blocks[start])
+        kept = 1 if blocks[start][-1][1] in KEEP_JUMPS else 0
+        for index, succ in enumerate(successors[start]):
+            entry = size + kept if index == 0 else size
+            if succ not in depth:
+                depth[succ] = entry
+                preds[succ] = 0
+                work.append(succ)
+            elif depth[succ] != entry:
+                raise ValueError('inconsistent stack depth at ' + str(succ))
+    for start in depth:
+        for succ in successors[start]:
+            preds[succ] += 1
+
+def find_flags_live():
+    global flags_live, flags_after
+    uses = {}
+    defines = {}
+    for start in depth:
+        uses[start] = False
+        defines[start] = False
+        for pc, op, operand in blocks[start]:
+            if op == CMP:
+                defines[start] = True
+                break
+            if op in FLAG_JUMPS:
+                uses[start] = True
+                break
+    flags_live = {start: uses[start] for start in depth}
+    changed = True
+    while changed:
+        changed = False
+        for start in depth:
+            live = uses[start] or (not defines[start] and
+                                   any(flags_live[succ] for succ in successors[start]))
+            if live != flags_live[start]:
+                flags_live[start] = live
+                changed = True
+
+    flags_after = {}
+    for start in depth:
+        needed = any(flags_live[succ] for succ in successors[start])
+        after = [False] * len(blocks[start])
+        for index in range(len(after) - 1, -1, -1):
+            after[index] = needed
+            op = blocks[start][index][1]
+            if op == CMP:
+                needed = False
+            elif op in FLAG_JUMPS:
+                needed = True
+        flags_after[start] = after
+
+# Slots are assigned by stores and reads, and known to be assigned after a
+# checked fetch; a slot is defined at a block if it is at the end of all
+# its predecessors
+def find_defined():
+    global defined
+    assigned = {}
+    for start in depth:
+        slots = set()
+        for pc, op, operand in blocks[start]:
+            if op in (FETCH_I, FETCH_F, STORE_I, STORE_F, STORE_B, TEE) or op in READS:
+                slots.add(operand)
+            elif op == FORPREP:
+                slots.update((operand, operand + 1, operand + 2))
+            elif op == FORLOOP:
+                slots.update((operand, operand + 2))
+        assigned[start] = slots
+    everything = frozenset(range(nvars))
+    defined = {start: everything for start in depth}
+    defined[0] = NOTHING
+    changed = True
+    while changed:
+        changed = False
+        for start in depth:
+            out = defined[start] | assigned[start]
+            for succ in successors[start]:
+                common = defined[succ] & out
+                if common != defined[succ]:
+                    defined[succ] = common
+                    changed = True
+
+# Every generated line ends with '  # pc' of the instruction it comes from,
+# origins maps the lines of the function back to those pcs
+def emit(lines, text):
+    lines.append(text + '  # ' + str(origin))
+
+def new_temp(lines, indent, expr):
+    global temps
+    name = 't' + str(temps)
+    temps += 1
+    emit(lines, '    ' * indent + name + ' = ' + expr)
+    return name
+
+def materialize(entry, lines, indent):
+    if not entry[2]:
+        return entry
+    return atom(new_temp(lines, indent, entry[0]))
+
+# entry as the operand of a new expression, too deep ones are materialized
+def shallow(entry, lines, indent):
+    if entry[2] >= MAX_NESTING:
+        return materialize(entry, lines, indent)
+    return entry
+
+# Values that read slot are saved before the slot is overwritten
+def protect(slot, stack, flags, needed, lines, indent):
+    for i in range(len(stack)):
+        if slot in stack[i][1]:
+            stack[i] = atom(new_temp(lines, indent, stack[i][0]))
+    if needed and (slot in flags[0][1] or slot in flags[1][1]):
+        emit(lines, '    ' * indent + 'fl, fr = ' + flags[0][0] + ', ' + flags[1][0])
+        flags = (atom('fl'), atom('fr'))
+    return flags
+
+# Leaves the current path for block start: the stack and flags move to the
+# locals the block expects, then the dispatcher continues with it
+def exit_to(start, stack, flags, lines, indent):
+    if start not in dispatched_set:
+        dispatched_set.add(start)
+        dispatched.append(start)
+    names = []
+    exprs = []
+    for i in range(len(stack)):
+        if stack[i][0] != 's' + str(i):
+            names.append('s' + str(i))
+            exprs.append(stack[i][0])
+    if flags_live[start] and flags[0][0] != 'fl':
+        names += ['fl', 'fr']
+        exprs += [flags[0][0], flags[1][0]]
+    if names:
+        emit(lines, '    ' * indent + ', '.join(names) + ' = ' + ', '.join(exprs))
+    emit(lines, '    ' * indent + 'block = ' + str(start))
+
+def follow(start, stack, flags, lines, indent):
+    if preds[start] == 1 and start != 0 and indent < MAX_INLINE:
+        translate_block(start, stack, flags, lines, indent)
+    else:
+        exit_to(start, stack, flags, lines, indent)
+
+def branch(cond, taken, fallthrough, stack, flags, lines, indent):
+    if cond == 'True' or cond == 'False':
+        follow(taken if cond == 'True' else fallthrough, stack, flags, lines, indent)
+        return
+    emit(lines, '    ' * indent + 'if ' + cond + ':')
+    follow(taken, list(stack), flags, lines, indent + 1)
+    emit(lines, '    ' * indent + 'else:')
+    follow(fallthrough, list(stack), flags, lines, indent + 1)
+
+def translate_block(start, stack, flags, lines, indent):
+    tab = '    ' * indent
+    global origin
+    known = set(defined[start])
+    for index, (pc, op, operand) in enumerate(blocks[start]):
+        origin = pc
+        if op in (FETCH_I, FETCH_F, FETCH_B):
+            if op != FETCH_B and operand not in known:
+                emit(lines, tab + 'if v' + str(operand) + ' is None: raise UndefinedValue(' + str(operand) + ')')
+                known.add(operand)
+            stack.append(atom('v' + str(operand), frozenset([operand])))
+        elif op in (STORE_I, STORE_F, STORE_B, TEE):
+            value = stack.pop()
+            flags = protect(operand, stack, flags, flags_after[start][index], lines, indent)
+            emit(lines, tab + 'v' + str(operand) + ' = ' + value[0])
+            known.add(operand)
+            if op == TEE:
+                stack.append(atom('v' + str(operand), frozenset([operand])))
+        elif op in READS:
+            flags = protect(operand, stack, flags, flags_after[start][index], lines, indent)
+            emit(lines, tab + 'v' + str(operand) + ' = ' + READS[op])
+            known.add(operand)
+        elif op == PUSH:
+            stack.append(literal(operand))
+        elif op == POP:
+            value = stack.pop()
+            if value[2]:
+                emit(lines, tab + value[0])
+        elif op in BINARY:
+            rhs = stack.pop()
+            lhs = shallow(stack.pop(), lines, indent)
+            rhs = shallow(rhs, lines, indent)
+            if op == AND or op == OR:
+                rhs = materialize(rhs, lines, indent)
+            if op == DIV:
+                stack.append(atom(new_temp(lines, indent, lhs[0] + ' / ' + rhs[0])))
+            else:
+                stack.append(('(' + lhs[0] + ' ' + BINARY[op] + ' ' + rhs[0] + ')', lhs[1] | rhs[1],
+                              max(lhs[2], rhs[2]) + 1))
+        elif op == NOT:
+            value = shallow(stack.pop(), lines, indent)
+            stack.append(('(not ' + value[0] + ')', value[1], value[2] + 1))
+        elif op == TOINT:
+            stack.append(atom(new_temp(lines, indent, 'int(' + stack.pop()[0] + ')')))
+        elif op == TOFLOAT:
+            stack.append(atom(new_temp(lines, indent, 'float(' + stack.pop()[0] + ')')))
+        elif op == CMP:
+            stack[-2] = materialize(stack[-2], lines, indent)
+            stack[-1] = materialize(stack[-1], lines, indent)
+            flags = (stack[-2], stack[-1])
+        elif op == WRITE:
+            value = stack.pop()
+            for i in range(len(stack)):
+                stack[i] = materialize(stack[i], lines, indent)
+            emit(lines, tab + 'write(' + value[0] + ')')
+        elif op == HALT:
+            emit(lines, tab + 'values[:] = [' + ', '.join('v' + str(i) for i in range(nvars)) + ']')
+            emit(lines, tab + 'return')
+            return
+        elif op == JMP:
+            follow(operand, stack, flags, lines, indent)
+            return
+        elif op in FLAG_JUMPS:
+            cond = flags[0][0] + ' ' + RELATION[op] + ' ' + flags[1][0]
+            branch(cond, operand, pc + 2, stack, flags, lines, indent)
+            return
+        elif op in RELATION:
+            rhs = stack.pop()
+            lhs = stack.pop()
+            branch(lhs[0] + ' ' + RELATION[op] + ' ' + rhs[0], operand, pc + 2, stack, flags, lines, indent)
+            return
+        elif op == JFALSE:
+            value = stack.pop()
+            branch(value[0], pc + 2, operand, stack, flags, lines, indent)
+            return
+        elif op == JTRUE:
+            value = stack.pop()
+            branch(value[0], operand, pc + 2, stack, flags, lines, indent)
+            return
+        elif op == FORPREP:
+            counter = stack.pop()
+            limit = stack.pop()
+            for slot, value in ((operand + 1, limit), (operand, counter), (operand + 2, counter)):
+                flags = protect(slot, stack, flags, flags_after[start][index], lines, indent)
+                emit(lines, tab + 'v' + str(slot) + ' = ' + value[0])
+            counter = 'v' + str(operand)
+            branch(counter + ' >= v' + str(operand + 1), program[pc + 2], pc + 3, stack, flags, lines, indent)
+            return
+        elif op == FORLOOP:
+            counter = 'v' + str(operand)
+            flags = protect(operand, stack, flags, flags_after[start][index], lines, indent)
+            flags = protect(operand + 2, stack, flags, flags_after[start][index], lines, indent)
+            emit(lines, tab + counter + ' = ' + counter + ' + 1')
+            emit(lines, tab + 'v' + str(operand + 2) + ' = ' + counter)
+            branch(counter + ' >= v' + str(operand + 1), pc + 3, program[pc + 2], stack, flags, lines, indent)
+            return
+        elif op in KEEP_JUMPS:
+            value = materialize(stack.pop(), lines, indent)
+            if value[0] == 'True' or value[0] == 'False':
+                if (value[0] == 'True') == (op == JTRUE_OR_POP):
+                    follow(operand, stack + [value], flags, lines, indent)
+                else:
+                    follow(pc + 2, stack, flags, lines, indent)
+                return
+            emit(lines, tab + ('if ' if op == JTRUE_OR_POP else 'if not ') + value[0] + ':')
+            follow(operand, stack + [value], flags, lines, indent + 1)
+            emit(lines, tab + 'else:')
+            follow(pc + 2, list(stack), flags, lines, indent + 1)
+            return
+        else:
+            emit(lines, tab + 'raise RuntimeError(' + repr('unsupported instruction ' + OPNAMES[op] +
+                                                      ' at ' + str(pc)) + ')')
+            return
+
+    if successors[start]:
+        follow(successors[start][0], stack, flags, lines, indent)
+    else:
+        emit(lines, tab + 'return')
+
+def dispatch(starts, leaves, lines, indent):
+    if len(starts) == 1:
+        lines.extend('    ' * indent + line for line in leaves[starts[0]])
+        return
+    middle = len(starts) // 2
+    lines.append('    ' * indent + 'if block < ' + str(starts[middle]) + ':')
+    dispatch(starts[:middle], leaves, lines, indent + 1)
+    lines.append('    ' * indent + 'else:')
+    dispatch(starts[middle:], leaves, lines, indent + 1)
+
+# Returns the source of 'def run(values, consts, write, reader)' for the
+# program, reader is a vmio.Input.
+# types are the slot types, only their number matters.
+def translate(program_code, program_consts, types):
+    global program, consts, nvars, dispatched, dispatched_set, temps, origins
+    program = program_code
+    consts = program_consts
+    nvars = len(types)
+    dispatched = [0]
+    dispatched_set = set([0])
+    temps = 0
+    split_blocks()
+    find_depths()
+    find_flags_live()
+    find_defined()
+
+    leaves = {}
+    i = 0
+    while i < len(dispatched):
+        start = dispatched[i]
+        stack = [atom('s' + str(k)) for k in range(depth[start])]
+        leaves[start] = []
+        translate_block(start, stack, (atom('fl'), atom('fr')), leaves[start], 0)
+        i += 1
+
+    lines = ['def run(values, consts, write, reader):',
+             '    read_int, read_float, read_bool = reader.read_int, reader.read_float, reader.read_bool']
+    for index in range(len(consts)):
+        if type(consts[index]) is float and not math.isfinite(consts[index]):
+            lines.append('    c' + str(index) + ' = consts[' + str(index) + ']')
+    if nvars:
+        lines.append('    ' + ''.join('v' + str(i) + ', ' for i in range(nvars)) + '= values')
+    # no CMP yet: every relation between the flags is false
+    lines.append('    fl = fr = float(\'nan\')')
+    lines.append('    block = 0')
+    lines.append('    while True:')
+    dispatch(sorted(leaves), leaves, lines, 2)
+    origins = []
+    for line in lines:
+        tag = line.rfind('  # ')
+        origins.append(int(line[tag + 4:]) if tag >= 0 else None)
+    return '\n'.join(lines) + '\n'
+
+# Translates and compiles the program, returns run(values, consts, write,
+# reader); run.origins is the pc of every line of its source
+def build(program_code, program_consts, types):
+    source = translate(program_code, program_consts, types)
+    namespace = {'UndefinedValue': vmio.UndefinedValue}
+    exec(compile(source, '<mlvm jit>', 'exec'), namespace)
+    run = namespace['run']
+    run.origins = origins
+    return run
+
+# pc of the instruction whose code in run raised error, None if unknown
+def fault_pc(run, error):
+    pc = None
+    tb = error.__traceback__
+    while tb:
+        if tb.tb_frame.f_code is run.__code__:
+            pc = run.origins[tb.tb_lineno - 1]
+        tb = tb.tb_next
+    return pc
@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import sys
+import os
+import re
+
+# Keywords
+keywords = ['program', 'begin', 'end', 'var', 'true', 'false', 'ass', 'if', 'else',
+            'then', 'for', 'to', 'do', 'while', 'read', 'write', 'int', 'float',
+            'bool', 'and', 'or', 'not']
+
+# Separators
+separators = ['+', '-', '=', '<', '>', '*', '/', '(', ')', ';', '.', ':', '<=', '>=', '<>', ',']
+numbers = []
+ids = []
+
+TABLE_KEYWORD   = 1
+TABLE_SEPARATOR = 2
+TABLE_NUMBER    = 3
+TABLE_ID        = 4
+
+# {token text: index} for every table, numbers and ids grow while scanning
+keyword_index   = {word: index for index, word in enumerate(keywords)}
+separator_index = {sep: index for index, sep in enumerate(separators)}
+number_index = {}
+id_index = {}
+
+# lexer token = (line, table_index, token_index), filled only on request
+tokens = None
+errors = ''
+
+bin_pattern = re.compile(r'[01]+[Bb]')
+oct_pattern = re.compile(r'[0-7]+[Oo]')
+dec_pattern = re.compile(r'[0-9]+[Dd]?')
+hex_pattern = re.compile(r'[0-9]+[A-Fa-f0-9]+[Hh]')
+dot_pattern = re.compile(r'(\.[0-9]+([Ee][+\-]?[0-9]+)?)|([0-9]+(\.[0-9]+)?([Ee][+\-]?[0-9]+)?)')
+
+id_pattern     = re.compile(r'[A-Za-z][A-Za-z0-9]*')
+number_pattern = re.compile(r'[0-9A-Fa-f.]*')
+
+DIGITS  = '0123456789'
+LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+SINGLE_SEPARATORS = '+-*=;():,'
+
+def log(line, position, message):
+    global errors
+    errors += 'Error at [' + str(line) + ',' + str(position) + ']: ' + message + '\n'
+
+def valid_number(text):
+    return bin_pattern.fullmatch(text) or oct_pattern.fullmatch(text) or \
+           dec_pattern.fullmatch(text) or hex_pattern.fullmatch(text) or \
+           dot_pattern.fullmatch(text)
+
+# Scans a number starting at pos (a digit, or a digit after the leading '.'
+# at start), returns (text, next position)
+def scan_number(s, start, pos):
+    n = len(s)
+    pos = number_pattern.match(s, pos).end()
+    if pos < n and s[pos] in 'HhOo':
+        pos += 1
+    text = s[start:pos]
+    if pos < n and s[pos] in '+-' and text[-1] in 'Ee':
+        if pos + 1 < n and s[pos + 1] in DIGITS:
+            pos = number_pattern.match(s, pos + 1).end()
+            text = s[start:pos]
+        else:
+            # the sign is consumed but does not belong to the number
+            pos += 1
+    return text, pos
+
+def intern(table, index, text):
+    i = index.get(text)
+    if i is None:
+        i = len(table)
+        index[text] = i
+        table.append(text)
+    return i
+
+def scan(text):
+    comment = False
+    line = 0
+    for s in text.split('\n'):
+        line += 1
+        n = len(s)
+        pos = 0
+        while True:
+            while pos < n and s[pos] == ' ':
+                pos += 1
+            if pos >= n:
+                break
+
+            if comment:
+                end = s.find('*/', pos)
+                if end < 0:
+                    break
+                pos = end + 2
+                comment = False
+                continue
+
+            c = s[pos]
+            if c in LETTERS:
+                end = id_pattern.match(s, pos).end()
+                word = s[pos:end]
+                pos = end
+                index = keyword_index.get(word)
+                if index is None:
+                    token = (line, TABLE_ID, intern(ids, id_index, word))
+                else:
+                    token = (line, TABLE_KEYWORD, index)
+            elif c in DIGITS:
+                word, pos = scan_number(s, pos, pos)
+                if not valid_number(word):
+                    log(line, pos + 1, '\'' + word + '\' undefined identificator.')
+                token = (line, TABLE_NUMBER, intern(numbers, number_index, word))
+            elif c in SINGLE_SEPARATORS:
+                pos += 1
+                token = (line, TABLE_SEPARATOR, separator_index[c])
+            elif c == '<' or c == '>':
+                word = c
+                pos += 1
+                if pos < n and (s[pos] == '=' or (c == '<' and s[pos] == '>')):
+                    word += s[pos]
+                    pos += 1
+                token = (line, TABLE_SEPARATOR, separator_index[word])
+            elif c == '/':
+                if pos + 1 < n and s[pos + 1] == '*':
+                    comment = True
+                    pos += 1
+                    continue
+                pos += 1
+                token = (line, TABLE_SEPARATOR, separator_index['/'])
+            elif c == '.':
+                if pos + 1 < n and s[pos + 1] in DIGITS:
+                    word, pos = scan_number(s, pos, pos + 1)
+                    if not valid_number(word):
+                        log(line, pos + 1, '\'' + word + '\' undefined identificator.')
+                    token = (line, TABLE_NUMBER, intern(numbers, number_index, word))
+                else:
+                    pos += 1
+                    token = (line, TABLE_SEPARATOR, separator_index['.'])
+            else:
+                pos += 1
+                log(line, pos + 1, '\'' + c + '\' undefined identificator.')
+                continue
+
+            if tokens is not None:
+                tokens.append(token)
+            yield token
+
+# Resets the tables and returns a generator of tokens over the source text.
+# With record=True the produced tokens are also kept in lexer.tokens.
+def tokenize(text, record = False):
+    global numbers, ids, number_index, id_index, tokens, errors
+    numbers = []
+    ids = []
+    number_index = {}
+    id_index = {}
+    tokens = [] if record else None
+    errors = ''
+    return scan(text)
+
+def token_text(table, index):
+    if table == TABLE_KEYWORD:
+        return keywords[index]
+    if table == TABLE_SEPARATOR:
+        return separators[index]
+    if table == TABLE_NUMBER:
+        return numbers[index]
+    return ids[index]
+
+def write_output(filename):
+    with open(filename, 'w') as handle:
+        handle.write(''.join(item + ' ' for item in numbers) + '\n')
+        handle.write(''.join(item + ' ' for item in ids) + '\n')
+        handle.write(''.join(str(t[0]) + ',' + str(t[1]) + ',' + str(t[2]) + ' ' for t in tokens) + '\n')
+
+def write_logs(filename):
+    with open(filename, 'w') as handle:
+        handle.write('[Identificators]\n')
+        for i in range(len(ids)):
+            handle.write(str(i) + ': ' + ids[i] + '\n')
+
+        handle.write('\n[Numbers]\n')
+        for i in range(len(numbers)):
+            handle.write(str(i) + ': ' + numbers[i] + '\n')
+
+        handle.write('\n[Tokens]\n')
+        for t in tokens:
+            handle.write('(' + str(t[1]) + ',' + str(t[2]) + ') : ' + token_text(t[1], t[2]) + '\n')
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('lexer: Error. Required input and output files.')
+        sys.exit(1)
+    if not os.path.isfile(sys.argv[1]):
+        sys.stderr.write('Error: file \'' + sys.argv[1] + '\' is not exist\n')
+        sys.exit(1)
+
+    with open(sys.argv[1], 'r') as handle:
+        for t in tokenize(handle.read(), record = True):
+            pass
+    if errors:
+        sys.stderr.write(errors)
+        sys.exit(1)
+    write_output(sys.argv[2])
+    write_logs('lexer.logs')
+    sys.exit(0)
@@ -4,49 +4,361 @@
 
 import sys
 import os
-import subprocess
+import io
+import time
+import argparse
+import hashlib
+import contextlib
+import concurrent.futures
 
-lexer_filename = 'lexer.out'
-parser_filename = 'parser.out'
-semantic_filename = 'semantic.out'
+import lexer
+import parser
+import semantic
+import compiler
+import optimizer
+import peephole
+import bytecode
+import mlctypes
+import cache
 
-def make(filename, program_filename):
-    exit_code = subprocess.call(['./main', filename, lexer_filename])
-    if exit_code:
-        sys.exit(1)
+# Optimization pass and peephole rule stats of the last compile_source call
+stats = {}
 
-    exit_code = subprocess.call(['./parser.py', lexer_filename])
-    if exit_code:
-        sys.exit(1)
+# Artifacts --emit can write: the lexer tables and tokens (lexer.logs), the
+# syntax tree (ast.tree), the tree with types (astext.tree) and the program
+# listing (<program>.S). None is written by default.
+artifacts = ['tokens', 'ast', 'typed-ast', 'asm']
 
-    exit_code = subprocess.call(['./semantic.py', lexer_filename, parser_filename])
-    if exit_code:
-        sys.exit(1)
+# Hash of the compiler sources, part of every cache key
+version = None
 
-    exit_code = subprocess.call(['./compiler.py', lexer_filename, semantic_filename, program_filename])
-    if exit_code:
-        sys.exit(1)
+def compiler_version():
+    global version
+    if version is None:
+        digest = hashlib.sha256()
+        for module in (lexer, parser, semantic, optimizer, compiler, peephole, bytecode, mlctypes):
+            with open(module.__file__, 'rb') as handle:
+                digest.update(handle.read())
+        with open(__file__, 'rb') as handle:
+            digest.update(handle.read())
+        version = digest.hexdigest()
+    return version
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print('Error: too few arguments')
-        print('mlc INPUT_FILE [OUTPUT_FILE]')
+def write_text(filename, text):
+    with open(filename, 'w') as handle:
+        handle.write(text)
+
+# Writes the artifact file prefix + filename with write(path, *args), the
+# dump is streamed to the file. files is None without the cache, otherwise
+# the text is read back into it for cache hits to replay.
+def write_artifact(files, prefix, filename, write, *args):
+    write(prefix + filename, *args)
+    if files is not None:
+        with open(prefix + filename, 'r') as handle:
+            files.append((filename, handle.read()))
+
+# Lexer and parser stages, from the cache when front (the source key) has
+# them. Writes the emitted prefix + lexer.logs and ast.tree, returns (numbers,
+# ids, program AST, [(artifact name, text)] or None without the cache) or
+# None on errors. The token table is only kept for the logs and the cache,
+# where it is stored when parsing fails, otherwise a later stage supersedes it.
+def parse_source(text, front, prefix = '', emit = ()):
+    parsed = cache.load(front, 'ast') if front else None
+    if parsed:
+        for filename, contents in parsed[3]:
+            write_text(prefix + filename, contents)
+        return parsed
+
+    files = [] if front else None
+    scanned = cache.load(front, 'tokens') if front else None
+    if scanned:
+        lexer_numbers, lexer_ids, tokens, logs = scanned
+        parser.init_tokens(lexer_numbers, lexer_ids, tokens)
+        program = parser.run()
+        if logs is not None:
+            write_text(prefix + 'lexer.logs', logs)
+            files.append(('lexer.logs', logs))
+    else:
+        tokens = lexer.tokenize(text, record = bool(front) or 'tokens' in emit)
+        parser.init_tokens(lexer.numbers, lexer.ids, tokens)
+        # the lexer errors are only known once the parser has read the whole
+        # source, the parser messages are held back until then and dropped
+        # if there are any: they would only follow from the bad tokens
+        messages = io.StringIO()
+        with contextlib.redirect_stdout(messages):
+            program = parser.run()
+        if lexer.errors:
+            sys.stderr.write(lexer.errors)
+            return None
+        sys.stdout.write(messages.getvalue())
+        if 'tokens' in emit:
+            write_artifact(files, prefix, 'lexer.logs', lexer.write_logs)
+        if front and not program:
+            logs = files[0][1] if files else None
+            cache.store(front, 'tokens', (lexer.numbers, lexer.ids, lexer.tokens, logs))
+        # the recorded tokens are not needed past the logs and the cache
+        lexer.tokens = None
+    if not program:
+        return None
+
+    if 'ast' in emit:
+        write_artifact(files, prefix, 'ast.tree', parser.write_tree, program)
+    return parser.numbers, parser.ids, program, files
+
+# Runs lexer -> parse -> semantic -> compile in one process, the stages share
+# the token table, AST and declarations in memory. optimize = 0 turns the
+# optimization passes off, disabled lists the names of single rules to skip.
+# With the cache enabled stage results are looked up by the hash of the
+# compiler and the source (plus the options for the final program), the
+# pipeline continues from the furthest stage found. Only the furthest stage
+# a build reaches is stored. emit names the artifacts to write (see
+# artifacts): prefix + lexer.logs, ast.tree and astext.tree and the listing
+# program_filename.S. It is part of the cache keys, the entries replay the
+# artifacts that were written.
+# Returns True if the program was written to program_filename.
+def compile_source(text, program_filename = 'a.out', optimize = 1, disabled = (), prefix = '', emit = ()):
+    global stats
+    stats = {}
+    front = back = None
+    if cache.directory:
+        front = cache.key(compiler_version(), text, ','.join(sorted(emit)))
+        back = cache.key(front, str(optimize), ','.join(sorted(disabled)))
+        built = cache.load(back, 'program')
+        if built:
+            for filename, contents in built['files']:
+                write_text(prefix + filename, contents)
+            with open(program_filename, 'wb') as handle:
+                handle.write(built['program'])
+            if built['listing'] is not None:
+                write_text(program_filename + '.S', built['listing'])
+            stats = built['stats']
+            return True
+
+    checked = cache.load(front, 'checked') if front else None
+    if checked:
+        numbers, ids, decls, program, files = checked
+        for filename, contents in files:
+            write_text(prefix + filename, contents)
+    else:
+        parsed = parse_source(text, front, prefix, emit)
+        if not parsed:
+            return False
+        numbers, ids, program, files = parsed
+        semantic.init_ast(numbers, ids, program)
+        semantic.semantic()
+        if semantic.errors:
+            if front:
+                cache.store(front, 'ast', parsed)
+            print('\n' + semantic.errors)
+            return False
+        semantic.init_values()
+        decls = semantic.decls
+        if files is not None:
+            files = list(files)
+        if 'typed-ast' in emit:
+            write_artifact(files, prefix, 'astext.tree', semantic.write_tree, program)
+        if front:
+            cache.store(front, 'checked', (numbers, ids, decls, program, files))
+
+    if optimize:
+        stats.update(optimizer.optimize(program.args[1], numbers, decls, disabled))
+    compiler.init_ast(numbers, ids, decls, program.args[1])
+    compiler.compile_program()
+    if optimize:
+        stats.update(compiler.optimize_program(disabled))
+    compiler.write_program(program_filename)
+    listing = None
+    if 'asm' in emit:
+        compiler.write_listing(program_filename + '.S')
+
+    if back:
+        with open(program_filename, 'rb') as handle:
+            code = handle.read()
+        if 'asm' in emit:
+            with open(program_filename + '.S', 'r') as handle:
+                listing = handle.read()
+        cache.store(back, 'program', {'files': files, 'program': code, 'listing': listing, 'stats': stats})
+        cache.evict()
+    return True
+
+def make(filename, program_filename, optimize = 1, disabled = (), emit = ()):
+    with open(filename, 'r') as handle:
+        text = handle.read()
+    if not compile_source(text, program_filename, optimize, disabled, emit = emit):
         sys.exit(1)
 
-    if len(sys.argv) == 2:
-        if os.path.isfile(sys.argv[1]):
-            make(sys.argv[1], 'a.out')
-            sys.exit(0)
+############################################
+#               Batch Mode
+############################################
+
+# Every program compiles in a worker process with its own lexer, parser and
+# compiler state. The program and the emitted artifacts go next to each other
+# (name.out, name.out.S, name.lexer.logs, name.ast.tree, name.astext.tree) and
+# the messages a compile prints are captured and reported with its result.
+
+def batch_sources(paths):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            sources += sorted(os.path.join(path, name) for name in os.listdir(path)
+                              if name.endswith('.ml'))
         else:
-            print('Error: file \'' + sys.argv[1] + '\' does not exist')
-            sys.exit(1)
-    if len(sys.argv) == 3:
-        if os.path.isfile(sys.argv[1]):
-            make(sys.argv[1], sys.argv[2])
-            sys.exit(0)
+            sources.append(path)
+    return sources
+
+def init_worker(cache_directory, cache_limit):
+    if cache_directory:
+        cache.init(cache_directory, cache_limit)
+
+# job = (source file, program file, artifact prefix, optimize, disabled, emit)
+# Returns (source file, success, seconds, messages, cache counts)
+def batch_job(job):
+    source, program_filename, prefix, optimize, disabled, emit = job
+    cache.counts = {}
+    messages = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(messages), contextlib.redirect_stderr(messages):
+        try:
+            with open(source, 'r') as handle:
+                text = handle.read()
+            success = compile_source(text, program_filename, optimize, disabled, prefix, emit)
+        except Exception as error:
+            # one broken program must not stop the batch
+            print('Error: ' + str(error))
+            success = False
+    return source, success, time.perf_counter() - start, messages.getvalue(), cache.counts
+
+# Compiles the sources (files or directories of .ml files) with jobs worker
+# processes, prints a line per program in the order given.
+# Returns True if every program compiled.
+def make_batch(paths, jobs, outdir = None, optimize = 1, disabled = (), emit = ()):
+    work = []
+    outputs = set()
+    for source in batch_sources(paths):
+        base = os.path.join(outdir if outdir else os.path.dirname(source),
+                            os.path.splitext(os.path.basename(source))[0])
+        if base in outputs:
+            print('Error: more than one program would be written to \'' + base + '.out\'')
+            return False
+        outputs.add(base)
+        work.append((source, base + '.out', base + '.', optimize, disabled, emit))
+    if outdir:
+        os.makedirs(outdir, exist_ok = True)
+
+    start = time.perf_counter()
+    counts = {}
+    failed = 0
+    with contextlib.ExitStack() as stack:
+        if jobs > 1 and len(work) > 1:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                jobs, initializer = init_worker, initargs = (cache.directory, cache.limit)))
+            results = pool.map(batch_job, work)
         else:
-            print('Error: file \'' + sys.argv[1] + '\' does not exist')
+            results = map(batch_job, work)
+        for source, success, seconds, messages, job_counts in results:
+            print(('ok  ' if success else 'FAIL') + '  ' + source + '  ' + '%.3fs' % seconds)
+            for line in messages.splitlines():
+                if line.strip():
+                    print('      ' + line)
+            if not success:
+                failed += 1
+            for stage, (hits, misses) in job_counts.items():
+                total = counts.setdefault(stage, [0, 0])
+                total[0] += hits
+                total[1] += misses
+    cache.counts = counts
+    print(str(len(work) - failed) + ' compiled, ' + str(failed) + ' failed in ' +
+          '%.2fs' % (time.perf_counter() - start))
+    return failed == 0
+
+def print_cache_stats():
+    for stage in ('program', 'checked', 'ast', 'tokens'):
+        if stage in cache.counts:
+            hits, misses = cache.counts[stage]
+            print('cache ' + stage + ': ' + str(hits) + ' hits, ' + str(misses) + ' misses')
+
+def print_stats():
+    for name, (count, removed) in stats.items():
+        if removed is None:
+            print(name + ': applied ' + str(count))
+        else:
+            print(name + ': applied ' + str(count) + ', removed ' + str(removed) + ' instructions')
+
+if __name__ == '__main__':
+    rule_names = optimizer.passes + [name for name, rule in peephole.rules]
+    argparser = argparse.ArgumentParser(prog = 'mlc', description = 'Model language compiler')
+    argparser.add_argument('files', nargs = '+', metavar = 'FILE',
+                           help = 'source file and program file (default a.out); with --batch '
+                                  'the source files and directories of .ml files to compile')
+    argparser.add_argument('-O', dest = 'optimize', type = int, choices = [0, 1], default = 1,
+                           help = 'optimization level, 0 disables all optimization passes')
+    argparser.add_argument('--disable', action = 'append', default = [], metavar = 'RULE[,RULE]',
+                           help = 'skip the named passes and peephole rules: ' +
+                                  ', '.join(rule_names))
+    argparser.add_argument('--emit', action = 'append', default = [], metavar = 'ARTIFACT[,ARTIFACT]',
+                           help = 'write compiler artifacts, none by default: tokens (lexer.logs), '
+                                  'ast (ast.tree), typed-ast (astext.tree), asm (PROGRAM.S)')
+    argparser.add_argument('--opt-stats', action = 'store_true',
+                           help = 'report what every pass and rule did')
+    argparser.add_argument('--cache', action = 'store_true',
+                           help = 'reuse stage results stored in .mlccache')
+    argparser.add_argument('--cache-dir', metavar = 'DIR',
+                           help = 'reuse stage results stored in DIR instead of .mlccache')
+    argparser.add_argument('--cache-size', type = int, default = cache.LIMIT >> 20, metavar = 'MB',
+                           help = 'evict the least recently used results past this size (default ' +
+                                  str(cache.LIMIT >> 20) + ')')
+    argparser.add_argument('--cache-stats', action = 'store_true',
+                           help = 'report cache hits and misses per stage')
+    argparser.add_argument('--batch', action = 'store_true',
+                           help = 'compile every given source, programs are written to name.out')
+    argparser.add_argument('-j', dest = 'jobs', type = int, default = os.cpu_count() or 1, metavar = 'N',
+                           help = 'worker processes in batch mode (default: one per core)')
+    argparser.add_argument('--outdir', metavar = 'DIR',
+                           help = 'batch mode: write programs and artifacts to DIR instead of '
+                                  'next to their sources')
+    args = argparser.parse_args()
+    if not args.batch and len(args.files) > 2:
+        argparser.error('more than one source file requires --batch')
+
+    disabled = set()
+    for item in args.disable:
+        disabled.update(name for name in item.split(',') if name)
+    unknown = disabled - set(rule_names)
+    if unknown:
+        print('Error: unknown rule \'' + sorted(unknown)[0] + '\'')
+        sys.exit(1)
+
+    emit = set()
+    for item in args.emit:
+        emit.update(name for name in item.split(',') if name)
+    unknown = emit - set(artifacts)
+    if unknown:
+        print('Error: unknown artifact \'' + sorted(unknown)[0] + '\'')
+        sys.exit(1)
+
+    if args.cache or args.cache_dir:
+        directory = args.cache_dir or '.mlccache'
+        try:
+            cache.init(directory, args.cache_size << 20)
+        except OSError:
+            print('Error: cannot use cache directory \'' + directory + '\'')
             sys.exit(1)
-    print('Error: too many arguments')
-    print('mlc INPUT_FILE [OUTPUT_FILE]')
-    sys.exit(1)
+    if args.batch:
+        success = make_batch(args.files, max(args.jobs, 1), args.outdir, args.optimize, disabled, emit)
+        if args.cache_stats:
+            print_cache_stats()
+        sys.exit(0 if success else 1)
+
+    source = args.files[0]
+    if not os.path.isfile(source):
+        print('Error: file \'' + source + '\' does not exist')
+        sys.exit(1)
+    try:
+        make(source, args.files[1] if len(args.files) > 1 else 'a.out', args.optimize, disabled, emit)
+        if args.opt_stats:
+            print_stats()
+    finally:
+        # a failed compile still reports the stages it looked up
+        if args.cache_stats:
+            print_cache_stats()
+    sys.exit(0)
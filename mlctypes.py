@@ -7,23 +7,13 @@ TABLE_SEPARATOR = 2
 TABLE_NUMBER    = 3
 TABLE_ID        = 4
 
+# Token codes: keywords by their index in the keyword table, separators
+# from PLUS on by theirs, then ids, numbers and the end of the stream
 class Token:
     PROGRAM, BEGIN, END, VAR, TRUE, FALSE, ASS, IF, ELSE, THEN, \
     FOR, TO, DO, WHILE, READ, WRITE, INT, FLOAT, BOOL, AND, OR, NOT, \
     PLUS, MINUS, EQUAL, LESS, GREAT, MUL, DIV, LPAR, RPAR, SEMICOLON, DOT, \
-    COLON, LESSEQUAL, GREATEQUAL, NOTEQUAL, COMMA = range(38)
-
-    value = None
-
-    def __init__(self, table, index):
-        self.table = table
-        self.index = index
-
-        if self.table == TABLE_SEPARATOR:
-
-            self.value = index + self.PLUS
-        elif self.table == TABLE_KEYWORD:
-            self.value = index
+    COLON, LESSEQUAL, GREATEQUAL, NOTEQUAL, COMMA, ID, NUMBER, EOF = range(41)
 
 ############################################
 #            AST Specification                   
@@ -46,13 +36,176 @@ class Token:
 
 ############################################
 
+# Nodes have no __dict__, most of a large tree is leaves and every
+# attribute dict would cost more than the node itself. A node pickles as
+# the constructor call plus its type when set, without the attribute names.
 class NodeAST:
     PROGRAM, DECLARATIONS, \
     NUMBER, ID, BOOL, OP, EXPR, \
     WHILE, FOR, IF, ASS, READ, WRITE, STMT_SEQ = range(14)
 
+    __slots__ = ('kind', 'line', 'args', 'type')
+
     def __init__(self, kind, line, *args):
         self.kind = kind
         self.line = line
         self.args = list(args)
         self.type = None
+
+    def __reduce__(self):
+        if self.type is None:
+            return NodeAST, (self.kind, self.line, *self.args)
+        return NodeAST, (self.kind, self.line, *self.args), self.type
+
+    def __setstate__(self, state):
+        self.type = state
+
+############################################
+#                AST Walkers
+############################################
+
+# The walkers keep their work on lists instead of the Python stack, so the
+# depth of a tree is only limited by memory. Handlers are looked up by node
+# kind in a dispatch table.
+
+# walk(root, handlers, *args) calls handlers[node.kind](node, *args). A
+# plain function returns the result of its node. A generator function walks
+# the children itself: 'value = yield child' suspends it until the child is
+# walked and resumes it with the result of the child, 'yield (child, args...)'
+# passes the child other arguments and 'yield None' gives None. The
+# generator's return value is the result of its node.
+
+GeneratorType = type((lambda: (yield))())
+
+def walk(root, handlers, *args):
+    value = handlers[root.kind](root, *args)
+    if type(value) is not GeneratorType:
+        return value
+    generator = GeneratorType
+    suspended = []
+    send = value.send
+    value = None
+    while True:
+        try:
+            item = send(value)
+        except StopIteration as stop:
+            if not suspended:
+                return stop.value
+            send = suspended.pop()
+            value = stop.value
+            continue
+        if item is None:
+            value = None
+            continue
+        if type(item) is tuple:
+            if len(item) == 2:
+                value = handlers[item[0].kind](item[0], item[1])
+            else:
+                value = handlers[item[0].kind](*item)
+        elif args:
+            value = handlers[item.kind](item, *args)
+        else:
+            value = handlers[item.kind](item)
+        if type(value) is generator:
+            suspended.append(send)
+            send = value.send
+            value = None
+
+# evaluate(root, handlers) computes an expression bottom-up, cheaper than a
+# generator per node: a leaf gives handlers[kind](node), an EXPR node gives
+# handlers[NodeAST.EXPR](node, left, right) once both operands are done
+# (right is None for a unary operation), the operator node is left to it.
+def evaluate(root, handlers):
+    operation = handlers[NodeAST.EXPR]
+    # EXPR nodes waiting for an operand, a None above a node means its right
+    # operand is being evaluated and its left one is on lefts
+    exprs = []
+    lefts = []
+    node = root
+    while True:
+        while node.kind == NodeAST.EXPR:
+            exprs.append(node)
+            node = node.args[1]
+        value = handlers[node.kind](node)
+        while exprs:
+            expr = exprs.pop()
+            if expr is None:
+                value = operation(exprs.pop(), lefts.pop(), value)
+                continue
+            right = expr.args[2]
+            if not right:
+                value = operation(expr, value, None)
+            elif right.kind != NodeAST.EXPR:
+                value = operation(expr, value, handlers[right.kind](right))
+            else:
+                exprs.append(expr)
+                exprs.append(None)
+                lefts.append(value)
+                node = right
+                break
+        else:
+            return value
+
+# Yields (node, depth) for an expression top-down, operands after their EXPR
+# node (left first) one level deeper, operator nodes are left out
+def preorder(root):
+    work = [(root, 0)]
+    while work:
+        node, depth = work.pop()
+        yield node, depth
+        if node.kind == NodeAST.EXPR:
+            if node.args[2]:
+                work.append((node.args[2], depth + 1))
+            work.append((node.args[1], depth + 1))
+
+############################################
+#            VM Instruction Set
+############################################
+
+# FETCH_x/STORE_x operand is a variable slot, the suffix is the slot type.
+# STORE_x does not convert, TOINT/TOFLOAT are emitted where types mix.
+# Jcc_POP pop rhs and lhs and jump if 'lhs cc rhs', without touching flags.
+# JFALSE/JTRUE pop a boolean and jump if it is false/true, TEE stores to a
+# slot without popping the value. READ_x reads the next input value into a
+# slot, converted to the slot type. JFALSE_OR_POP/JTRUE_OR_POP short-circuit
+# 'and'/'or': they jump if the boolean on top of the stack is false/true and leave it there
+# as the result, otherwise pop it and continue with the right operand.
+# FORPREP/FORLOOP run a 'for' loop from three slots starting at their first
+# operand: the counter, the limit and the loop variable as the body sees it.
+# FORPREP pops the limit and the start value and jumps out if the counter is
+# not below the limit; FORLOOP adds 1 to the counter, copies it to the loop
+# variable and jumps back to the body while it is below the limit.
+# The jump target is always the last operand word of a jump.
+FETCH_I, FETCH_F, FETCH_B, STORE_I, STORE_F, STORE_B, PUSH, POP, ADD, SUB, MUL, DIV,\
+JL, JG, JLE, JGE, JE, JNE, JMP, CMP, HALT, WRITE, AND, OR, NOT, TOINT, TOFLOAT,\
+JLT_POP, JGT_POP, JLE_POP, JGE_POP, JEQ_POP, JNE_POP, JFALSE, TEE,\
+READ_I, READ_F, READ_B, JTRUE, JFALSE_OR_POP, JTRUE_OR_POP, FORPREP, FORLOOP = range(43)
+
+OPNAMES = ['FETCH_I', 'FETCH_F', 'FETCH_B', 'STORE_I', 'STORE_F', 'STORE_B', 'PUSH', 'POP',
+           'ADD', 'SUB', 'MUL', 'DIV', 'JL', 'JG', 'JLE', 'JGE', 'JE', 'JNE', 'JMP', 'CMP',
+           'HALT', 'WRITE', 'AND', 'OR', 'NOT', 'TOINT', 'TOFLOAT',
+           'JLT_POP', 'JGT_POP', 'JLE_POP', 'JGE_POP', 'JEQ_POP', 'JNE_POP', 'JFALSE', 'TEE',
+           'READ_I', 'READ_F', 'READ_B', 'JTRUE', 'JFALSE_OR_POP', 'JTRUE_OR_POP', 'FORPREP', 'FORLOOP']
+
+# Number of operand words that follow each opcode in the program
+OPERANDS = [1, 1, 1, 1, 1, 1, 1, 0,
+            0, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 0,
+            0, 0, 0, 0, 0, 0, 0,
+            1, 1, 1, 1, 1, 1, 1, 1,
+            1, 1, 1, 1, 1, 1, 2, 2]
+
+# Change of the stack depth caused by each opcode, for the KEEP_JUMPS when
+# they do not jump (the jump keeps the depth)
+STACK_EFFECT = [1, 1, 1, -1, -1, -1, 1, -1,
+                -1, -1, -1, -1, 0, 0, 0, 0, 0, 0, 0, 0,
+                0, -1, -1, -1, 0, 0, 0,
+                -2, -2, -2, -2, -2, -2, -1, 0,
+                0, 0, 0, -1, -1, -1, -2, 0]
+
+# Instructions whose operand is a jump target
+JUMPS = frozenset([JL, JG, JLE, JGE, JE, JNE, JMP,
+                   JLT_POP, JGT_POP, JLE_POP, JGE_POP, JEQ_POP, JNE_POP, JFALSE,
+                   JTRUE, JFALSE_OR_POP, JTRUE_OR_POP, FORPREP, FORLOOP])
+
+# Jumps that leave the tested value on the stack when they are taken
+KEEP_JUMPS = frozenset([JFALSE_OR_POP, JTRUE_OR_POP])
@@ -4,87 +4,135 @@
 
 import sys
 import os
-import pickle
+import time
+import argparse
 
+import bytecode
+import jit
+import vmio
+import vmprof
 from mlctypes import Token
+from mlctypes import FETCH_I, FETCH_F, FETCH_B, STORE_I, STORE_F, STORE_B, PUSH, POP, ADD, SUB, MUL, DIV,\
+                     JL, JG, JLE, JGE, JE, JNE, JMP, CMP, HALT, WRITE, AND, OR, NOT, TOINT, TOFLOAT,\
+                     JLT_POP, JGT_POP, JLE_POP, JGE_POP, JEQ_POP, JNE_POP, JFALSE, TEE,\
+                     READ_I, READ_F, READ_B, JTRUE, JFALSE_OR_POP, JTRUE_OR_POP, FORPREP, FORLOOP,\
+                     OPNAMES, OPERANDS
 
-FETCH, STORE, PUSH, POP, ADD, SUB, MUL, DIV, JL, JG, JLE, JGE, JE, JNE, JMP, CMP, HALT,\
-WRITE, READ, AND, OR, NOT = range(22)
-
-# Commands sequence
+# Commands sequence, an int32 view of the program file
 program = []
 
-# {index, value}
-decls = {}
+# Variable slots: types, names and current values
+types = []
+names = []
+values = []
+
+# PUSH operands
+consts = []
+
+# Deepest the operand stack gets, from the program header
+stack_size = 0
+
+# Destination of WRITE, flushed at HALT
+output = vmio.Output()
 
+# Source of READ_x
+reader = vmio.Input()
+
+# (hits, nanoseconds, back edges) collected by run_profiled
+profile = None
+
+# The function run_jit translated the program into
+jitted = None
+
+# The operand stack is a list of stack_size entries, sp counts the entries
+# in use and the top of the stack is kept in tos, out of the list. The entry
+# under the first value pushed holds the initial tos, which is never read.
 def run():
     # [less, great, equal]
     flags = [0, 0, 0]
-    stack = []
+    stack = [None] * stack_size
+    sp = 0
+    tos = None
+    write = output.write
+    read_int = reader.read_int
+    read_float = reader.read_float
+    read_bool = reader.read_bool
     pc = 0
 
     while True:
         op = program[pc]
 
-        if op == FETCH:
-            if decls[program[pc + 1]][0] == Token.FLOAT:
-                stack.append(float(decls[program[pc + 1]][1]))
-            elif decls[program[pc + 1]][0] == Token.INT:
-                stack.append(int(decls[program[pc + 1]][1]))
-            else:
-                stack.append(decls[program[pc + 1]][1])
+        # FETCH_I, FETCH_F, FETCH_B and then STORE_I, STORE_F, STORE_B are
+        # the first opcodes; the values already have the slot type, so the
+        # variants of each run alike. Only unassigned numbers are None.
+        if op <= FETCH_B:
+            stack[sp] = tos
+            sp += 1
+            tos = values[program[pc + 1]]
+            if tos is None:
+                raise vmio.UndefinedValue(program[pc + 1])
             pc += 2
-        elif op == STORE:
-            if decls[program[pc + 1]][0] == Token.FLOAT:
-                decls[program[pc + 1]][1] = float(stack.pop())
-            elif decls[program[pc + 1]][0] == Token.INT:
-                decls[program[pc + 1]][1] = int(stack.pop())
-            else:
-                decls[program[pc + 1]][1] = stack.pop()
+        elif op <= STORE_B:
+            values[program[pc + 1]] = tos
+            sp -= 1
+            tos = stack[sp]
+            pc += 2
+        elif op == TEE:
+            values[program[pc + 1]] = tos
             pc += 2
         elif op == PUSH:
-            stack.append(program[pc + 1])
+            stack[sp] = tos
+            sp += 1
+            tos = consts[program[pc + 1]]
             pc += 2
         elif op == POP:
-            stack.pop()
+            sp -= 1
+            tos = stack[sp]
             pc += 1
         elif op == ADD:
-            stack[-2] += stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] + tos
             pc += 1
         elif op == SUB:
-            stack[-2] -= stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] - tos
             pc += 1
         elif op == MUL:
-            stack[-2] *= stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] * tos
             pc += 1
         elif op == DIV:
-            stack[-2] /= stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] / tos
             pc += 1
         elif op == AND:
-            stack[-2] = stack[-2] and stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] and tos
             pc += 1
         elif op == OR:
-            stack[-2] = stack[-2] or stack[-1]
-            stack.pop()
+            sp -= 1
+            tos = stack[sp] or tos
             pc += 1
         elif op == NOT:
-            stack[-1] = not stack[-1]
+            tos = not tos
+            pc += 1
+        elif op == TOINT:
+            tos = int(tos)
+            pc += 1
+        elif op == TOFLOAT:
+            tos = float(tos)
             pc += 1
         elif op == CMP:
             flags = [0, 0, 0]
-            if stack[-1] == stack[-2]:
+            lhs = stack[sp - 1]
+            if tos == lhs:
                 flags[2] = 1
                 flags[1] = 0
                 flags[0] = 0
-            if stack[-2] < stack[-1]:
+            if lhs < tos:
                 flags[0] = 1
                 flags[1] = 0
-            if stack[-2] > stack[-1]:
+            if lhs > tos:
                 flags[1] = 1
                 flags[0] = 0
             pc += 1
@@ -108,6 +156,11 @@ def run():
                 pc = program[pc + 1]
             else:
                 pc += 2
+        elif op == JE:
+            if flags[2] == 1:
+                pc = program[pc + 1]
+            else:
+                pc += 2
         elif op == JNE:
             if flags[2] == 0:
                 pc = program[pc + 1]
@@ -115,21 +168,647 @@ def run():
                 pc += 2
         elif op == JMP:
             pc = program[pc + 1]
+        elif op == JLT_POP:
+            sp -= 2
+            if stack[sp + 1] < tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JGT_POP:
+            sp -= 2
+            if stack[sp + 1] > tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JLE_POP:
+            sp -= 2
+            if stack[sp + 1] <= tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JGE_POP:
+            sp -= 2
+            if stack[sp + 1] >= tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JEQ_POP:
+            sp -= 2
+            if stack[sp + 1] == tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JNE_POP:
+            sp -= 2
+            if stack[sp + 1] != tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JFALSE:
+            sp -= 1
+            if tos:
+                pc += 2
+            else:
+                pc = program[pc + 1]
+            tos = stack[sp]
+        elif op == JTRUE:
+            sp -= 1
+            if tos:
+                pc = program[pc + 1]
+            else:
+                pc += 2
+            tos = stack[sp]
+        elif op == JFALSE_OR_POP:
+            if tos:
+                sp -= 1
+                tos = stack[sp]
+                pc += 2
+            else:
+                pc = program[pc + 1]
+        elif op == JTRUE_OR_POP:
+            if tos:
+                pc = program[pc + 1]
+            else:
+                sp -= 1
+                tos = stack[sp]
+                pc += 2
+        elif op == FORPREP:
+            slot = program[pc + 1]
+            values[slot + 1] = limit = stack[sp - 1]
+            values[slot] = tos
+            values[slot + 2] = tos
+            if tos >= limit:
+                pc = program[pc + 2]
+            else:
+                pc += 3
+            sp -= 2
+            tos = stack[sp]
+        elif op == FORLOOP:
+            slot = program[pc + 1]
+            counter = values[slot] + 1
+            values[slot] = counter
+            values[slot + 2] = counter
+            if counter >= values[slot + 1]:
+                pc += 3
+            else:
+                pc = program[pc + 2]
         elif op == WRITE:
-            print(stack[-1])
-            stack.pop()
+            write(tos)
+            sp -= 1
+            tos = stack[sp]
             pc += 1
+        elif op == READ_I:
+            values[program[pc + 1]] = read_int()
+            pc += 2
+        elif op == READ_F:
+            values[program[pc + 1]] = read_float()
+            pc += 2
+        elif op == READ_B:
+            values[program[pc + 1]] = read_bool()
+            pc += 2
         elif op == HALT:
+            output.flush()
             break
+        else:
+            raise RuntimeError('unsupported instruction ' + OPNAMES[op] + ' at ' + str(pc))
+
+# Pre-decoded engine: every instruction becomes a closure with its operands
+# already resolved, executing it returns the next pc (-1 stops the machine).
+# handlers[pc] is None for the operand words.
+def decode():
+    # [less, great, equal]
+    flags = [False, False, False]
+    # the stack of run, sp and tos are shared by the handlers
+    stack = [None] * stack_size
+    sp = 0
+    tos = None
+    write_value = output.write
+
+    def make_fetch(pc, slot):
+        def fetch():
+            nonlocal sp, tos
+            stack[sp] = tos
+            sp += 1
+            tos = values[slot]
+            if tos is None:
+                raise vmio.UndefinedValue(slot)
+            return pc + 2
+        return fetch
+
+    def make_store(pc, slot):
+        def store():
+            nonlocal sp, tos
+            values[slot] = tos
+            sp -= 1
+            tos = stack[sp]
+            return pc + 2
+        return store
+
+    def make_tee(pc, slot):
+        def tee():
+            values[slot] = tos
+            return pc + 2
+        return tee
+
+    def make_push(pc, index):
+        value = consts[index]
+        def push_const():
+            nonlocal sp, tos
+            stack[sp] = tos
+            sp += 1
+            tos = value
+            return pc + 2
+        return push_const
+
+    def make_pop(pc, operand):
+        def pop_value():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp]
+            return pc + 1
+        return pop_value
+
+    def make_add(pc, operand):
+        def add():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] + tos
+            return pc + 1
+        return add
+
+    def make_sub(pc, operand):
+        def sub():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] - tos
+            return pc + 1
+        return sub
+
+    def make_mul(pc, operand):
+        def mul():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] * tos
+            return pc + 1
+        return mul
+
+    def make_div(pc, operand):
+        def div():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] / tos
+            return pc + 1
+        return div
+
+    def make_and(pc, operand):
+        def logical_and():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] and tos
+            return pc + 1
+        return logical_and
+
+    def make_or(pc, operand):
+        def logical_or():
+            nonlocal sp, tos
+            sp -= 1
+            tos = stack[sp] or tos
+            return pc + 1
+        return logical_or
+
+    def make_not(pc, operand):
+        def logical_not():
+            nonlocal tos
+            tos = not tos
+            return pc + 1
+        return logical_not
+
+    def make_toint(pc, operand):
+        def toint():
+            nonlocal tos
+            tos = int(tos)
+            return pc + 1
+        return toint
+
+    def make_tofloat(pc, operand):
+        def tofloat():
+            nonlocal tos
+            tos = float(tos)
+            return pc + 1
+        return tofloat
+
+    def make_cmp(pc, operand):
+        def compare():
+            lhs = stack[sp - 1]
+            flags[0] = lhs < tos
+            flags[1] = lhs > tos
+            flags[2] = lhs == tos
+            return pc + 1
+        return compare
+
+    def make_jl(pc, target):
+        def jump():
+            if flags[0] and not flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_jg(pc, target):
+        def jump():
+            if flags[1] and not flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_jle(pc, target):
+        def jump():
+            if flags[0] or flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_jge(pc, target):
+        def jump():
+            if flags[1] or flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_je(pc, target):
+        def jump():
+            if flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_jne(pc, target):
+        def jump():
+            if not flags[2]:
+                return target
+            return pc + 2
+        return jump
+
+    def make_jlt_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] < tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jgt_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] > tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jle_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] <= tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jge_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] >= tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jeq_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] == tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jne_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            sp -= 2
+            taken = stack[sp + 1] != tos
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jfalse(pc, target):
+        def jump():
+            nonlocal sp, tos
+            taken = not tos
+            sp -= 1
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jtrue(pc, target):
+        def jump():
+            nonlocal sp, tos
+            taken = tos
+            sp -= 1
+            tos = stack[sp]
+            return target if taken else pc + 2
+        return jump
+
+    def make_jfalse_or_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            if tos:
+                sp -= 1
+                tos = stack[sp]
+                return pc + 2
+            return target
+        return jump
+
+    def make_jtrue_or_pop(pc, target):
+        def jump():
+            nonlocal sp, tos
+            if tos:
+                return target
+            sp -= 1
+            tos = stack[sp]
+            return pc + 2
+        return jump
+
+    def make_forprep(pc, slot):
+        target = program[pc + 2]
+        def forprep():
+            nonlocal sp, tos
+            counter = tos
+            limit = values[slot + 1] = stack[sp - 1]
+            values[slot] = counter
+            values[slot + 2] = counter
+            sp -= 2
+            tos = stack[sp]
+            if counter >= limit:
+                return target
+            return pc + 3
+        return forprep
+
+    def make_forloop(pc, slot):
+        target = program[pc + 2]
+        def forloop():
+            counter = values[slot] + 1
+            values[slot] = counter
+            values[slot + 2] = counter
+            if counter >= values[slot + 1]:
+                return pc + 3
+            return target
+        return forloop
+
+    def make_jmp(pc, target):
+        def jump():
+            return target
+        return jump
+
+    def make_write(pc, operand):
+        def write():
+            nonlocal sp, tos
+            write_value(tos)
+            sp -= 1
+            tos = stack[sp]
+            return pc + 1
+        return write
+
+    def make_read(pc, slot):
+        read = {READ_I: reader.read_int, READ_F: reader.read_float, READ_B: reader.read_bool}[program[pc]]
+        def read_value():
+            values[slot] = read()
+            return pc + 2
+        return read_value
+
+    def make_halt(pc, operand):
+        def halt():
+            output.flush()
+            return -1
+        return halt
+
+    def make_unsupported(pc, operand):
+        def unsupported():
+            raise RuntimeError('unsupported instruction ' + OPNAMES[program[pc]] + ' at ' + str(pc))
+        return unsupported
+
+    makers = [make_unsupported] * len(OPNAMES)
+    makers[FETCH_I] = make_fetch
+    makers[FETCH_F] = make_fetch
+    makers[FETCH_B] = make_fetch
+    makers[STORE_I] = make_store
+    makers[STORE_F] = make_store
+    makers[STORE_B] = make_store
+    makers[TEE]     = make_tee
+    makers[PUSH]    = make_push
+    makers[POP]     = make_pop
+    makers[ADD]     = make_add
+    makers[SUB]     = make_sub
+    makers[MUL]     = make_mul
+    makers[DIV]     = make_div
+    makers[AND]     = make_and
+    makers[OR]      = make_or
+    makers[NOT]     = make_not
+    makers[TOINT]   = make_toint
+    makers[TOFLOAT] = make_tofloat
+    makers[CMP]     = make_cmp
+    makers[JL]      = make_jl
+    makers[JG]      = make_jg
+    makers[JLE]     = make_jle
+    makers[JGE]     = make_jge
+    makers[JE]      = make_je
+    makers[JNE]     = make_jne
+    makers[JMP]     = make_jmp
+    makers[JLT_POP] = make_jlt_pop
+    makers[JGT_POP] = make_jgt_pop
+    makers[JLE_POP] = make_jle_pop
+    makers[JGE_POP] = make_jge_pop
+    makers[JEQ_POP] = make_jeq_pop
+    makers[JNE_POP] = make_jne_pop
+    makers[JFALSE]  = make_jfalse
+    makers[JTRUE]   = make_jtrue
+    makers[JFALSE_OR_POP] = make_jfalse_or_pop
+    makers[JTRUE_OR_POP]  = make_jtrue_or_pop
+    makers[FORPREP] = make_forprep
+    makers[FORLOOP] = make_forloop
+    makers[WRITE]   = make_write
+    makers[READ_I]  = make_read
+    makers[READ_F]  = make_read
+    makers[READ_B]  = make_read
+    makers[HALT]    = make_halt
+
+    handlers = [None] * len(program)
+    pc = 0
+    while pc < len(program):
+        op = program[pc]
+        operand = program[pc + 1] if OPERANDS[op] else None
+        handlers[pc] = makers[op](pc, operand)
+        pc += 1 + OPERANDS[op]
+    return handlers
+
+def run_table():
+    handlers = decode()
+    pc = 0
+    while pc >= 0:
+        pc = handlers[pc]()
+
+# The pre-decoded engine counting executed instructions, stops the program
+# with an error after limit of them (None runs without a limit). Returns the
+# number of instructions executed.
+def run_counted(limit = None):
+    handlers = decode()
+    pc = 0
+    count = 0
+    while pc >= 0:
+        if count == limit:
+            raise RuntimeError('instruction limit of ' + str(limit) + ' exceeded at ' + str(pc))
+        pc = handlers[pc]()
+        count += 1
+    return count
+
+# The pre-decoded engine with every instruction timed, a variant of its own
+# so the other engines pay nothing for profiling. Fills profile with per-pc
+# execution counts and nanoseconds and {(pc, target): count} of the backward
+# jumps taken, the back edges of loops; it is kept if the program fails.
+def run_profiled():
+    global profile
+    handlers = decode()
+    hits = [0] * len(program)
+    spent = [0] * len(program)
+    edges = {}
+    profile = (hits, spent, edges)
+    clock = time.perf_counter_ns
+    pc = 0
+    while pc >= 0:
+        start = clock()
+        target = handlers[pc]()
+        spent[pc] += clock() - start
+        hits[pc] += 1
+        if 0 <= target <= pc:
+            edges[pc, target] = edges.get((pc, target), 0) + 1
+        pc = target
+
+# Bool variables start as false, numbers are undefined until assigned
+def init_values():
+    global values
+    values = [False if kind == Token.BOOL else None for kind in types]
+
+# Translates the program into a Python function and calls it
+def run_jit():
+    global jitted
+    jitted = jit.build(program, consts, types)
+    jitted(values, consts, output.write, reader)
+    output.flush()
+
+engines = {'loop': run, 'table': run_table, 'jit': run_jit}
+
+############################################
+#              Run Time Errors
+############################################
+
+# The engines do nothing to track the failing instruction; once an error
+# escapes, its pc is the 'pc' local of the engine frame in the traceback,
+# or the line of the translated function that raised.
+
+ENGINE_CODES = (run.__code__, run_table.__code__, run_counted.__code__, run_profiled.__code__)
+
+def fault_pc(error):
+    pc = None
+    tb = error.__traceback__
+    while tb:
+        if tb.tb_frame.f_code in ENGINE_CODES:
+            pc = tb.tb_frame.f_locals.get('pc')
+        tb = tb.tb_next
+    if pc is None and jitted:
+        pc = jit.fault_pc(jitted, error)
+    return pc
+
+# Errors a program can cause: bad input, arithmetic and undefined values
+RUNTIME_ERRORS = (ValueError, EOFError, ArithmeticError, vmio.UndefinedValue)
+
+def error_message(error):
+    if isinstance(error, ZeroDivisionError):
+        return 'division by zero'
+    if isinstance(error, vmio.UndefinedValue):
+        return 'use of an undefined value'
+    return str(error)
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Error: required program file')
-        print('mlvm FILE')
+    if sys.argv[1:2] == ['serve']:
+        import vmserve
+        vmserve.main(sys.argv[2:])
+        sys.exit(0)
+
+    argparser = argparse.ArgumentParser(prog = 'mlvm', description = 'Model language virtual machine')
+    argparser.add_argument('file', help = 'compiled program')
+    argparser.add_argument('--engine', choices = sorted(engines), default = 'loop',
+                           help = 'execution engine: the reference decode loop, pre-decoded handlers '
+                                  'or the program translated to Python')
+    argparser.add_argument('--jit', dest = 'engine', action = 'store_const', const = 'jit',
+                           help = 'same as --engine jit')
+    argparser.add_argument('--output', metavar = 'FILE', help = 'write the program output to FILE')
+    argparser.add_argument('--input', metavar = 'FILE', help = 'read the program input from FILE')
+    argparser.add_argument('--buffer', type = int, default = vmio.THRESHOLD, metavar = 'N',
+                           help = 'values collected before the output is written (default ' +
+                                  str(vmio.THRESHOLD) + ', 1 writes every value at once)')
+    argparser.add_argument('--profile', action = 'store_true',
+                           help = 'run on the instrumented loop and write a profile to stderr; '
+                                  'the engine choice is ignored')
+    argparser.add_argument('--profile-output', metavar = 'FILE',
+                           help = 'profile as with --profile, writing the report to FILE')
+    argparser.add_argument('--top', type = int, default = vmprof.TOP, metavar = 'N',
+                           help = 'hot instructions listed in the profile (default ' + str(vmprof.TOP) + ')')
+    args = argparser.parse_args()
+
+    if not os.path.isfile(args.file):
+        print('Error: file \'' + args.file + '\' does not exist')
+        sys.exit(1)
+    try:
+        types, names, consts, program, stack_size = bytecode.load(args.file)
+    except ValueError as error:
+        print('Error: ' + str(error))
         sys.exit(1)
-    if not os.path.isfile(sys.argv[1]):
-        print('Error: file \'' + sys.argv[1] + '\' does not exist')
+    init_values()
+    sink = open(args.output, 'w') if args.output else None
+    output = vmio.Output(sink, args.buffer)
+    source = open(args.input, 'rb') if args.input else None
+    reader = vmio.Input(source, output = output)
+    try:
+        if args.profile or args.profile_output:
+            run_profiled()
+        else:
+            engines[args.engine]()
+    except RUNTIME_ERRORS as error:
+        output.flush()
+        line = bytecode.line_at(bytecode.load_lines(args.file), fault_pc(error))
+        if line is None:
+            print('Error: ' + error_message(error))
+        else:
+            print('Error [line ' + str(line) + ']: ' + error_message(error))
         sys.exit(1)
-    with open(sys.argv[1], 'rb') as handle:
-        decls, program = pickle.load(handle)
-    run()
+    finally:
+        # what was written before a run time error is not lost
+        output.flush()
+        if sink:
+            sink.close()
+        if source:
+            source.close()
+        if profile:
+            report = vmprof.report(profile, program, names, consts, args.top, bytecode.load_lines(args.file))
+            if args.profile_output:
+                with open(args.profile_output, 'w') as handle:
+                    handle.write(report)
+            else:
+                sys.stderr.write(report)
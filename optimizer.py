@@ -0,0 +1,270 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import mlctypes
+from mlctypes import NodeAST
+from mlctypes import Token
+
+TABLE_KEYWORD   = 1
+TABLE_SEPARATOR = 2
+TABLE_NUMBER    = 3
+TABLE_ID        = 4
+
+############################################
+#       Constant Folding / Propagation
+############################################
+
+# Runs between semantic analysis and code generation. Expressions whose
+# operands are all constants are replaced by NUMBER/BOOL nodes, computed
+# the way the VM would (same Python operators, '/' always gives a float).
+# Known constant values of variables are propagated through straight-line
+# code, converted like STORE does for the variable type; control flow
+# joins keep only the values every path agrees on.
+
+passes = ['constant-folding', 'constant-propagation']
+
+numbers = None
+decls = None
+# {(type, repr(value)): index in numbers}
+numbers_index = {}
+# {id index: value} of variables known to hold a constant
+env = {}
+folding = True
+propagation = True
+stats = {}
+
+NOCONST = object()
+
+def constant_value(node):
+    if node.kind == NodeAST.NUMBER:
+        return numbers[node.args[0]]
+    if node.kind == NodeAST.BOOL:
+        return node.args[0] == Token.TRUE
+    return NOCONST
+
+def constant_node(value, line):
+    if type(value) is bool:
+        node = NodeAST(NodeAST.BOOL, line, Token.TRUE if value else Token.FALSE)
+        node.type = Token.BOOL
+        return node
+    key = (type(value), repr(value))
+    index = numbers_index.get(key)
+    if index is None:
+        index = len(numbers)
+        numbers_index[key] = index
+        numbers.append(value)
+    node = NodeAST(NodeAST.NUMBER, line, index)
+    node.type = Token.FLOAT if type(value) is float else Token.INT
+    return node
+
+# Value a variable of type kind holds after STORE
+def stored_value(kind, value):
+    if kind == Token.INT:
+        return int(value)
+    if kind == Token.FLOAT:
+        return float(value)
+    return value
+
+def evaluate(op, lhs, rhs):
+    code = op.args[1]
+    if op.args[0] == TABLE_KEYWORD:
+        if code == Token.AND:
+            return lhs and rhs
+        if code == Token.OR:
+            return lhs or rhs
+        return not lhs
+    if code == Token.PLUS:
+        return lhs + rhs
+    if code == Token.MINUS:
+        return lhs - rhs
+    if code == Token.MUL:
+        return lhs * rhs
+    if code == Token.DIV:
+        return lhs / rhs
+    if code == Token.LESS:
+        return lhs < rhs
+    if code == Token.GREAT:
+        return lhs > rhs
+    if code == Token.LESSEQUAL:
+        return lhs <= rhs
+    if code == Token.GREATEQUAL:
+        return lhs >= rhs
+    if code == Token.EQUAL:
+        return lhs == rhs
+    return lhs != rhs
+
+# Expression handlers return the folded replacement of their node (the node
+# itself if nothing changed)
+def fold_id(expr):
+    if propagation and expr.args[0] in env:
+        stats['constant-propagation'][0] += 1
+        return constant_node(env[expr.args[0]], expr.line)
+    return expr
+
+def fold_constant(expr):
+    return expr
+
+def fold_operation(expr, left, right):
+    expr.args[1] = left
+    if expr.args[2]:
+        expr.args[2] = right
+    if not folding:
+        return expr
+
+    lhs = constant_value(expr.args[1])
+    rhs = constant_value(expr.args[2]) if expr.args[2] else None
+    if lhs is NOCONST or rhs is NOCONST:
+        return expr
+    try:
+        value = evaluate(expr.args[0], lhs, rhs)
+    except ArithmeticError:
+        # division by zero and overflows are left to fail at run time
+        return expr
+    stats['constant-folding'][0] += 1
+    return constant_node(value, expr.line)
+
+# Variables a statement may assign, collected in result
+def assigned_ass(stmt, result):
+    result.add(stmt.args[0].args[0])
+
+def assigned_read(stmt, result):
+    for var in stmt.args:
+        result.add(var.args[0])
+
+def assigned_none(stmt, result):
+    pass
+
+def assigned_if(stmt, result):
+    yield stmt.args[1]
+    yield stmt.args[2]
+
+def assigned_for(stmt, result):
+    yield stmt.args[0]
+    yield stmt.args[2]
+
+def assigned_while(stmt, result):
+    yield stmt.args[1]
+
+def assigned_stmt_seq(stmt, result):
+    for s in stmt.args:
+        yield s
+
+assigners = {NodeAST.ASS:      assigned_ass,
+             NodeAST.READ:     assigned_read,
+             NodeAST.WRITE:    assigned_none,
+             NodeAST.IF:       assigned_if,
+             NodeAST.FOR:      assigned_for,
+             NodeAST.WHILE:    assigned_while,
+             NodeAST.STMT_SEQ: assigned_stmt_seq}
+
+def assigned(stmt, result):
+    mlctypes.walk(stmt, assigners, result)
+    return result
+
+def forget(variables):
+    for var in variables:
+        env.pop(var, None)
+
+def join(lhs, rhs):
+    return {var: value for var, value in lhs.items()
+            if var in rhs and type(rhs[var]) is type(value) and repr(rhs[var]) == repr(value)}
+
+def fold_ass(stmt):
+    stmt.args[1] = fold_expr(stmt.args[1])
+    var = stmt.args[0].args[0]
+    value = constant_value(stmt.args[1])
+    env.pop(var, None)
+    if value is NOCONST:
+        return
+    try:
+        stored = stored_value(decls[var][0], value)
+    except (ArithmeticError, ValueError):
+        # TOINT of inf/nan fails at run time
+        return
+    env[var] = stored
+    if folding and type(stored) is not type(value):
+        # the TOINT/TOFLOAT before the store is done here
+        stmt.args[1] = constant_node(stored, stmt.args[1].line)
+        stats['constant-folding'][0] += 1
+
+def fold_read(stmt):
+    forget(var.args[0] for var in stmt.args)
+
+def fold_write(stmt):
+    for i in range(len(stmt.args)):
+        stmt.args[i] = fold_expr(stmt.args[i])
+
+def fold_if(stmt):
+    global env
+
+    stmt.args[0] = fold_expr(stmt.args[0])
+    cond = constant_value(stmt.args[0])
+    before = dict(env)
+    yield stmt.args[1]
+    after_then = env
+    env = before
+    if stmt.args[2]:
+        env = dict(before)
+        yield stmt.args[2]
+    if cond is True:
+        env = after_then
+    elif cond is not False:
+        env = join(after_then, env)
+
+def fold_for(stmt):
+    yield stmt.args[0]
+    stmt.args[1] = fold_expr(stmt.args[1])
+    changed = assigned(stmt.args[2], set([stmt.args[0].args[0].args[0]]))
+    forget(changed)
+    yield stmt.args[2]
+    forget(changed)
+
+def fold_while(stmt):
+    changed = assigned(stmt.args[1], set())
+    forget(changed)
+    stmt.args[0] = fold_expr(stmt.args[0])
+    yield stmt.args[1]
+    forget(changed)
+
+def fold_stmt_seq(stmt):
+    for s in stmt.args:
+        yield s
+
+expr_folders = {NodeAST.ID:     fold_id,
+                NodeAST.NUMBER: fold_constant,
+                NodeAST.BOOL:   fold_constant,
+                NodeAST.EXPR:   fold_operation}
+
+folders = {NodeAST.ASS:      fold_ass,
+           NodeAST.READ:     fold_read,
+           NodeAST.WRITE:    fold_write,
+           NodeAST.IF:       fold_if,
+           NodeAST.FOR:      fold_for,
+           NodeAST.WHILE:    fold_while,
+           NodeAST.STMT_SEQ: fold_stmt_seq}
+
+# Returns the folded replacement of expr
+def fold_expr(expr):
+    return mlctypes.evaluate(expr, expr_folders)
+
+def fold_stmt(stmt):
+    mlctypes.walk(stmt, folders)
+
+# Optimizes the statements in place, new constants are appended to
+# program_numbers. Returns {pass name: [applications, None]}.
+def optimize(stmts, program_numbers, semantic_decls, disabled = ()):
+    global numbers, decls, numbers_index, env, folding, propagation, stats
+    numbers = program_numbers
+    decls = semantic_decls
+    numbers_index = {}
+    for index, value in enumerate(numbers):
+        numbers_index.setdefault((type(value), repr(value)), index)
+    env = {}
+    folding = 'constant-folding' not in disabled
+    propagation = 'constant-propagation' not in disabled
+    stats = {name: [0, None] for name in passes}
+    if folding or propagation:
+        for stmt in stmts:
+            fold_stmt(stmt)
+    return {name: stats[name] for name in passes if name not in disabled}
@@ -5,6 +5,8 @@
 import sys
 import os
 import pickle
+from array import array
+from itertools import islice
 
 import mlctypes
 from mlctypes import Token
@@ -25,174 +27,277 @@ TABLE_SEPARATOR = 2
 TABLE_NUMBER    = 3
 TABLE_ID        = 4
 
-# lexer token = [line, table_index, token_index]
-tokens = []
-tokens_iterator = None
-token = Token(0, 0)
+# The token stream is read in chunks of TOKEN_CHUNK tokens: token_chunk has
+# the (line, table, index) triples of the lexer and token_codes the token
+# code (see Token) of each, computed once when the chunk is read.
+# next_token() moves the cursor and loads the current token into token,
+# token_index and token_line, refilling the chunk from the lexer stream when
+# it runs out. The productions only compare the integer token codes.
+TOKEN_CHUNK = 4096
+
+tokens_iterator = iter(())
+token_chunk = []
+token_codes = []
+token_pos = 0
+token = Token.EOF
+token_index = 0
 token_line = 0
 errors = False
 
-def ast_to_string(ast, level = 0):
-    tab = '   ' * level
-    nl  = '\n'
+# Token code by lexer table, keywords and separators add their table index
+table_codes = {TABLE_KEYWORD: Token.PROGRAM, TABLE_SEPARATOR: Token.PLUS,
+               TABLE_NUMBER: Token.NUMBER, TABLE_ID: Token.ID}
+
+# Tokens that stop skipping a bad statement
+RECOVERY_STOP = (Token.PROGRAM, Token.ID, Token.NUMBER, Token.EOF)
+
+# Tree dump, the handlers pass the lines of a node to dump: the write
+# of the tree file or the append of a list of lines
+dump = None
 
-    if ast.kind == NodeAST.NUMBER:
-        return tab + str(numbers[ast.args[0]]) + nl
+def dump_number(ast, level):
+    dump('   ' * level + str(numbers[ast.args[0]]) + '\n')
 
-    if ast.kind == NodeAST.ID:
-        return tab + ids[ast.args[0]] + nl
+def dump_id(ast, level):
+    dump('   ' * level + ids[ast.args[0]] + '\n')
 
-    if ast.kind == NodeAST.BOOL:
-        return tab + keywords[ast.args[0]] + nl
+def dump_bool(ast, level):
+    dump('   ' * level + keywords[ast.args[0]] + '\n')
 
-    if ast.kind == NodeAST.OP:
-        if ast.args[0] == TABLE_SEPARATOR:
-            return tab + separators[ast.args[1] - Token.PLUS] + nl
+def op_to_string(ast):
+    if ast.args[0] == TABLE_SEPARATOR:
+        return separators[ast.args[1] - Token.PLUS]
+    return keywords[ast.args[1]]
+
+def dump_op(ast, level):
+    dump('   ' * level + op_to_string(ast) + '\n')
+
+def dump_expr(ast, level):
+    for node, depth in mlctypes.preorder(ast):
+        if node.kind == NodeAST.EXPR:
+            dump('   ' * (level + depth) + op_to_string(node.args[0]) + '\n')
         else:
-            return tab + keywords[ast.args[1]] + nl
-
-    if ast.kind == NodeAST.EXPR:
-        result = ast_to_string(ast.args[0], level) +\
-                 ast_to_string(ast.args[1], level + 1)
-        if ast.args[2]:
-            result += ast_to_string(ast.args[2], level + 1)
-        return result
-
-    if ast.kind == NodeAST.STMT_SEQ:
-        result = ast_to_string(ast.args[0], level)
-        for item in ast.args[1:]:
-            result += ast_to_string(item, level)
-        return result
-
-    if ast.kind == NodeAST.IF:
-        result = tab + '[if]' + nl +\
-                 ast_to_string(ast.args[0], level + 1) +\
-                 tab + '[then]' + nl +\
-                 ast_to_string(ast.args[1], level + 1)
-        if ast.args[2]:
-            result += tab + '[else]' + nl
-            result += ast_to_string(ast.args[2], level + 1)
-        return result
-
-    if ast.kind == NodeAST.FOR:
-        return tab + '[for]' + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               tab + '[to]' + nl +\
-               ast_to_string(ast.args[1], level + 1) +\
-               tab + '[do]' + nl +\
-               ast_to_string(ast.args[2], level + 1)
-
-    if ast.kind == NodeAST.WHILE:
-        return tab + '[while]' + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               tab + '[do]' + nl +\
-               ast_to_string(ast.args[1], level + 1)
-
-    if ast.kind == NodeAST.ASS:
-        return tab + '[ass]' + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               ast_to_string(ast.args[1], level + 1)
-
-    if ast.kind == NodeAST.WRITE:
-        result = tab + '[write]' + nl
-        for item in ast.args:
-            result += ast_to_string(item, level + 1)
-        return result
-
-    if ast.kind == NodeAST.READ:
-        result = tab + '[read]' + nl
-        for item in ast.args:
-            result += ast_to_string(item, level + 1)
-        return result
+            dumpers[node.kind](node, level + depth)
+
+def dump_stmt_seq(ast, level):
+    for item in ast.args:
+        yield item, level
 
+def dump_if(ast, level):
+    tab = '   ' * level
+    dump(tab + '[if]\n')
+    dump_expr(ast.args[0], level + 1)
+    dump(tab + '[then]\n')
+    yield ast.args[1], level + 1
+    if ast.args[2]:
+        dump(tab + '[else]\n')
+        yield ast.args[2], level + 1
+
+def dump_for(ast, level):
+    tab = '   ' * level
+    dump(tab + '[for]\n')
+    yield ast.args[0], level + 1
+    dump(tab + '[to]\n')
+    dump_expr(ast.args[1], level + 1)
+    dump(tab + '[do]\n')
+    yield ast.args[2], level + 1
+
+def dump_while(ast, level):
+    tab = '   ' * level
+    dump(tab + '[while]\n')
+    dump_expr(ast.args[0], level + 1)
+    dump(tab + '[do]\n')
+    yield ast.args[1], level + 1
+
+def dump_ass(ast, level):
+    dump('   ' * level + '[ass]\n')
+    dump_id(ast.args[0], level + 1)
+    dump_expr(ast.args[1], level + 1)
+
+def dump_write(ast, level):
+    dump('   ' * level + '[write]\n')
+    for item in ast.args:
+        dump_expr(item, level + 1)
+
+def dump_read(ast, level):
+    dump('   ' * level + '[read]\n')
+    for item in ast.args:
+        dump_id(item, level + 1)
+
+def dump_program(ast, level):
+    tab = '   ' * level
+    dump(tab + '[declarations]\n')
+    for item in ast.args[0]:
+        dump('   ' + keywords[item[0]] + ' ')
+        for var in item[1:]:
+            dump(ids[var] + ' ')
+        dump('\n')
+    dump(tab + '[statements]\n')
+    for item in ast.args[1]:
+        yield item, level + 1
+
+dumpers = {NodeAST.NUMBER:   dump_number,
+           NodeAST.ID:       dump_id,
+           NodeAST.BOOL:     dump_bool,
+           NodeAST.OP:       dump_op,
+           NodeAST.EXPR:     dump_expr,
+           NodeAST.STMT_SEQ: dump_stmt_seq,
+           NodeAST.IF:       dump_if,
+           NodeAST.FOR:      dump_for,
+           NodeAST.WHILE:    dump_while,
+           NodeAST.ASS:      dump_ass,
+           NodeAST.WRITE:    dump_write,
+           NodeAST.READ:     dump_read,
+           NodeAST.PROGRAM:  dump_program}
+
+# Streams the tree of a program to filename, the text is ast_to_string(ast)
+# and a newline
+def write_tree(filename, ast):
+    global dump
+    with open(filename, 'w') as handle:
+        dump = handle.write
+        mlctypes.walk(ast, dumpers, 0)
+    dump = None
+
+def ast_to_string(ast, level = 0):
+    global dump
+    lines = []
+    dump = lines.append
+    mlctypes.walk(ast, dumpers, level)
+    dump = None
+    result = ''.join(lines)
     if ast.kind == NodeAST.PROGRAM:
-        result = tab + '[declarations]' + nl
-        for item in ast.args[0]:
-            result += '   ' + keywords[item[0]] + ' '
-            for var in item[1:]:
-                result += ids[var] + ' '
-            result += nl
-        result += tab + '[statements]' + nl
-        for item in ast.args[1]:
-            result += ast_to_string(item, level + 1)
         return result.rstrip('\n')
+    return result
+
+# Reads the next chunk of the lexer stream, returns the number of tokens read
+def fill_tokens():
+    global token_chunk, token_codes, token_pos
+
+    token_chunk = list(islice(tokens_iterator, TOKEN_CHUNK))
+    token_codes = [table_codes[table] + index if table <= TABLE_SEPARATOR else table_codes[table]
+                   for line, table, index in token_chunk]
+    token_pos = 0
+    return len(token_codes)
 
 def next_token():
-    global token
-    global token_line
-    t = next(tokens_iterator, None)
-    if t:
-        token = Token(t[1], t[2])
-        token_line = t[0]
-    else:
-        token = Token(None, None)
+    global token, token_index, token_line, token_pos
+    pos = token_pos
+    if pos == len(token_codes):
+        if not fill_tokens():
+            token = Token.EOF
+            return
+        pos = 0
+    token = token_codes[pos]
+    token_line, table, token_index = token_chunk[pos]
+    token_pos = pos + 1
 
 # <mulop> ::= * | / | and
 def mulop():
-    if token.value == token.MUL or token.value == token.DIV:
-        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token.value)
-    if token.value == token.AND:
-        return NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, token.value)
+    if token == Token.MUL or token == Token.DIV:
+        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token)
+    if token == Token.AND:
+        return NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, token)
     return None
 
 # <sumop> ::= + | - | or
 def sumop():
-    if token.value == token.PLUS or token.value == token.MINUS:
-        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token.value)
-    if token.value == token.OR:
-        return NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, token.value)
+    if token == Token.PLUS or token == Token.MINUS:
+        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token)
+    if token == Token.OR:
+        return NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, token)
     return None
 
 # <relop> ::= <> | = | < | >= | > | >=
 def relop():
-    if (token.value == token.NOTEQUAL) or (token.value == token.EQUAL) or \
-       (token.value == token.LESS) or (token.value == token.GREAT) or     \
-       (token.value == token.LESSEQUAL) or (token.value == token.GREATEQUAL):
-        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token.value)
+    if (token == Token.NOTEQUAL) or (token == Token.EQUAL) or \
+       (token == Token.LESS) or (token == Token.GREAT) or     \
+       (token == Token.LESSEQUAL) or (token == Token.GREATEQUAL):
+        return NodeAST(NodeAST.OP, token_line, TABLE_SEPARATOR, token)
     return None
 
-# <expr> ::= <operand> {<relations_op> <operand>}
+# Operator levels, operators of a level bind tighter than those below it
+RELATION, SUM, PRODUCT = 1, 2, 3
+
+# <expr>       ::= <operand> {<relop> <operand>}
+# <operand>    ::= <summand> {<sumop> <summand>}
+# <summand>    ::= <multiplier> {<mulop> <multiplier>}
+# <multiplier> ::= <id> | <number> | <logical> | not <multiplier> | (<expr>)
+#
+# Operator precedence parser with explicit stacks, so the depth of nesting
+# and the length of operator chains are not limited by Python recursion.
+# Binary operators are right associative, 'a - b - c' is 'a - (b - c)': an
+# operator only reduces the operators of higher levels on the stack. Nodes
+# are built at the token the grammar completes them at, so they carry the
+# same line: a binary expression the line of the token after its right
+# operand, 'not' the line of the last token of its multiplier. Returns the
+# EXPR tree or None on a syntax error, the error is reported by the caller.
 def expr():
-    lhs = operand()
-    if lhs:
-        op = relop()
-        if op:
+    # operand nodes; operators are (level, OP node), 'not' and '(' markers
+    # are (0, None) and (0, LPAR)
+    operands = []
+    operators = []
+    depth = 0
+    while True:
+        # a multiplier: any number of 'not' and '(' and then an atom
+        if token == Token.NOT:
+            operators.append((0, None))
             next_token()
-            rhs = expr()
-            if rhs:
-                return NodeAST(NodeAST.EXPR, token_line, op, lhs, rhs)
-            return None
-        return lhs
-    return None
-
-# <operand> ::= <summand> {<sumop> <operand>}
-def operand():
-    lhs = summand()
-    if lhs:
-        op = sumop()
-        if op:
+            continue
+        if token == Token.LPAR:
+            operators.append((0, Token.LPAR))
+            depth += 1
             next_token()
-            rhs = operand()
-            if rhs:
-                return NodeAST(NodeAST.EXPR, token_line, op, lhs, rhs)
+            continue
+        if token == Token.ID:
+            node = NodeAST(NodeAST.ID, token_line, token_index)
+        elif token == Token.NUMBER:
+            node = NodeAST(NodeAST.NUMBER, token_line, token_index)
+        elif token == Token.TRUE or token == Token.FALSE:
+            node = NodeAST(NodeAST.BOOL, token_line, token_index)
+        else:
             return None
-        return lhs
-    return None
-
-# <summand> ::= <multiplier> {<mulop> <summand>}
-def summand():
-    lhs = multiplier()
-    if lhs:
-        next_token()
-        op = mulop()
-        if op:
+        operands.append(node)
+
+        while True:
+            # the multiplier ends at its last token, apply the 'not' before it
+            while operators and operators[-1] == (0, None):
+                operators.pop()
+                operands[-1] = NodeAST(NodeAST.EXPR, token_line,
+                                       NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, Token.NOT),
+                                       operands[-1], None)
             next_token()
-            rhs = summand()
-            if rhs:
-                return NodeAST(NodeAST.EXPR, token_line, op, lhs, rhs)
-            return None
-        return lhs
-    return None
+
+            op = mulop()
+            level = PRODUCT
+            if not op:
+                op = sumop()
+                level = SUM
+            if not op:
+                op = relop()
+                level = RELATION
+            if op:
+                reduce(operands, operators, level)
+                operators.append((level, op))
+                next_token()
+                break
+
+            reduce(operands, operators, 0)
+            if not depth:
+                return operands[0]
+            if token != Token.RPAR:
+                return None
+            # ')' closes the innermost '(', the group is a multiplier
+            operators.pop()
+            depth -= 1
+
+# Builds the binary expressions of operators above level on the stack
+def reduce(operands, operators, level):
+    while operators and operators[-1][0] > level:
+        op = operators.pop()[1]
+        rhs = operands.pop()
+        lhs = operands.pop()
+        operands.append(NodeAST(NodeAST.EXPR, token_line, op, lhs, rhs))
 
 def convert_to_number(snum):
     if snum[-1] == 'H' or snum[-1] == 'h':
@@ -208,64 +313,38 @@ def convert_to_number(snum):
         snum = snum[:-1]
     return int(snum)
 
-# <multiplier> ::= <id> | <number> | <logical> | <unary multiplier> | (<expr>)
-def multiplier():
-    if token.table == TABLE_ID:
-        return NodeAST(NodeAST.ID, token_line, token.index)
-
-    if token.table == TABLE_NUMBER:
-        return NodeAST(NodeAST.NUMBER, token_line, token.index)
-
-    if token.value == token.TRUE or token.value == token.FALSE:
-        return NodeAST(NodeAST.BOOL, token_line, token.index)
-
-    if token.value == token.NOT:
-        next_token()
-        m = multiplier()
-        if not m:
-            return None
-        return NodeAST(NodeAST.EXPR, token_line, NodeAST(NodeAST.OP, token_line, TABLE_KEYWORD, token.NOT), m, None)
-
-    if token.value == token.LPAR:
-        next_token()
-        e = expr()
-        if e and token.value == token.RPAR:
-            return e
-
-    return None
-
 # <stmt> ::= <stmt> { : <stmt> } | <ass_stmt> | <if_stmt> | <for_stmt> | <while_stmt> | <write_stmt> | <read_stmt>
 def stmt():
     args = []
     node = None
-    if token.table == TABLE_ID:
+    if token == Token.ID:
         node = ass_stmt()
-    elif token.value == token.IF:
+    elif token == Token.IF:
         node = if_stmt()
-    elif token.value == token.WRITE:
+    elif token == Token.WRITE:
         node = write_stmt()
-    elif token.value == token.READ:
+    elif token == Token.READ:
         node = read_stmt()
-    elif token.value == token.FOR:
+    elif token == Token.FOR:
         node = for_stmt()
-    elif token.value == token.WHILE:
+    elif token == Token.WHILE:
         node = while_stmt()
     if node:
-        if token.value == token.COLON:
+        if token == Token.COLON:
             args.append(node)
-            while token.value == token.COLON:
+            while token == Token.COLON:
                 next_token()
-                if token.table == TABLE_ID:
+                if token == Token.ID:
                     node = ass_stmt()
-                elif token.value == token.IF:
+                elif token == Token.IF:
                     node = if_stmt()
-                elif token.value == token.WRITE:
+                elif token == Token.WRITE:
                     node = write_stmt()
-                elif token.value == token.READ:
+                elif token == Token.READ:
                     node = read_stmt()
-                elif token.value == token.FOR:
+                elif token == Token.FOR:
                     node = for_stmt()
-                elif token.value == token.WHILE:
+                elif token == Token.WHILE:
                     node = while_stmt()
                 if not node:
                     return None
@@ -276,9 +355,9 @@ def stmt():
 
 # <ass_stmt> ::= <id> ass <expr>
 def ass_stmt():
-    lhs = NodeAST(NodeAST.ID, token_line, token.index)
+    lhs = NodeAST(NodeAST.ID, token_line, token_index)
     next_token()
-    if token.value == token.ASS:
+    if token == Token.ASS:
         next_token()
         rhs = expr()
         if rhs:
@@ -293,11 +372,11 @@ def if_stmt():
     next_token()
     cond = expr()
     if cond:
-        if token.value == token.THEN:
+        if token == Token.THEN:
             next_token()
             lhs = stmt()
             if lhs:
-                if token.value == token.ELSE:
+                if token == Token.ELSE:
                     next_token()
                     rhs = stmt()
                     if rhs:
@@ -317,11 +396,11 @@ def for_stmt():
     next_token()
     begin = ass_stmt()
     if begin:
-        if token.value == token.TO:
+        if token == Token.TO:
             next_token()
             end = expr()
             if end:
-                if token.value == token.DO:
+                if token == Token.DO:
                     next_token()
                     stmts = stmt()
                     if stmts:
@@ -342,7 +421,7 @@ def while_stmt():
     next_token()
     cond = expr()
     if cond:
-        if token.value == token.DO:
+        if token == Token.DO:
             next_token()
             stmts = stmt()
             if stmts:
@@ -358,24 +437,24 @@ def while_stmt():
 def write_stmt():
     next_token()
     args = []
-    if token.value == token.LPAR:
+    if token == Token.LPAR:
         next_token()
         args.append(expr())
         if not args[-1]:
             print('Error [line ' + str(token_line) + ']: expected expression after \'(\'')
             return None
 
-        while token.value == token.COMMA:
+        while token == Token.COMMA:
             next_token()
             args.append(expr())
             if not args[-1]:
                 print('Error [line ' + str(token_line) + ']: expected expression')
                 return None
 
-        if token.table == TABLE_ID:
+        if token == Token.ID:
             print('Error [line ' + str(token_line) + ']: expected \',\'')
             return None
-        elif token.value == token.RPAR:
+        elif token == Token.RPAR:
             next_token()
             return NodeAST(NodeAST.WRITE, token_line, *args)
         else:
@@ -388,21 +467,21 @@ def write_stmt():
 def read_stmt():
     args = []
     next_token()
-    if token.value == token.LPAR:
+    if token == Token.LPAR:
         next_token()
-        if token.table != TABLE_ID:
+        if token != Token.ID:
             print('Error [line ' + str(token_line) + ']: expected variable after \'(\'')
             return None
-        args.append(NodeAST(NodeAST.ID, token_line, token.index))
+        args.append(NodeAST(NodeAST.ID, token_line, token_index))
         next_token()
-        while token.value == token.COMMA:
+        while token == Token.COMMA:
             next_token()
-            if token.table != TABLE_ID:
+            if token != Token.ID:
                 print('Error [line ' + str(token_line) + ']: expected variable after \'(\'')
                 return None
-            args.append(NodeAST(NodeAST.ID, token_line, token.index))
+            args.append(NodeAST(NodeAST.ID, token_line, token_index))
             next_token()
-        if token.value == token.RPAR:
+        if token == Token.RPAR:
             next_token()
             return NodeAST(NodeAST.READ, token_line, *args)
     print('Error [line ' + str(token_line) + ']: expected \'(\' after \'read\'')
@@ -410,23 +489,23 @@ def read_stmt():
 
 # <declaration> ::= (int | float | bool) <id> {, <id>}
 def declaration():
-    if (token.value == token.INT) or (token.value == token.FLOAT) or (token.value == token.BOOL):
-        decl = [token.value]
+    if (token == Token.INT) or (token == Token.FLOAT) or (token == Token.BOOL):
+        decl = [token]
         next_token()
-        if token.table == TABLE_ID:
-            decl.append(token.index)
+        if token == Token.ID:
+            decl.append(token_index)
             next_token()
-            if token.table == TABLE_ID:
+            if token == Token.ID:
                 print('Error [line ' + str(token_line) + ']: ' + 'expected \',\'')
                 return None
-            while token.value == token.COMMA:
+            while token == Token.COMMA:
                 next_token()
-                if token.table != TABLE_ID:
+                if token != Token.ID:
                     print('Error [line ' + str(token_line) + ']: ' + 'expected variable')
                     return None
-                decl.append(token.index)
+                decl.append(token_index)
                 next_token()
-            if token.table == TABLE_ID:
+            if token == Token.ID:
                 print('Error [line ' + str(token_line) + ']: ' + 'expected \',\'')
                 return None
             return decl
@@ -437,12 +516,12 @@ def declaration():
 def parse():
     global errors
 
-    if token.value != token.PROGRAM:
+    if token != Token.PROGRAM:
         print('Error [line ' + str(token_line) + ']: expected \'program\'')
         return None
     next_token()
 
-    if token.value != token.VAR:
+    if token != Token.VAR:
         print('Error [line ' + str(token_line) + ']: expected \'var\'')
         return None
     next_token()
@@ -450,7 +529,7 @@ def parse():
     decls = []
     decls.append(declaration())
     while decls[-1]:
-        if token.value == token.BEGIN:
+        if token == Token.BEGIN:
             break
         decls.append(declaration())
     if not decls:
@@ -462,53 +541,81 @@ def parse():
     result = stmt()
     while True:
         if not result:
-            if token.value == token.END or not token.value:
+            if token == Token.END or token in RECOVERY_STOP:
                 break
             errors = True
-            while token.value != token.SEMICOLON:
+            while token != Token.SEMICOLON:
                 next_token()
-                if not token.value: 
+                if token in RECOVERY_STOP:
                     break
             next_token()
-            if token.value == token.END or not token.value:
+            if token == Token.END or token in RECOVERY_STOP:
                 break
             result = stmt()
 
         stmts.append(result)
-        if token.value != token.SEMICOLON:
+        if token != Token.SEMICOLON:
             print('Error [line ' + str(token_line) + ']: ' + 'expected \';\' after statement')
             return None
         next_token()
         result = stmt()
 
-    if token.value != token.END:
+    if token != Token.END:
         print('Error [line ' + str(token_line) + ']: ' + 'expected \'end\'')
         return None
     next_token()
 
-    if token.value != token.DOT:
+    if token != Token.DOT:
         print('Error [line ' + str(token_line) + ']: ' + 'expected \'.\' after \'end\'')
         return None
 
     return NodeAST(NodeAST.PROGRAM, token_line, decls, stmts)
 
-def init(filename):
-    global numbers
-    global ids
+def read_lexer_output(filename):
     with open(filename, 'r') as file:
-        numbers = file.readline().split()
-        ids     = file.readline().split()
-
-        items = file.readline().split()
-        for item in items:
-            item = item.split(',')
-            tokens.append([int(item[0]), int(item[1]), int(item[2])])
+        lexer_numbers = file.readline().split()
+        lexer_ids     = file.readline().split()
+
+        values = array('i', map(int, file.readline().replace(',', ' ').split()))
+    return lexer_numbers, lexer_ids, zip(values[0::3], values[1::3], values[2::3])
+
+# Resets the parser state for a new token table produced by the lexer.
+# lexer_tokens may be a generator (see lexer.tokenize), the number and id
+# tables are then filled while the tokens are consumed.
+def init_tokens(lexer_numbers, lexer_ids, lexer_tokens):
+    global numbers, ids, tokens_iterator, token_chunk, token_codes
+    global token_pos, token, token_index, token_line, errors
+
+    numbers = lexer_numbers
+    ids = lexer_ids
+    tokens_iterator = iter(lexer_tokens)
+    token_chunk = []
+    token_codes = []
+    token_pos = 0
+    token = Token.EOF
+    token_index = 0
+    token_line = 0
+    errors = False
 
-        for i in range(len(numbers)):
-            numbers[i] = convert_to_number(numbers[i])
+def init(filename):
+    init_tokens(*read_lexer_output(filename))
 
-    global tokens_iterator
-    tokens_iterator = iter(tokens)
+# Parses the whole token table, returns the program AST or None on errors
+def run():
+    global numbers
+    next_token()
+    program = parse()
+    # consume the rest of the stream so that the lexer sees the whole source
+    for t in tokens_iterator:
+        pass
+    if errors or not program:
+        return None
+    try:
+        numbers = [convert_to_number(number) for number in numbers]
+    except ValueError:
+        # a malformed literal, the lexer reports it
+        return None
+    return program
 
 
 if __name__ == '__main__':
@@ -520,12 +627,10 @@ if __name__ == '__main__':
             print('parser: Error. File \'' + lexer_filename + '\' is not exist.')
 
         init(lexer_filename)
-        next_token()
-        program = parse()
-        if not errors and program:
+        program = run()
+        if program:
             with open('parser.out', 'wb') as handle:
                 pickle.dump([numbers, program], handle)
-            with open('ast.tree', 'w') as handle:
-                handle.write(ast_to_string(program) + '\n')
+            write_tree('ast.tree', program)
             sys.exit(0)
         sys.exit(1)
@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+from mlctypes import FETCH_I, FETCH_F, FETCH_B, STORE_I, STORE_F, STORE_B, PUSH, POP,\
+                     JNE, JMP, CMP, AND, OR, NOT, JFALSE, TEE, OPERANDS, JUMPS
+
+############################################
+#            Peephole Optimizer
+############################################
+
+# The program is decoded into Instruction objects, jumps refer to their
+# target instruction instead of an address. A rule looks at the window
+# starting at code[i] and returns (window size, replacement instructions)
+# or None. Instructions inside a window, except the first one, are never
+# jump targets; jumps to a replaced window land on the first replacement
+# instruction, or on the instruction after the window if it was removed.
+# Replacements take the source line of the first instruction of the window.
+# The arg of FORPREP/FORLOOP is their slot operand, their target the last one.
+
+class Instruction:
+    __slots__ = ('op', 'arg', 'target', 'forward', 'line')
+
+    def __init__(self, op, arg = None, target = None):
+        self.op = op
+        self.arg = arg
+        self.target = target
+        self.forward = None
+        self.line = 0
+
+def resolve(ins):
+    while ins.forward:
+        ins = ins.forward
+    return ins
+
+def decode(program, lines):
+    code = []
+    at = {}
+    jumps = []
+    pc = 0
+    while pc < len(program):
+        op = program[pc]
+        ins = Instruction(op, program[pc + 1] if OPERANDS[op] else None)
+        ins.line = lines[pc]
+        at[pc] = ins
+        code.append(ins)
+        if op in JUMPS:
+            jumps.append((ins, program[pc + OPERANDS[op]]))
+        pc += 1 + OPERANDS[op]
+    for ins, address in jumps:
+        ins.target = at[address]
+    return code
+
+def encode(code):
+    address = {}
+    pc = 0
+    for ins in code:
+        address[id(ins)] = pc
+        pc += 1 + OPERANDS[ins.op]
+    program = []
+    lines = []
+    for ins in code:
+        program.append(ins.op)
+        if ins.target:
+            if OPERANDS[ins.op] > 1:
+                program.append(ins.arg)
+            program.append(address[id(resolve(ins.target))])
+        elif OPERANDS[ins.op]:
+            program.append(ins.arg)
+        lines.extend([ins.line] * (1 + OPERANDS[ins.op]))
+    return program, lines
+
+# PUSH x; POP  or  FETCH v; POP  ->  (nothing)
+def push_pop(code, i, prev, consts):
+    if code[i].op in (PUSH, FETCH_I, FETCH_F, FETCH_B) and \
+       i + 1 < len(code) and code[i + 1].op == POP:
+        return 2, []
+    return None
+
+# <bool>; PUSH True; CMP; POP; POP; JNE L  ->  <bool>; JFALSE L
+def bool_branch(code, i, prev, consts):
+    if i + 4 < len(code) and code[i].op == PUSH and consts[code[i].arg] is True and \
+       code[i + 1].op == CMP and code[i + 2].op == POP and code[i + 3].op == POP and \
+       code[i + 4].op == JNE and prev and produces_bool(prev, consts):
+        return 5, [Instruction(JFALSE, target = code[i + 4].target)]
+    return None
+
+def produces_bool(ins, consts):
+    if ins.op == PUSH:
+        return type(consts[ins.arg]) is bool
+    return ins.op in (FETCH_B, AND, OR, NOT)
+
+# Jump to a JMP  ->  jump to its destination, JMP to the next instruction
+# -> (nothing)
+def jump_threading(code, i, prev, consts):
+    ins = code[i]
+    if not ins.target:
+        return None
+    if ins.op == JMP and i + 1 < len(code) and resolve(ins.target) is code[i + 1]:
+        return 1, []
+    target = resolve(ins.target)
+    hops = 0
+    while target.op == JMP and target is not ins and hops < len(code):
+        target = resolve(target.target)
+        hops += 1
+    if target is resolve(ins.target):
+        return None
+    return 1, [Instruction(ins.op, ins.arg, target)]
+
+# STORE v; FETCH v  ->  TEE v
+def store_fetch(code, i, prev, consts):
+    if i + 1 < len(code) and code[i].op in (STORE_I, STORE_F, STORE_B) and \
+       code[i + 1].op == code[i].op - STORE_I + FETCH_I and code[i + 1].arg == code[i].arg:
+        return 2, [Instruction(TEE, code[i].arg)]
+    return None
+
+# (name, rule), applied in this order at every instruction
+rules = [('push-pop',       push_pop),
+         ('bool-branch',    bool_branch),
+         ('jump-threading', jump_threading),
+         ('store-fetch',    store_fetch)]
+
+def run_pass(code, enabled, consts, stats):
+    targets = set()
+    for ins in code:
+        if ins.target:
+            targets.add(id(resolve(ins.target)))
+
+    out = []
+    changed = False
+    i = 0
+    while i < len(code):
+        # the previous instruction is only known to run before code[i]
+        # when nothing jumps to code[i]
+        prev = out[-1] if out and id(code[i]) not in targets else None
+        for name, rule in enabled:
+            result = rule(code, i, prev, consts)
+            if not result:
+                continue
+            size, replacement = result
+            if any(id(ins) in targets for ins in code[i + 1:i + size]):
+                continue
+            follow = replacement[0] if replacement else \
+                     (code[i + size] if i + size < len(code) else None)
+            for ins in code[i:i + size]:
+                ins.forward = follow
+            for ins in replacement:
+                ins.line = code[i].line
+            out.extend(replacement)
+            stats[name][0] += 1
+            stats[name][1] += size - len(replacement)
+            changed = True
+            i += size
+            break
+        else:
+            out.append(code[i])
+            i += 1
+    return out, changed
+
+# Runs the enabled rules until nothing changes, lines gives the source line
+# of every program word. Returns the new program, its lines and
+# {rule name: [applications, instructions removed]}.
+def optimize(program, lines, consts, disabled = ()):
+    enabled = [(name, rule) for name, rule in rules if name not in disabled]
+    stats = {name: [0, 0] for name, rule in enabled}
+    code = decode(program, lines)
+    changed = bool(enabled)
+    while changed:
+        code, changed = run_pass(code, enabled, consts, stats)
+    program, lines = encode(code)
+    return program, lines, stats
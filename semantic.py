@@ -6,6 +6,7 @@ import sys
 import os
 import pickle
 
+import mlctypes
 from mlctypes import NodeAST
 from mlctypes import Token
 
@@ -29,84 +30,118 @@ decls = {}
 errors = ''
 ast = None
 
-def ast_to_string(ast, level = 0):
-    tab = '   ' * level
-    nl  = '\n'
+# Tree dump with types, the handlers pass the lines of a node to dump: the write
+# of the tree file or the append of a list of lines
+dump = None
+
+def dump_number(ast, level):
+    dump('   ' * level + '(' + keywords[ast.type] + ')' + str(numbers[ast.args[0]]) + '\n')
+
+def dump_id(ast, level):
+    dump('   ' * level + '(' + keywords[ast.type] + ')' + ids[ast.args[0]] + '\n')
 
-    if ast.kind == NodeAST.NUMBER:
-        return tab + '(' + keywords[ast.type] + ')' + str(numbers[ast.args[0]]) + nl
+def dump_bool(ast, level):
+    dump('   ' * level + keywords[ast.args[0]] + '\n')
 
-    if ast.kind == NodeAST.ID:
-        return tab + '(' + keywords[ast.type] + ')' + ids[ast.args[0]] + nl
+def op_to_string(ast):
+    if ast.args[0] == TABLE_SEPARATOR:
+        return separators[ast.args[1] - Token.PLUS]
+    return keywords[ast.args[1]]
 
-    if ast.kind == NodeAST.BOOL:
-        return tab + keywords[ast.args[0]] + nl
+def dump_op(ast, level):
+    dump('   ' * level + op_to_string(ast) + '\n')
 
-    if ast.kind == NodeAST.OP:
-        if ast.args[0] == TABLE_SEPARATOR:
-            return tab + separators[ast.args[1] - Token.PLUS] + nl
+# The operator follows the type on the same line
+def dump_expr(ast, level):
+    for node, depth in mlctypes.preorder(ast):
+        if node.kind == NodeAST.EXPR:
+            dump('   ' * (level + depth) + '(' + keywords[node.type] + ')' + op_to_string(node.args[0]) + '\n')
         else:
-            return tab + keywords[ast.args[1]] + nl
-
-    if ast.kind == NodeAST.EXPR:
-        result = tab + '(' + keywords[ast.type] + ')' + ast_to_string(ast.args[0]) +\
-                 ast_to_string(ast.args[1], level + 1)
-        if ast.args[2]:
-            result += ast_to_string(ast.args[2], level + 1)
-        return result
-
-    if ast.kind == NodeAST.STMT_SEQ:
-        result = ast_to_string(ast.args[0], level)
-        for item in ast.args[1:]:
-            result += ast_to_string(item, level)
-        return result
-
-    if ast.kind == NodeAST.IF:
-        result = tab + '[if]' + nl +\
-                 ast_to_string(ast.args[0], level + 1) +\
-                 tab + '[then]' + nl +\
-                 ast_to_string(ast.args[1], level + 1)
-        if ast.args[2]:
-            result += tab + '[else]' + nl
-            result += ast_to_string(ast.args[2], level + 1)
-        return result
-
-    if ast.kind == NodeAST.FOR:
-        return tab + '[for]' + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               tab + '[to]' + nl +\
-               ast_to_string(ast.args[1], level + 1) +\
-               tab + '[do]' + nl +\
-               ast_to_string(ast.args[2], level + 1)
-
-    if ast.kind == NodeAST.WHILE:
-        return tab + '[while]' + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               tab + '[do]' + nl +\
-               ast_to_string(ast.args[1], level + 1)
-
-    if ast.kind == NodeAST.ASS:
-        return tab + '[ass] -> ' + keywords[ast.args[0].type] + nl +\
-               ast_to_string(ast.args[0], level + 1) +\
-               ast_to_string(ast.args[1], level + 1)
-
-    if ast.kind == NodeAST.WRITE:
-        result = tab + '[write]' + nl
-        for item in ast.args:
-            result += ast_to_string(item, level + 1)
-        return result
-
-    if ast.kind == NodeAST.READ:
-        result = tab + '[read]' + nl
-        for item in ast.args:
-            result += ast_to_string(item, level + 1)
-        return result
+            dumpers[node.kind](node, level + depth)
+
+def dump_stmt_seq(ast, level):
+    for item in ast.args:
+        yield item, level
+
+def dump_if(ast, level):
+    tab = '   ' * level
+    dump(tab + '[if]\n')
+    dump_expr(ast.args[0], level + 1)
+    dump(tab + '[then]\n')
+    yield ast.args[1], level + 1
+    if ast.args[2]:
+        dump(tab + '[else]\n')
+        yield ast.args[2], level + 1
+
+def dump_for(ast, level):
+    tab = '   ' * level
+    dump(tab + '[for]\n')
+    yield ast.args[0], level + 1
+    dump(tab + '[to]\n')
+    dump_expr(ast.args[1], level + 1)
+    dump(tab + '[do]\n')
+    yield ast.args[2], level + 1
+
+def dump_while(ast, level):
+    tab = '   ' * level
+    dump(tab + '[while]\n')
+    dump_expr(ast.args[0], level + 1)
+    dump(tab + '[do]\n')
+    yield ast.args[1], level + 1
+
+def dump_ass(ast, level):
+    dump('   ' * level + '[ass] -> ' + keywords[ast.args[0].type] + '\n')
+    dump_id(ast.args[0], level + 1)
+    dump_expr(ast.args[1], level + 1)
+
+def dump_write(ast, level):
+    dump('   ' * level + '[write]\n')
+    for item in ast.args:
+        dump_expr(item, level + 1)
+
+def dump_read(ast, level):
+    dump('   ' * level + '[read]\n')
+    for item in ast.args:
+        dump_id(item, level + 1)
+
+def dump_program(ast, level):
+    dump('   ' * level + '[statements]\n')
+    for item in ast.args[1]:
+        yield item, level + 1
+
+dumpers = {NodeAST.NUMBER:   dump_number,
+           NodeAST.ID:       dump_id,
+           NodeAST.BOOL:     dump_bool,
+           NodeAST.OP:       dump_op,
+           NodeAST.EXPR:     dump_expr,
+           NodeAST.STMT_SEQ: dump_stmt_seq,
+           NodeAST.IF:       dump_if,
+           NodeAST.FOR:      dump_for,
+           NodeAST.WHILE:    dump_while,
+           NodeAST.ASS:      dump_ass,
+           NodeAST.WRITE:    dump_write,
+           NodeAST.READ:     dump_read,
+           NodeAST.PROGRAM:  dump_program}
+
+# Streams the tree of a program to filename, the text is ast_to_string(ast)
+# and a newline
+def write_tree(filename, ast):
+    global dump
+    with open(filename, 'w') as handle:
+        dump = handle.write
+        mlctypes.walk(ast, dumpers, 0)
+    dump = None
 
+def ast_to_string(ast, level = 0):
+    global dump
+    lines = []
+    dump = lines.append
+    mlctypes.walk(ast, dumpers, level)
+    dump = None
+    result = ''.join(lines)
     if ast.kind == NodeAST.PROGRAM:
-        result = tab + '[statements]' + nl
-        for item in ast.args[1]:
-            result += ast_to_string(item, level + 1)
         return result.rstrip('\n')
+    return result
 
 def get_id_type(ast):
     if ast.args[0] in decls:
@@ -137,29 +172,30 @@ def verify_decl(decl):
 # Expression specification:
 # e1 [*,/,+,-] e2: e1 and e2 are numbers
 # e1 [and,or,not] e2: e1 and e2 are bools
-def verify_expr(expr):
+# Expression handlers return the type of the expression, None on errors
+def verify_id(expr):
     global errors
 
-    if expr == None:
+    expr.type = get_id_type(expr)
+    if not expr.type:
+        errors += 'Error [line ' + str(expr.line) + '] undeclared identificator \'' + ids[expr.args[0]] + '\'\n'
+    if expr.args[0] in decls and not decls[expr.args[0]][1]:
+        errors += 'Error [line ' + str(expr.line) + '] uninitialized variable \'' + ids[expr.args[0]] + '\'\n'
         return None
-    if expr.kind == NodeAST.ID:
-        expr.type = get_id_type(expr)
-        if not expr.type:
-            errors += 'Error [line ' + str(expr.line) + '] undeclared identificator \'' + ids[expr.args[0]] + '\'\n'
-        if expr.args[0] in decls and not decls[expr.args[0]][1]:
-            errors += 'Error [line ' + str(expr.line) + '] uninitialized variable \'' + ids[expr.args[0]] + '\'\n'
-            return None
-        return expr.type
-    if expr.kind == NodeAST.NUMBER:
-        expr.type = get_number_type(expr)
-        return expr.type
-    if expr.kind == NodeAST.BOOL:
-        expr.type = Token.BOOL
-        return expr.type
+    return expr.type
+
+def verify_number(expr):
+    expr.type = get_number_type(expr)
+    return expr.type
+
+def verify_bool(expr):
+    expr.type = Token.BOOL
+    return expr.type
+
+def verify_operation(expr, ltype, rtype):
+    global errors
 
     op = expr.args[0]
-    ltype = verify_expr(expr.args[1])
-    rtype = verify_expr(expr.args[2])
 
     if op.args[0] == TABLE_KEYWORD:
         if (ltype == Token.BOOL and rtype == Token.BOOL) or\
@@ -195,77 +231,101 @@ def verify_expr(expr):
 
     return expr.type
 
-def verify_stmt(stmt):
+def verify_ass(stmt):
     global errors
 
-    if stmt.kind == NodeAST.ASS:
-        ltype = get_id_type(stmt.args[0])
-        rtype = verify_expr(stmt.args[1])
-
-        if ltype == None:
-            errors += 'Error [line ' + str(stmt.line) + '] ' + 'undeclared identificator \'' + ids[stmt.args[0].args[0]] + '\'\n'
-            return
-        if rtype == None:
-            errors += 'Error [line ' + str(stmt.line) + '] ' + 'expected expression\n' 
-            return
-
-        if ltype == Token.BOOL:
-            if rtype != Token.BOOL:
-                errors += 'Error [line ' + str(stmt.line) + ']: number can not be converted to boolean\n'
-            stmt.args[0].type = Token.BOOL
-            decls[stmt.args[0].args[0]][1] = True
-            return
-
-        if rtype == Token.BOOL:
-            errors += 'Error [line ' + str(stmt.line) + ']: boolean can not be converted to number\n'
-            return
-
-        if ltype == Token.INT and rtype == Token.FLOAT:
-            stmt.args[1].type = Token.INT
-        elif ltype == Token.FLOAT and rtype == Token.INT:
-            stmt.args[1].type = Token.FLOAT
-        decls[stmt.args[0].args[0]][1] = True
+    ltype = get_id_type(stmt.args[0])
+    rtype = verify_expr(stmt.args[1])
+
+    if ltype == None:
+        errors += 'Error [line ' + str(stmt.line) + '] ' + 'undeclared identificator \'' + ids[stmt.args[0].args[0]] + '\'\n'
+        return
+    if rtype == None:
+        errors += 'Error [line ' + str(stmt.line) + '] ' + 'expected expression\n' 
         return
 
-    if stmt.kind == NodeAST.READ:
-        for var in stmt.args:
-            if not get_id_type(var):
-                errors += 'Error: undeclared identificator \'' + ids[var.args[0]] + '\'\n'
-            else:
-                decls[var.args[0]][1] = True
+    if ltype == Token.BOOL:
+        if rtype != Token.BOOL:
+            errors += 'Error [line ' + str(stmt.line) + ']: number can not be converted to boolean\n'
+        stmt.args[0].type = Token.BOOL
+        decls[stmt.args[0].args[0]][1] = True
         return
 
-    if stmt.kind == NodeAST.WRITE:
-        for expr in stmt.args:
-            verify_expr(expr)
+    if rtype == Token.BOOL:
+        errors += 'Error [line ' + str(stmt.line) + ']: boolean can not be converted to number\n'
         return
 
-    if stmt.kind == NodeAST.IF:
-        condition_type = verify_expr(stmt.args[0])
-        if not condition_type or condition_type != Token.BOOL:
-            errors += 'Error [line ' + str(stmt.args[0].line) + ']: expected boolean after \'if\''
-        verify_stmt(stmt.args[1])
-        if stmt.args[2]:
-            verify_stmt(stmt.args[2])
-
-    if stmt.kind == NodeAST.FOR:
-        verify_stmt(stmt.args[0])
-        if stmt.args[0].args[0].type == Token.BOOL:
-            errors += 'Error [line ' + str(stmt.args[0].line) + ']: counter must be a number\n'
-        verify_expr(stmt.args[1])
-        if stmt.args[1].type == Token.BOOL:
-            errors += 'Error [line ' + str(stmt.args[0].line) + ']: limit must be a number\n'
-        verify_stmt(stmt.args[2])
-
-    if stmt.kind == NodeAST.WHILE:
-        verify_expr(stmt.args[0])
-        if stmt.args[0].type != Token.BOOL:
-            errors += 'Error [line ' + str(stmt.args[0].line) + ']: expected boolean after \'while\''
-        verify_stmt(stmt.args[1])
-
-    if stmt.kind == NodeAST.STMT_SEQ:
-        for s in stmt.args:
-            verify_stmt(s)
+    if ltype == Token.INT and rtype == Token.FLOAT:
+        stmt.args[1].type = Token.INT
+    elif ltype == Token.FLOAT and rtype == Token.INT:
+        stmt.args[1].type = Token.FLOAT
+    decls[stmt.args[0].args[0]][1] = True
+
+def verify_read(stmt):
+    global errors
+
+    for var in stmt.args:
+        if not get_id_type(var):
+            errors += 'Error: undeclared identificator \'' + ids[var.args[0]] + '\'\n'
+        else:
+            decls[var.args[0]][1] = True
+
+def verify_write(stmt):
+    for expr in stmt.args:
+        verify_expr(expr)
+
+def verify_if(stmt):
+    global errors
+
+    condition_type = verify_expr(stmt.args[0])
+    if not condition_type or condition_type != Token.BOOL:
+        errors += 'Error [line ' + str(stmt.args[0].line) + ']: expected boolean after \'if\''
+    yield stmt.args[1]
+    yield stmt.args[2]
+
+def verify_for(stmt):
+    global errors
+
+    yield stmt.args[0]
+    if stmt.args[0].args[0].type == Token.BOOL:
+        errors += 'Error [line ' + str(stmt.args[0].line) + ']: counter must be a number\n'
+    verify_expr(stmt.args[1])
+    if stmt.args[1].type == Token.BOOL:
+        errors += 'Error [line ' + str(stmt.args[0].line) + ']: limit must be a number\n'
+    yield stmt.args[2]
+
+def verify_while(stmt):
+    global errors
+
+    verify_expr(stmt.args[0])
+    if stmt.args[0].type != Token.BOOL:
+        errors += 'Error [line ' + str(stmt.args[0].line) + ']: expected boolean after \'while\''
+    yield stmt.args[1]
+
+def verify_stmt_seq(stmt):
+    for s in stmt.args:
+        yield s
+
+expr_verifiers = {NodeAST.ID:     verify_id,
+                  NodeAST.NUMBER: verify_number,
+                  NodeAST.BOOL:   verify_bool,
+                  NodeAST.EXPR:   verify_operation}
+
+verifiers = {NodeAST.ASS:      verify_ass,
+             NodeAST.READ:     verify_read,
+             NodeAST.WRITE:    verify_write,
+             NodeAST.IF:       verify_if,
+             NodeAST.FOR:      verify_for,
+             NodeAST.WHILE:    verify_while,
+             NodeAST.STMT_SEQ: verify_stmt_seq}
+
+def verify_expr(expr):
+    if expr == None:
+        return None
+    return mlctypes.evaluate(expr, expr_verifiers)
+
+def verify_stmt(stmt):
+    mlctypes.walk(stmt, verifiers)
 
 def semantic():
     global decls
@@ -285,13 +345,29 @@ def decls_to_str():
         result += ids[var] + '\t' + keywords[values[0]] + '\t' + str(values[1]) + '\n'
     return result.rstrip('\n')
 
+# Resets variable values to their runtime defaults before code generation
+def init_values():
+    for key in decls:
+        if decls[key][0] == Token.BOOL:
+            decls[key][1] = False
+        else:
+            decls[key][1] = None
+
+def init_ast(parser_numbers, lexer_ids, program_ast):
+    global numbers, ids, ast, decls, errors
+    numbers = parser_numbers
+    ids = lexer_ids
+    ast = program_ast
+    decls = {}
+    errors = ''
+
 def init(lexer_filename, parser_filename):
-    global numbers, ids, ast
     with open(parser_filename, 'rb') as handle:
-        numbers, ast = pickle.load(handle)
+        parser_numbers, program_ast = pickle.load(handle)
     with open(lexer_filename, 'r') as handle:
         handle.readline()
-        ids     = handle.readline().split()
+        lexer_ids = handle.readline().split()
+    init_ast(parser_numbers, lexer_ids, program_ast)
 
 if __name__ == '__main__':
     if len(sys.argv) != 3:
@@ -310,16 +386,10 @@ if __name__ == '__main__':
         semantic()
 
         if not errors:
-            for key in decls:
-                if decls[key][0] == Token.BOOL:
-                    decls[key][1] = False
-                else:
-                    decls[key][1] = None
+            init_values()
             with open('semantic.out', 'wb') as handle:
                 pickle.dump([numbers, decls, ast.args[1]], handle)
-            with open('astext.tree', 'w') as handle:
-                handle.write(ast_to_string(ast) + '\n')
+            write_tree('astext.tree', ast)
             sys.exit(0)
         print('\n' + errors)
         sys.exit(1)
-
@@ -0,0 +1,14 @@
+program var int i, n, s float x, y bool b, c
+begin
+   /* simple arithmetic */
+   i ass 1; n ass 10; s ass 0;
+   x ass 2.5; y ass x * 2 + i;
+   write(i, n, x, y);
+   s ass 7 / 2; write(s);
+   x ass 7 / 2; write(x);
+   i ass 1Ah + 101b + 17o + 12d; write(i);
+   x ass 1.5e2 + .5; write(x);
+   b ass i < n; c ass not b or (i = n); write(b, c);
+   b ass true and false; write(b);
+   write(2 * 3 + 4, 1 - 2 - 3, 8 / 2 / 2);
+end.
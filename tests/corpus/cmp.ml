@@ -0,0 +1,13 @@
+program var int i, j float x bool b
+begin
+   i ass 3; j ass 5; x ass 3.0;
+   write(i <= j, i >= j, i <> j, i = j, i < j, i > j);
+   write(i <= x, i >= x, i <> x, i = x, x < j, x > j);
+   b ass true; write(b = true, b <> false, b = false);
+   i ass 0;
+   while i <= 3 do i ass i + 1;
+   write(i);
+   while i >= 0 do i ass i - 2;
+   write(i);
+   if i <> 5 then write(10) else write(20);
+end.
@@ -0,0 +1,14 @@
+program var int i, j float x, y bool b
+begin
+   x ass 1; write(x);
+   i ass 2.75; write(i);
+   i ass 0 - 2.75; write(i);
+   y ass i; write(y);
+   j ass i * 2.5 + 1; write(j);
+   x ass i / 4; write(x);
+   j ass x + y; write(j);
+   for x ass 1 to 3.5 do write(x);
+   for i ass 1.9 to 4 do write(i / 2);
+   write(i, x, 1 + 2.0, 5 - 5);
+   b ass 2.0 = 2; write(b);
+end.
@@ -0,0 +1,23 @@
+program var int i, j, k, n float x, y bool b, c
+begin
+   i ass 7 / 2; write(i);
+   x ass 2 * 3; write(x);
+   y ass x / 4 + i; write(y);
+   j ass (1 + 2) * (3 - 10) - 4 - 1; write(j);
+   b ass (1 < 2.0) and (not (3 = 3.0)) or true; write(b);
+   c ass (2 <> 2); write(c, not c, b and c);
+   x ass 0.0 * (0 - 1); write(x, 0.0);
+   k ass 1;
+   if b then k ass 2 else k ass 3; write(k);
+   if c then n ass 5; write(k + 1);
+   n ass 10;
+   while n > 7 do write(n * 2) : n ass n - 1;
+   write(n, i + j);
+   for k ass 0 to k + 3 do write(k, i * 2);
+   write(k);
+   j ass 1;
+   if i > 0 then j ass 1 else j ass 1; write(j + 1);
+   x ass 1.5; i ass x; write(i + 0.5);
+   write(100000000000 * 100000000000);
+   write(1 / 3, 3 - 2 - 1);
+end.
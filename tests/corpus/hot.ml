@@ -0,0 +1,6 @@
+program var int i, s, k
+begin
+   s ass 0; i ass 0;
+   while i < 200000 do i ass i + 1 : s ass s + i * 2 - 1 : k ass s / 3;
+   write(s, k);
+end.
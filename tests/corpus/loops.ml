@@ -0,0 +1,17 @@
+program var int i, j, s, n float f bool b
+begin
+   s ass 0; n ass 100;
+   for i ass 0 to n do s ass s + i;
+   write(s);
+   i ass 0;
+   while i < 5 do i ass i + 1 : write(i * i);
+   for i ass 1 to 4 do for j ass 0 to i do write(i * 10 + j);
+   f ass 0.5;
+   for f ass 0.5 to 3 do write(f);
+   b ass true;
+   if b then write(1) else write(2);
+   if i > 2 then write(3);
+   if not b then write(4) else write(5) : write(6);
+   while b do b ass false;
+   write(b);
+end.
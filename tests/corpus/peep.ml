@@ -0,0 +1,12 @@
+program var int i, s bool b, c
+begin
+   i ass 0; s ass 0; b ass false;
+   while i < 10 do i ass i + 1 : if b then s ass s + i else s ass s - 1 : b ass not b;
+   write(s, i);
+   while not (i < 5) do if i > 7 then if b then i ass i - 1 else i ass i - 2 else i ass i - 3;
+   write(i);
+   c ass true; b ass c and (i > 0);
+   if c then write(1);
+   if b or c then write(2) else write(3);
+   if (i < 2) and c then write(4) else write(5);
+end.
@@ -0,0 +1,27 @@
+program var int i, j, k, m, n, s float x, y bool b
+begin
+   n ass 0; i ass 0; m ass 1;
+   while i < 3 do i ass i + 1 : n ass n + i : if i = 2 then m ass 5;
+   write(n, i, m);
+   k ass 1;
+   if i > 2 then k ass 2; write(k);
+   k ass 1;
+   if i < 0 then k ass 9 else k ass 4; write(k);
+   k ass 1;
+   if i < 0 then write(k) else k ass k + 1; write(k);
+   s ass 0;
+   for j ass 1 to 4 do s ass s + j;
+   write(s, j);
+   n ass 2;
+   for j ass 0 to 3 do if j = 2 then n ass n * 10; write(n);
+   k ass 1;
+   while i < 0 do k ass 2; write(k);
+   for j ass 5 to 1 do k ass 3; write(k);
+   b ass true; n ass 0;
+   while b do b ass false : n ass n + 1;
+   write(b, n);
+   x ass 7; write(x, x / 2);
+   y ass x; write(y);
+   i ass 2.75; write(i, i * 2);
+   x ass 1 + 2; i ass x; write(i + x);
+end.
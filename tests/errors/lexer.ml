@@ -0,0 +1 @@
+program x	var ~ 12abc
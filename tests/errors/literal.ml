@@ -0,0 +1 @@
+program var float a begin a ass 12abc; write(a); end.
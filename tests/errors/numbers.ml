@@ -0,0 +1,5 @@
+program var int a1, b2 /* multi
+line ** comment */ float x
+begin a1 ass 1Ah+10b*17o-9d; x ass 1e+5 + 1.5E-3 + .25 + 3.; b2 ass a1<>2;/*/ a1 ass 3 */
+ x ass 1e+ ;  x ass 12.5.5; b2 ass a1<=b2>=a1 ; x ass 0ffh
+end.
@@ -0,0 +1 @@
+program var int a begin a ass ; write(a) end.
@@ -0,0 +1,6 @@
+program var int i, j float x bool b
+begin
+if false then i ass 1 : x ass 2;
+write(i);
+write(x); j ass i; write(j);
+end.
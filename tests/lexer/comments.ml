@@ -0,0 +1,5 @@
+program var int a /* one line */ float x
+/* multi
+line ** comment
+*/ begin a ass 1;/*/ a ass 3 */ a ass a*2 /**/; x ass 1.5
+/*/*/ ; write(a, x) end.
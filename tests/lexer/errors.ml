@@ -0,0 +1,4 @@
+program x	var ~ 12abc
+begin a ass 3. ; b ass 12.5.5; c ass 1e+ ; d ass 0xff; e ass 1..2
+  f ass @ # $; g ass 1Ah2 ; h ass .e5 ; k ass 9o
+end.
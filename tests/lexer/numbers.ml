@@ -0,0 +1,4 @@
+program var int a, b, c float x, y
+begin a ass 1Ah + 10b * 17o - 9d + 0ffh + 101B + 7O + 12D;
+x ass 1e+5 + 1.5E-3 + .25 + 2e3 + 1E5 - 3.14e-2 + 0.5; b ass a-1; c ass 0 ;
+end.
@@ -0,0 +1,5 @@
+program var int i, j bool b
+begin for i ass 1 to 10 do j ass (i+2)*3/4-1;
+b ass (i<=j) or (i>=j) and not (i<>j) or (i<j) = (i>j);
+while b do b ass false;if i=j then write(i) else read(j);
+end.
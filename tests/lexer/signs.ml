@@ -0,0 +1,5 @@
+program var float x, y int b
+begin y ass 1e - 2; b ass 12e+b;
+x ass 1e+ 1; x ass 2E-;
+x ass 3e+4-1
+end.
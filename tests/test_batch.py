@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+############################################
+#               Batch Mode
+############################################
+
+# The corpus directory and a source with errors are compiled in one batch,
+# every corpus program must be written to --outdir and run to its
+# name.expected, the broken one must fail the batch.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+ERRORS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'errors')
+
+def corpus():
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(CORPUS) if name.endswith('.ml'))
+
+def compile_batch(*args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), '--batch'] + list(args),
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True,
+                          timeout = 120)
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_batch(self):
+        outdir = os.path.join(self.directory, 'out')
+        result = compile_batch(CORPUS, os.path.join(ERRORS, 'parser.ml'), '-j', '2', '--outdir', outdir)
+        self.assertEqual(result.returncode, 1, result.stdout)
+        # a line per source in the order given, then the summary
+        status = [line.split()[:2] for line in result.stdout.splitlines() if not line.startswith(' ')]
+        self.assertEqual(status[:-1], [['ok', os.path.join(CORPUS, name + '.ml')] for name in corpus()] +
+                                      [['FAIL', os.path.join(ERRORS, 'parser.ml')]])
+        self.assertTrue(result.stdout.splitlines()[-1].startswith(str(len(corpus())) + ' compiled, 1 failed'))
+        self.assertIn('      Error [line 1]: expected expression after \'ass\'\n', result.stdout)
+
+        self.assertEqual(sorted(os.listdir(outdir)), sorted(name + '.out' for name in corpus()))
+        for name in corpus():
+            with self.subTest(program = name):
+                run = subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'),
+                                      os.path.join(outdir, name + '.out')],
+                                     stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                                     universal_newlines = True, timeout = 120)
+                with open(os.path.join(CORPUS, name + '.expected'), 'r') as handle:
+                    self.assertEqual(run.stdout, handle.read())
+
+    # Worker processes build the same programs as a single process
+    def test_jobs(self):
+        images = {}
+        for jobs in ('1', '2'):
+            outdir = os.path.join(self.directory, 'j' + jobs)
+            result = compile_batch(CORPUS, '-j', jobs, '--outdir', outdir)
+            self.assertEqual(result.returncode, 0, result.stdout)
+            images[jobs] = {}
+            for name in corpus():
+                with open(os.path.join(outdir, name + '.out'), 'rb') as handle:
+                    images[jobs][name] = handle.read()
+        self.assertEqual(images['1'], images['2'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+############################################
+#              Build Cache
+############################################
+
+# Compiles corpus programs with the cache enabled and checks which stages
+# hit, that the options of the final program are part of its key, that the
+# least recently used entries are evicted first and that damaged entries
+# are rebuilt. Every program built is run against its name.expected.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# Stage results of a compile: {stage: (hits, misses)}, from --cache-stats
+def cache_stats(output):
+    counts = {}
+    for line in output.splitlines():
+        if line.startswith('cache '):
+            stage, text = line[len('cache '):].split(': ')
+            hits, misses = text.split(', ')
+            counts[stage] = (int(hits.split()[0]), int(misses.split()[0]))
+    return counts
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Compiles corpus program name with the cache, checks that the program
+    # runs to its expected output and returns the cache stats
+    def build(self, name, *args):
+        program_filename = os.path.join(self.directory, name + '.out')
+        built = subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), os.path.join(CORPUS, name + '.ml'),
+                                program_filename, '--cache-dir', self.cache, '--cache-stats'] + list(args),
+                               stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        self.assertEqual(built.returncode, 0, built.stdout)
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'), program_filename],
+                                stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        with open(os.path.join(CORPUS, name + '.expected'), 'r') as handle:
+            self.assertEqual(result.stdout, handle.read())
+        return cache_stats(built.stdout)
+
+    def entries(self, stage):
+        return [os.path.join(self.cache, name) for name in os.listdir(self.cache) if name.endswith('.' + stage)]
+
+    def test_stages(self):
+        self.assertEqual(self.build('fold'), {'program': (0, 1), 'checked': (0, 1), 'ast': (0, 1), 'tokens': (0, 1)})
+        self.assertEqual(self.build('fold'), {'program': (1, 0)})
+        # another source misses again
+        self.assertEqual(self.build('arith')['program'], (0, 1))
+        # only the furthest stage reached is stored
+        self.assertEqual(len(os.listdir(self.cache)), 4)
+        self.assertEqual(len(self.entries('program')), 2)
+        self.assertEqual(len(self.entries('checked')), 2)
+
+    # The final program depends on -O and --disable, the checked AST does not
+    def test_options(self):
+        self.build('fold')
+        self.assertEqual(self.build('fold', '-O', '0'), {'program': (0, 1), 'checked': (1, 0)})
+        self.assertEqual(self.build('fold', '--disable', 'constant-propagation'),
+                         {'program': (0, 1), 'checked': (1, 0)})
+        self.assertEqual(self.build('fold', '--disable', 'constant-propagation'), {'program': (1, 0)})
+        self.assertEqual(self.build('fold', '-O', '0'), {'program': (1, 0)})
+        self.assertEqual(len(self.entries('program')), 3)
+
+    # Past the size limit the entries used longest ago go first, a hit counts
+    # as a use
+    def test_eviction(self):
+        self.build('fold')
+        program, = self.entries('program')
+        checked, = self.entries('checked')
+        past = time.time() - 1000
+        os.utime(program, (past, past))
+        os.utime(checked, (past, past))
+        # used after the fold entries, big enough to push the cache past 1 MB
+        filler = os.path.join(self.cache, 'filler.program')
+        with open(filler, 'wb') as handle:
+            handle.write(b'\0' * (1 << 20))
+        os.utime(filler, (past + 500, past + 500))
+        self.assertEqual(self.build('fold', '--cache-size', '1'), {'program': (1, 0)})
+        # a miss stores and evicts: the checked entry, then the filler go; the
+        # fold program, refreshed by its hit, stays
+        self.assertEqual(self.build('arith', '--cache-size', '1')['program'], (0, 1))
+        self.assertFalse(os.path.exists(filler))
+        self.assertFalse(os.path.exists(checked))
+        self.assertTrue(os.path.exists(program))
+        self.assertEqual(self.build('fold', '--cache-size', '1'), {'program': (1, 0)})
+
+    def test_size_zero(self):
+        self.build('fold', '--cache-size', '0')
+        self.assertEqual(os.listdir(self.cache), [])
+        self.assertEqual(self.build('fold', '--cache-size', '0')['program'], (0, 1))
+
+    # Entries are written through a temporary file and renamed; a damaged
+    # entry is a miss and is replaced
+    def test_damaged_entry(self):
+        self.build('fold')
+        self.assertEqual([name for name in os.listdir(self.cache) if name.endswith('.tmp')], [])
+        program, = self.entries('program')
+        with open(program, 'rb') as handle:
+            data = handle.read()
+        with open(program, 'wb') as handle:
+            handle.write(data[:len(data) // 2])
+        self.assertEqual(self.build('fold'), {'program': (0, 1), 'checked': (1, 0)})
+        with open(program, 'rb') as handle:
+            self.assertEqual(handle.read(), data)
+        self.assertEqual(self.build('fold'), {'program': (1, 0)})
+
+    def test_bad_directory(self):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), os.path.join(CORPUS, 'fold.ml'),
+                                 os.path.join(self.directory, 'fold.out'),
+                                 '--cache-dir', os.path.join(CORPUS, 'fold.ml')],
+                                stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, 'Error: cannot use cache directory \'' +
+                         os.path.join(CORPUS, 'fold.ml') + '\'\n')
+
+if __name__ == '__main__':
+    unittest.main()
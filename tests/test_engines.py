@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+############################################
+#          Engine Equivalence
+############################################
+
+# Every corpus program (tests/corpus/name.ml) is compiled with and without
+# the optimization passes and run on every VM engine, the output must match
+# name.expected, the output of the unoptimized compiler on the loop engine.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+LEVELS = ['0', '1']
+ENGINES = ['loop', 'table', 'jit']
+
+def corpus():
+    return sorted(os.path.splitext(name)[0] for name in os.listdir(CORPUS) if name.endswith('.ml'))
+
+def compile_program(source, program_filename, level, *args):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), source, program_filename,
+                           '-O', level] + list(args),
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True)
+
+def run_program(program_filename, engine):
+    return subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'), program_filename,
+                           '--engine', engine],
+                          stdout = subprocess.PIPE, stderr = subprocess.STDOUT, universal_newlines = True,
+                          timeout = 120)
+
+class EngineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Compiles source at every level and checks the output of every engine
+    # against expected
+    def check(self, source, expected):
+        for level in LEVELS:
+            program_filename = os.path.join(self.directory, 'O' + level + '.out')
+            built = compile_program(source, program_filename, level)
+            self.assertEqual(built.returncode, 0, built.stdout)
+            for engine in ENGINES:
+                with self.subTest(level = level, engine = engine):
+                    result = run_program(program_filename, engine)
+                    self.assertEqual(result.returncode, 0, result.stdout)
+                    self.assertEqual(result.stdout, expected)
+
+    def test_corpus(self):
+        for name in corpus():
+            with self.subTest(program = name):
+                with open(os.path.join(CORPUS, name + '.expected'), 'r') as handle:
+                    expected = handle.read()
+                self.check(os.path.join(CORPUS, name + '.ml'), expected)
+
+    # Expressions nested deeper than Python parses in one piece
+    def test_deep_expressions(self):
+        nested = 'i'
+        for k in range(300):
+            nested = '(' + nested + ' + 1)'
+        source = os.path.join(self.directory, 'deep.ml')
+        with open(source, 'w') as handle:
+            handle.write('program var int i, s bool b\nbegin\ni ass 1; b ass true;\n' +
+                         's ass ' + nested + '; write(s);\n' +
+                         's ass ' + ' + '.join(['i'] * 300) + '; write(s);\n' +
+                         'b ass ' + 'not ' * 300 + 'b; write(b);\n' +
+                         'end.\n')
+        self.check(source, '301\n300\nTrue\n')
+
+    # A failing instruction is reported with its own line on every engine,
+    # not the line of the statement it belongs to
+    def test_error_line(self):
+        source = os.path.join(self.directory, 'fault.ml')
+        with open(source, 'w') as handle:
+            handle.write('program var int i, j float x\nbegin\ni ass 0;\nj ass 5;\n'
+                         'x ass j\n / i;\nwrite(x);\nend.\n')
+        for level in LEVELS:
+            program_filename = os.path.join(self.directory, 'O' + level + '.out')
+            built = compile_program(source, program_filename, level)
+            self.assertEqual(built.returncode, 0, built.stdout)
+            for engine in ENGINES:
+                with self.subTest(level = level, engine = engine):
+                    result = run_program(program_filename, engine)
+                    self.assertEqual(result.returncode, 1)
+                    self.assertEqual(result.stdout, 'Error [line 6]: division by zero\n')
+
+if __name__ == '__main__':
+    unittest.main()
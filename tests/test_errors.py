@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+############################################
+#          Compile and Run Errors
+############################################
+
+# Every program in tests/errors (name.ml) must fail with exactly the
+# messages in name.expected: the lexer errors alone when there are any,
+# otherwise the parser or semantic errors. A program that compiles must
+# fail the same way at run time on every VM engine.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import bytecode
+
+ERRORS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'errors')
+
+ENGINES = ['loop', 'table', 'jit']
+
+class ErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_errors(self):
+        for name in sorted(os.path.splitext(name)[0] for name in os.listdir(ERRORS) if name.endswith('.ml')):
+            with self.subTest(program = name):
+                with open(os.path.join(ERRORS, name + '.expected'), 'r') as handle:
+                    expected = handle.read()
+                program_filename = os.path.join(self.directory, name + '.out')
+                result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'),
+                                         os.path.join(ERRORS, name + '.ml'), program_filename],
+                                        stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                                        universal_newlines = True)
+                if result.returncode == 0:
+                    for engine in ENGINES:
+                        with self.subTest(engine = engine):
+                            self.check_run(program_filename, engine, expected)
+                    continue
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stdout, expected)
+
+    def check_run(self, program_filename, engine, expected):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'), program_filename,
+                                 '--engine', engine],
+                                stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                                universal_newlines = True, timeout = 120)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, expected)
+
+    # A program file cut off anywhere between the version and the end of the
+    # code is rejected as truncated (the line table is only read on errors)
+    def test_truncated(self):
+        source = os.path.join(self.directory, 'program.ml')
+        with open(source, 'w') as handle:
+            handle.write('program var int abc, defgh float x\n'
+                         'begin abc ass 123456789012345678901234567890; x ass 2.5; defgh ass 3;\n'
+                         'write(abc); write(x); write(defgh); end.\n')
+        program_filename = os.path.join(self.directory, 'program.out')
+        subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), source, program_filename, '-O0'],
+                       check = True)
+        with open(program_filename, 'rb') as handle:
+            image = handle.read()
+        truncated_filename = os.path.join(self.directory, 'truncated.out')
+        end = bytecode.read_image(image)[6]
+        for size in range(6, end):
+            with self.subTest(size = size):
+                with open(truncated_filename, 'wb') as handle:
+                    handle.write(image[:size])
+                result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'), truncated_filename],
+                                        stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                                        universal_newlines = True)
+                self.assertEqual(result.returncode, 1)
+                self.assertEqual(result.stdout, 'Error: truncated program\n')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+############################################
+#          Lexer Against ./main
+############################################
+
+# The files in tests/lexer were written by the C++ lexer the Python one
+# replaces (main.cpp, 'g++ main.cpp -lboost_regex -o main', then
+# './main name.ml name.lexer.out' and its lexer.logs saved as
+# name.lexer.logs). For a source with errors ./main writes no tables and
+# prints the messages, saved as name.errors. lexer.tokenize must produce
+# the same tables, tokens and messages.
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+LEXER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lexer')
+sys.path.insert(0, ROOT)
+
+import lexer
+
+def read(filename):
+    with open(filename, 'r') as handle:
+        return handle.read()
+
+class LexerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lexer(self):
+        for name in sorted(os.path.splitext(name)[0] for name in os.listdir(LEXER) if name.endswith('.ml')):
+            with self.subTest(source = name):
+                for token in lexer.tokenize(read(os.path.join(LEXER, name + '.ml')), record = True):
+                    pass
+                golden = os.path.join(LEXER, name)
+                if os.path.exists(golden + '.errors'):
+                    self.assertEqual(lexer.errors, read(golden + '.errors'))
+                    continue
+                self.assertEqual(lexer.errors, '')
+                lexer.write_output(os.path.join(self.directory, 'lexer.out'))
+                lexer.write_logs(os.path.join(self.directory, 'lexer.logs'))
+                self.assertEqual(read(os.path.join(self.directory, 'lexer.out')), read(golden + '.lexer.out'))
+                self.assertEqual(read(os.path.join(self.directory, 'lexer.logs')), read(golden + '.lexer.logs'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import os
+import sys
+import json
+import time
+import signal
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+############################################
+#             Execution Server
+############################################
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+class ServeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.program = os.path.join(self.directory, 'arith.out')
+        subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), os.path.join(CORPUS, 'arith.ml'),
+                        self.program], stdout = subprocess.DEVNULL, check = True)
+        with open(os.path.join(CORPUS, 'arith.expected'), 'r') as handle:
+            self.expected = handle.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Runs the jobs on a server reading stdin, returns the answers by job id
+    def serve(self, jobs):
+        lines = ''.join(json.dumps(job) + '\n' for job in jobs)
+        result = subprocess.run([sys.executable, os.path.join(ROOT, 'mlvm.py'), 'serve', '--workers', '1'],
+                                input = lines, stdout = subprocess.PIPE, universal_newlines = True,
+                                timeout = 60)
+        self.assertEqual(result.returncode, 0)
+        return dict((answer['id'], answer) for answer in map(json.loads, result.stdout.splitlines()))
+
+    def test_run(self):
+        answers = self.serve([{'id': engine, 'program': self.program, 'engine': engine, 'timeout': 30}
+                              for engine in ('loop', 'table', 'jit')] +
+                             [{'id': 'limit', 'program': self.program, 'limit': 1000000}])
+        for job_id in ('loop', 'table', 'jit', 'limit'):
+            self.assertEqual(answers[job_id]['status'], 0)
+            self.assertEqual(answers[job_id]['output'], self.expected)
+
+    # Input lists are read like the text of their values, values of the
+    # wrong type are input errors of the program
+    def test_input_values(self):
+        source = os.path.join(self.directory, 'read.ml')
+        with open(source, 'w') as handle:
+            handle.write('program var int i float x bool b\nbegin\nread(i, x, b);\nwrite(i, x, b);\nend.\n')
+        program = os.path.join(self.directory, 'read.out')
+        subprocess.run([sys.executable, os.path.join(ROOT, 'mlc.py'), source, program], check = True)
+        answers = self.serve([{'id': 1, 'program': program, 'input': [7, 2, True]},
+                              {'id': 2, 'program': program, 'input': [2.9, 1.5, 0]},
+                              {'id': 4, 'program': program, 'input': [True, 1.5, True]},
+                              {'id': 5, 'program': program, 'input': [1e308 * 10, 1.5, True]},
+                              {'id': 6, 'program': program, 'input': [1, True, True]},
+                              {'id': 7, 'program': program, 'input': [1, 10 ** 400, True]},
+                              {'id': 8, 'program': program, 'input': [1, 1.5, 2]}])
+        self.assertEqual(answers[1]['output'], '7\n2.0\nTrue\n')
+        self.assertEqual(answers[2]['output'], '2\n1.5\nFalse\n')
+        errors = {4: 'invalid int input \'True\'', 5: 'invalid int input \'inf\'',
+                  6: 'invalid float input \'True\'', 7: 'invalid float input \'1' + '0' * 400 + '\'',
+                  8: 'invalid bool input \'2\''}
+        for job_id, error in errors.items():
+            self.assertEqual(answers[job_id]['status'], 1)
+            self.assertEqual(answers[job_id]['error'], error)
+            self.assertEqual(answers[job_id]['line'], 3)
+
+    # Jobs with fields of the wrong kind are answered, the server keeps going
+    def test_invalid_jobs(self):
+        jobs = [{'id': 1, 'program': self.program, 'timeout': '5'},
+                {'id': 2, 'program': self.program, 'timeout': True},
+                {'id': 3, 'program': self.program, 'timeout': -1},
+                {'id': 4, 'program': self.program, 'limit': '100'},
+                {'id': 5, 'program': self.program, 'limit': 1.5},
+                {'id': 6, 'program': self.program, 'engine': 'fast'},
+                {'id': 7, 'program': self.program, 'engine': ['jit']},
+                {'id': 8},
+                {'id': 9, 'program': self.program, 'code': ''},
+                {'id': 10, 'program': 5},
+                {'id': 11, 'code': None},
+                {'id': 12, 'program': self.program, 'input': 5},
+                {'id': 13, 'program': self.program, 'input': [1, {'a': 1}]},
+                {'id': 14, 'program': self.program, 'input': [[1]]},
+                {'id': 15, 'program': self.program, 'input': [1, 2.5, True, '']},
+                {'id': 16, 'program': self.program}]
+        answers = self.serve(jobs)
+        for job_id in range(1, 16):
+            self.assertEqual(answers[job_id]['status'], 1)
+            self.assertTrue(answers[job_id]['error'].startswith('invalid job: '), answers[job_id]['error'])
+        self.assertEqual(answers[16]['status'], 0)
+        self.assertEqual(answers[16]['output'], self.expected)
+
+    # A worker killed between jobs is replaced, the next job still runs
+    @unittest.skipUnless(os.path.isdir('/proc/self/task'), 'needs /proc')
+    def test_dead_worker(self):
+        server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'mlvm.py'), 'serve', '--workers', '1'],
+                                  stdin = subprocess.PIPE, stdout = subprocess.PIPE, universal_newlines = True)
+        try:
+            job = {'id': 1, 'program': self.program}
+            server.stdin.write(json.dumps(job) + '\n')
+            server.stdin.flush()
+            self.assertEqual(json.loads(server.stdout.readline())['output'], self.expected)
+            workers = children(server.pid)
+            self.assertEqual(len(workers), 1)
+            for pid in workers:
+                os.kill(pid, signal.SIGKILL)
+                while process_state(pid) not in ('Z', None):
+                    time.sleep(0.01)
+            job['id'] = 2
+            server.stdin.write(json.dumps(job) + '\n')
+            server.stdin.close()
+            answer = json.loads(server.stdout.readline())
+            self.assertEqual(answer['status'], 0, answer['error'])
+            self.assertEqual(answer['output'], self.expected)
+            self.assertEqual(server.wait(60), 0)
+        finally:
+            server.kill()
+            server.wait()
+            server.stdout.close()
+
+# Worker processes of the server, forked so they share its command line
+def children(pid):
+    with open('/proc/' + str(pid) + '/cmdline', 'rb') as handle:
+        command = handle.read()
+    found = []
+    for task in os.listdir('/proc/' + str(pid) + '/task'):
+        with open('/proc/' + str(pid) + '/task/' + task + '/children', 'r') as handle:
+            for child in handle.read().split():
+                with open('/proc/' + child + '/cmdline', 'rb') as child_handle:
+                    if child_handle.read() == command:
+                        found.append(int(child))
+    return found
+
+def process_state(pid):
+    try:
+        with open('/proc/' + str(pid) + '/stat', 'r') as handle:
+            return handle.read().rsplit(')', 1)[1].split()[0]
+    except FileNotFoundError:
+        return None
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import sys
+import math
+
+############################################
+#               VM Output
+############################################
+
+# WRITE appends the value to a buffer; values are formatted with str() and
+# written one per line, in bulk, once threshold values have been collected
+# and when the program halts, so the text is the same print() would give.
+# The sink is any object with write(str): sys.stdout by default, an open
+# file, or an io.StringIO when the VM is embedded.
+
+THRESHOLD = 4096
+
+# Raised by FETCH_I/FETCH_F on a number that was never assigned, with the
+# variable slot as its argument. Defined
+# here rather than in mlvm, which also runs as __main__, so the engines,
+# the translated functions and the server all raise and catch one class.
+class UndefinedValue(Exception):
+    pass
+
+class Output:
+    def __init__(self, sink = None, threshold = THRESHOLD):
+        self.sink = sink
+        self.threshold = max(threshold, 1)
+        self.buffer = []
+
+    def write(self, value):
+        self.buffer.append(value)
+        if len(self.buffer) >= self.threshold:
+            self.flush()
+
+    def flush(self):
+        sink = self.sink if self.sink is not None else sys.stdout
+        if self.buffer:
+            sink.write('\n'.join(map(str, self.buffer)) + '\n')
+            self.buffer = []
+        sink.flush()
+
+############################################
+#               VM Input
+############################################
+
+# READ_x takes the next whitespace separated value. The source is read in
+# chunks of CHUNK bytes and split all at once, there is no readline() per
+# value. Input.from_values() serves values that are already parsed, such
+# as a list built by an embedding program; the sequence is used as it is,
+# without copying or formatting it to text. Its values must be text or of
+# the type read: an int or a float for READ_I (truncated) and READ_F, a
+# bool or 0/1 for READ_B.
+
+CHUNK = 1 << 16
+
+class Input:
+    def __init__(self, source = None, chunk = CHUNK, output = None):
+        self.source = source
+        self.chunk = chunk
+        # flushed before the program waits for more input
+        self.output = output
+        self.values = []
+        self.pos = 0
+        self.rest = ''
+        self.eof = False
+
+    @classmethod
+    def from_values(cls, values):
+        data = cls()
+        data.values = values
+        data.eof = True
+        return data
+
+    def fill(self):
+        if self.output:
+            self.output.flush()
+        source = self.source if self.source is not None else sys.stdin.buffer
+        read = getattr(source, 'read1', source.read)
+        values = []
+        while not values and not self.eof:
+            text = read(self.chunk)
+            if isinstance(text, bytes):
+                text = text.decode('latin-1')
+            if not text:
+                self.eof = True
+                values = self.rest.split()
+                break
+            text = self.rest + text
+            values = text.split()
+            # a value cut at the end of the chunk continues in the next one
+            if values and not text[-1].isspace():
+                self.rest = values.pop()
+            else:
+                self.rest = ''
+        self.values = values
+        self.pos = 0
+
+    def next(self):
+        if self.pos >= len(self.values):
+            if not self.eof:
+                self.fill()
+            if self.pos >= len(self.values):
+                raise EOFError('end of input')
+        value = self.values[self.pos]
+        self.pos += 1
+        return value
+
+    def read_int(self):
+        value = self.next()
+        if type(value) is not str:
+            # a parsed value: an int, or a float that is truncated like the
+            # text of one
+            if type(value) is int:
+                return value
+            if type(value) is float and math.isfinite(value):
+                return int(value)
+            raise ValueError('invalid int input \'' + str(value) + '\'')
+        try:
+            return int(value)
+        except ValueError:
+            pass
+        try:
+            return int(float(value))
+        except (ValueError, OverflowError):
+            raise ValueError('invalid int input \'' + value + '\'')
+
+    def read_float(self):
+        value = self.next()
+        if type(value) is not str and type(value) is not int and type(value) is not float:
+            raise ValueError('invalid float input \'' + str(value) + '\'')
+        try:
+            return float(value)
+        except (ValueError, OverflowError):
+            raise ValueError('invalid float input \'' + str(value) + '\'')
+
+    def read_bool(self):
+        value = self.next()
+        if type(value) is bool:
+            return value
+        text = str(value).lower() if type(value) is str or type(value) is int else None
+        if text == 'true' or text == '1':
+            return True
+        if text == 'false' or text == '0':
+            return False
+        raise ValueError('invalid bool input \'' + str(value) + '\'')
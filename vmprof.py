@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import bytecode
+from mlctypes import OPNAMES, OPERANDS
+
+############################################
+#             Profile Report
+############################################
+
+# Turns what mlvm.run_profiled collected into a text report:
+#   [opcodes]      executions and time per opcode
+#   [instructions] the top instructions by time, as in the .S listing
+#   [loops]        taken back edges with the time spent between the jump
+#                  target and the jump, the loop body in straight code
+#   [lines]        time per source line
+# Instructions and loops show their source line when the program has a
+# line table.
+# Times include the cost of the clock calls around every instruction, so
+# they are useful to compare with each other, not as absolute numbers.
+
+TOP = 20
+
+def percent(part, total):
+    return format(100.0 * part / total if total else 0.0, '6.1f') + '%'
+
+def milliseconds(ns):
+    return format(ns / 1e6, '10.3f')
+
+def source_line(table, pc):
+    line = bytecode.line_at(table, pc)
+    return ('line ' + str(line) if line is not None else '').ljust(10)
+
+def report(profile, code, names, consts, top = TOP, table = ()):
+    hits, spent, edges = profile
+    total_hits = sum(hits)
+    total_time = sum(spent)
+    lines = ['[profile]',
+             str(total_hits) + ' instructions in ' + format(total_time / 1e9, '.3f') + 's']
+
+    op_hits = [0] * len(OPNAMES)
+    op_time = [0] * len(OPNAMES)
+    for pc, text in bytecode.disassemble(code, names, consts):
+        op_hits[code[pc]] += hits[pc]
+        op_time[code[pc]] += spent[pc]
+    lines += ['', '[opcodes]',
+              'opcode'.ljust(10) + 'count'.rjust(12) + '%'.rjust(8) + 'ms'.rjust(10) + '%'.rjust(8) + 'ns/op'.rjust(8)]
+    for op in sorted(range(len(OPNAMES)), key = lambda op: -op_time[op]):
+        if not op_hits[op]:
+            continue
+        lines.append(OPNAMES[op].ljust(10) + str(op_hits[op]).rjust(12) + percent(op_hits[op], total_hits).rjust(8) +
+                     milliseconds(op_time[op]) + percent(op_time[op], total_time).rjust(8) +
+                     str(op_time[op] // op_hits[op]).rjust(8))
+
+    listing = dict(bytecode.disassemble(code, names, consts))
+    hot = sorted((pc for pc in listing if hits[pc]), key = lambda pc: -spent[pc])[:max(top, 0)]
+    lines += ['', '[instructions]',
+              'count'.rjust(12) + 'ms'.rjust(10) + '%'.rjust(8) + '  ' + 'source'.ljust(10) + 'instruction']
+    for pc in hot:
+        lines.append(str(hits[pc]).rjust(12) + milliseconds(spent[pc]) + percent(spent[pc], total_time).rjust(8) +
+                     '  ' + source_line(table, pc) + listing[pc])
+
+    lines += ['', '[loops]',
+              'count'.rjust(12) + 'ms'.rjust(10) + '%'.rjust(8) + '  ' + 'source'.ljust(10) + 'back edge']
+    loops = []
+    for (pc, target), count in edges.items():
+        body = sum(spent[target:pc + 1 + OPERANDS[code[pc]]])
+        loops.append((body, count, pc, target))
+    for body, count, pc, target in sorted(loops, reverse = True)[:max(top, 0)]:
+        lines.append(str(count).rjust(12) + milliseconds(body) + percent(body, total_time).rjust(8) +
+                     '  ' + source_line(table, target) + str(pc) + ' -> ' + str(target) + '\t' + listing[target])
+
+    if table:
+        line_hits = {}
+        line_time = {}
+        for pc in listing:
+            line = bytecode.line_at(table, pc)
+            line_hits[line] = line_hits.get(line, 0) + hits[pc]
+            line_time[line] = line_time.get(line, 0) + spent[pc]
+        lines += ['', '[lines]',
+                  'count'.rjust(12) + 'ms'.rjust(10) + '%'.rjust(8) + '  source']
+        for line in sorted(line_time, key = lambda line: -line_time[line])[:max(top, 0)]:
+            if line_hits[line]:
+                lines.append(str(line_hits[line]).rjust(12) + milliseconds(line_time[line]) +
+                             percent(line_time[line], total_time).rjust(8) + '  line ' + str(line))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+# vim:fileencoding=utf-8
+
+import sys
+import os
+import io
+import json
+import math
+import time
+import base64
+import signal
+import socket
+import hashlib
+import argparse
+import threading
+import collections
+import multiprocessing
+from multiprocessing.connection import wait
+
+import bytecode
+import jit
+import vmio
+import mlvm
+
+############################################
+#             Execution Server
+############################################
+
+# mlvm serve keeps a pool of worker processes with the VM loaded. Jobs are
+# JSON lines read from stdin or from clients of a Unix socket:
+#
+#   {"id": any, "program": "file" | "code": "base64 image",
+#    "input": "text" | [values], "engine": "loop|table|jit",
+#    "timeout": seconds, "limit": instructions}
+#
+# and every job is answered on the line it came from with
+#
+#   {"id": any, "status": 0 | 1, "output": "text", "error": "message",
+#    "line": source line of a run time error, if the program has a line table}
+#
+# Workers keep loaded programs by the hash of their image. A job running
+# past its timeout gets its worker killed and replaced; a worker found dead
+# when a job is handed to it is replaced and the job goes to the new one. A
+# job with an instruction limit runs on the counting engine. A job without
+# exactly one of program and code, or with a field of the wrong kind, is
+# answered with 'invalid job: ...' without running.
+
+PROGRAMS = 256
+
+############################################
+#                 Worker
+############################################
+
+# {image hash: [types, names, consts, code, stack size, jit function or None, image]}
+programs = collections.OrderedDict()
+
+def load_program(job):
+    if 'program' in job:
+        with open(job['program'], 'rb') as handle:
+            image = handle.read()
+    else:
+        image = base64.b64decode(job['code'])
+    key = hashlib.sha256(image).digest()
+    loaded = programs.get(key)
+    if loaded is None:
+        loaded = programs[key] = list(bytecode.loads(image)) + [None, image]
+        if len(programs) > PROGRAMS:
+            programs.popitem(last = False)
+    else:
+        programs.move_to_end(key)
+    return loaded
+
+def run_job(job, engine, limit):
+    sink = io.StringIO()
+    status = 0
+    error = ''
+    line = None
+    loaded = None
+    mlvm.jitted = None
+    try:
+        loaded = load_program(job)
+        mlvm.types, mlvm.names, mlvm.consts, mlvm.program, mlvm.stack_size = loaded[:5]
+        mlvm.init_values()
+        mlvm.output = vmio.Output(sink)
+        data = job.get('input', '')
+        if isinstance(data, str):
+            mlvm.reader = vmio.Input(io.StringIO(data))
+        else:
+            mlvm.reader = vmio.Input.from_values(data)
+
+        engine = job.get('engine', engine)
+        limit = job.get('limit', limit)
+        if limit:
+            mlvm.run_counted(limit)
+        elif engine == 'jit':
+            if loaded[5] is None:
+                loaded[5] = jit.build(mlvm.program, mlvm.consts, mlvm.types)
+            mlvm.jitted = loaded[5]
+            mlvm.jitted(mlvm.values, mlvm.consts, mlvm.output.write, mlvm.reader)
+        else:
+            mlvm.engines[engine]()
+    except mlvm.RUNTIME_ERRORS as exception:
+        status = 1
+        error = mlvm.error_message(exception)
+        if loaded:
+            line = bytecode.line_at(bytecode.loads_lines(loaded[6]), mlvm.fault_pc(exception))
+    except (OSError, RuntimeError) as exception:
+        status = 1
+        error = str(exception)
+    except Exception as exception:
+        status = 1
+        error = type(exception).__name__ + ': ' + str(exception)
+    try:
+        mlvm.output.flush()
+    except Exception:
+        pass
+    result = {'id': job.get('id'), 'status': status, 'output': sink.getvalue(), 'error': error}
+    if line is not None:
+        result['line'] = line
+    return result
+
+def worker(connection, engine, limit):
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        connection.send(run_job(job, engine, limit))
+
+############################################
+#                 Server
+############################################
+
+# Jobs arrive from reader threads as (reply, line), the main loop hands them
+# to idle workers. A reader thread writes to wakeup so the main loop, which
+# waits on the worker pipes, notices new jobs.
+jobs = collections.deque()
+jobs_lock = threading.Lock()
+wakeup = None
+finished = False
+
+def submit(reply, line):
+    with jobs_lock:
+        jobs.append((reply, line))
+    os.write(wakeup, b'.')
+
+def read_stdin():
+    global finished
+    reply = lambda text: (sys.stdout.write(text), sys.stdout.flush())
+    # a forked worker closes sys.stdin, which would wait forever on the
+    # buffer lock this thread holds while reading; use a file of our own
+    with open(sys.stdin.fileno(), 'r', encoding = 'utf-8', closefd = False) as lines:
+        for line in lines:
+            if line.strip():
+                submit(reply, line)
+    finished = True
+    os.write(wakeup, b'.')
+
+def read_client(client):
+    lock = threading.Lock()
+    def reply(text):
+        with lock:
+            try:
+                client.sendall(text.encode('utf-8'))
+            except OSError:
+                pass
+    with client, client.makefile('r', encoding = 'utf-8') as lines:
+        for line in lines:
+            if line.strip():
+                submit(reply, line)
+
+def accept_clients(server):
+    while True:
+        client, address = server.accept()
+        threading.Thread(target = read_client, args = (client,), daemon = True).start()
+
+# Raises ValueError if the job cannot be handed to a worker
+def check_job(job):
+    if not isinstance(job, dict):
+        raise ValueError('a job is a JSON object')
+    if ('program' in job) == ('code' in job):
+        raise ValueError('a job has either a program file or code')
+    if not isinstance(job.get('program', job.get('code')), str):
+        raise ValueError('program is a file name and code a base64 image')
+    data = job.get('input', '')
+    if not isinstance(data, (str, list)) or \
+       isinstance(data, list) and any(type(value) not in (int, float, bool) for value in data):
+        raise ValueError('input is text or a list of numbers and booleans')
+    seconds = job.get('timeout', 0)
+    if isinstance(seconds, bool) or not isinstance(seconds, (int, float)) or \
+       not math.isfinite(seconds) or seconds < 0:
+        raise ValueError('timeout is a number of seconds, 0 for none')
+    limit = job.get('limit', 0)
+    if isinstance(limit, bool) or not isinstance(limit, int) or limit < 0:
+        raise ValueError('limit is a number of instructions, 0 for none')
+    engine = job.get('engine', 'loop')
+    if not isinstance(engine, str) or engine not in mlvm.engines:
+        raise ValueError('engine is one of ' + ', '.join(sorted(mlvm.engines)))
+
+def answer(reply, result):
+    reply(json.dumps(result) + '\n')
+
+class Worker:
+    def __init__(self, engine, limit):
+        self.connection, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = worker, args = (child, engine, limit), daemon = True)
+        self.process.start()
+        child.close()
+        # (reply, job id, deadline) of the running job
+        self.job = None
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+def serve(workers, engine, timeout, limit, path):
+    global wakeup
+    wake_read, wakeup = os.pipe()
+    if path:
+        if os.path.exists(path):
+            os.remove(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen()
+        threading.Thread(target = accept_clients, args = (server,), daemon = True).start()
+    else:
+        threading.Thread(target = read_stdin, daemon = True).start()
+
+    pool = [Worker(engine, limit) for i in range(workers)]
+    try:
+        while True:
+            idle = [w for w in pool if not w.job]
+            while idle:
+                with jobs_lock:
+                    if not jobs:
+                        break
+                    reply, line = jobs.popleft()
+                job = None
+                try:
+                    job = json.loads(line)
+                    check_job(job)
+                except ValueError as error:
+                    job_id = job.get('id') if isinstance(job, dict) else None
+                    answer(reply, {'id': job_id, 'status': 1, 'output': '', 'error': 'invalid job: ' + str(error)})
+                    continue
+                w = idle.pop()
+                try:
+                    w.connection.send(job)
+                except OSError:
+                    # the worker died while idle, the job goes to a new one
+                    i = pool.index(w)
+                    w.kill()
+                    w = pool[i] = Worker(engine, limit)
+                    try:
+                        w.connection.send(job)
+                    except OSError:
+                        answer(reply, {'id': job.get('id'), 'status': 1, 'output': '', 'error': 'worker exited'})
+                        continue
+                seconds = job.get('timeout', timeout)
+                w.job = (reply, job.get('id'), time.monotonic() + seconds if seconds else None)
+
+            busy = [w for w in pool if w.job]
+            if finished and not busy and not jobs:
+                break
+            deadlines = [w.job[2] for w in busy if w.job[2] is not None]
+            delay = max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+            ready = wait([wake_read] + [w.connection for w in busy], delay)
+
+            if wake_read in ready:
+                os.read(wake_read, 4096)
+            for i in range(len(pool)):
+                w = pool[i]
+                if not w.job:
+                    continue
+                reply, job_id, deadline = w.job
+                if w.connection in ready:
+                    try:
+                        answer(reply, w.connection.recv())
+                        w.job = None
+                        continue
+                    except (EOFError, OSError):
+                        error = 'worker exited'
+                elif deadline is not None and time.monotonic() >= deadline:
+                    error = 'timeout'
+                else:
+                    continue
+                answer(reply, {'id': job_id, 'status': 1, 'output': '', 'error': error})
+                w.kill()
+                pool[i] = Worker(engine, limit)
+    finally:
+        for w in pool:
+            w.stop()
+        if path and os.path.exists(path):
+            os.remove(path)
+
+def main(argv):
+    argparser = argparse.ArgumentParser(prog = 'mlvm serve', description = 'Run jobs on a pool of VM workers')
+    argparser.add_argument('--socket', metavar = 'PATH',
+                           help = 'accept jobs from clients of a Unix socket instead of stdin')
+    argparser.add_argument('--workers', type = int, default = os.cpu_count() or 1, metavar = 'N',
+                           help = 'worker processes (default: one per core)')
+    argparser.add_argument('--engine', choices = sorted(mlvm.engines), default = 'loop',
+                           help = 'engine of jobs that do not choose one')
+    argparser.add_argument('--timeout', type = float, default = 10, metavar = 'SECONDS',
+                           help = 'default time limit of a job, 0 for none (default 10)')
+    argparser.add_argument('--limit', type = int, default = 0, metavar = 'N',
+                           help = 'default instruction limit of a job, 0 for none')
+    args = argparser.parse_args(argv)
+    # leave through the cleanup of serve() on kill as on ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        serve(max(args.workers, 1), args.engine, args.timeout, args.limit, args.socket)
+    except KeyboardInterrupt:
+        pass